@@ -0,0 +1,241 @@
+"""
+Change data capture: events for the apps that changed since the last run.
+
+``ChangeIndex`` keeps a compact on-disk record of the last snapshot, so
+memory stays flat however large the catalog is. It holds one row per app
+id with an 8-byte hash of every field and the last run whose sitemap listed
+the app. Each scraped app is compared against its row, which produces one
+of three events:
+
+- ``insert``: a new app, with all its fields
+- ``update``: a changed app, with only the fields that changed
+- nothing, for an unchanged app
+
+Apps the sitemap no longer lists are found when a run finishes and produce
+``delete`` events.
+
+Events are appended to a JSON lines file, which is flushed to disk before
+every index commit. A killed crawl can therefore repeat events, but never
+lose them. Replaying events is idempotent. ``rebuild`` (``python -m
+appstore_scraper.cdc``) rebuilds a full snapshot from a baseline plus the
+event files written since.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from appstore_scraper.utils import app_id_from_url
+
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+
+HASH_SIZE = 8
+
+# Sent by the spider for every app listed in the sitemap (args: app_id)
+app_listed = object()
+
+
+def field_hash(value):
+    """Return a short, stable binary hash of a field value."""
+    data = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=HASH_SIZE).digest()
+
+
+class ChangeIndex:
+    """Per-app field hashes of the last snapshot, and the sitemap runs that listed each app."""
+
+    def __init__(self, path, commit_interval=1000, before_commit=None):
+        self.path = path
+        self.commit_interval = commit_interval
+        # Called before every commit, to get the events of the committed changes on disk first
+        self.before_commit = before_commit
+        self._pending = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS apps ('
+            ' app_id INTEGER PRIMARY KEY,'
+            ' hashes BLOB,'
+            ' listed_run INTEGER)'
+        )
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        meta = dict(self.conn.execute('SELECT key, value FROM meta'))
+        # The run only advances once a crawl finishes, so paused, resumed or
+        # killed crawls keep adding to the same run
+        self.run = int(meta.get('run', 1))
+        # Hashes are stored in this order; fields seen for the first time are appended
+        self.fields = json.loads(meta.get('fields', '[]'))
+        self._positions = {field: i for i, field in enumerate(self.fields)}
+
+    def compare(self, app_id, values):
+        """
+        Record an app's current fields and return its event type and changed fields.
+
+        Returns ``(INSERT, values)``, ``(UPDATE, changed)`` or ``(None, {})``.
+        """
+        hashes = {field: field_hash(value) for field, value in values.items()}
+        for field in hashes:
+            if field not in self._positions:
+                self._positions[field] = len(self.fields)
+                self.fields.append(field)
+                self._save_meta('fields', json.dumps(self.fields))
+        row = self.conn.execute('SELECT hashes FROM apps WHERE app_id = ?', (app_id,)).fetchone()
+        if row is None:
+            event, changed = INSERT, values
+        else:
+            old = row[0]
+            changed = {}
+            for field, digest in hashes.items():
+                start = self._positions[field] * HASH_SIZE
+                if old[start:start + HASH_SIZE] != digest:
+                    changed[field] = values[field]
+            event = UPDATE if changed else None
+        blob = b''.join(hashes.get(field, b'\0' * HASH_SIZE) for field in self.fields)
+        self.conn.execute(
+            'INSERT INTO apps (app_id, hashes, listed_run) VALUES (?, ?, ?)'
+            ' ON CONFLICT (app_id) DO UPDATE SET hashes = excluded.hashes, listed_run = excluded.listed_run',
+            (app_id, blob, self.run),
+        )
+        self._changed()
+        return event, changed
+
+    def listed(self, app_id):
+        """Mark an app as listed in the current run's sitemap."""
+        self.conn.execute('UPDATE apps SET listed_run = ? WHERE app_id = ?', (self.run, app_id))
+        self._changed()
+
+    def size(self):
+        return self.conn.execute('SELECT COUNT(*) FROM apps').fetchone()[0]
+
+    def unlisted(self):
+        """Return the ids of the indexed apps the current run's sitemap didn't list."""
+        return [row[0] for row in self.conn.execute('SELECT app_id FROM apps WHERE listed_run < ?', (self.run,))]
+
+    def finish_run(self, deleted):
+        """Drop the deleted apps and start the next run."""
+        self.conn.executemany('DELETE FROM apps WHERE app_id = ?', ((app_id,) for app_id in deleted))
+        self.run += 1
+        self._save_meta('run', str(self.run))
+        self.commit()
+
+    def _save_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def _changed(self):
+        self._pending += 1
+        if self.commit_interval and self._pending >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        if self.before_commit is not None:
+            self.before_commit()
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+class EventWriter:
+    """Appends change events to a JSON lines file."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, op, app_id, run, fields=None):
+        event = {'op': op, 'app_id': app_id, 'run': run, 'time': round(time.time(), 3)}
+        if fields:
+            event['fields'] = fields
+        line = json.dumps(event, ensure_ascii=False, default=str) + '\n'
+        self.file.write(line)
+        return len(line)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+def read_records(path):
+    """Yield the records of a JSON lines or JSON array file."""
+    with open(path, encoding='utf-8') as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == '[':
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def rebuild(baseline, event_paths, output):
+    """
+    Write the snapshot ``baseline`` turns into after the events in ``event_paths``.
+
+    ``baseline`` is a full feed (JSON lines or JSON) or an earlier rebuilt
+    snapshot, and may be None to start from nothing. The snapshot is kept
+    in a temporary SQLite database, so memory stays flat. Returns the number
+    of apps written.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'snapshot.sqlite3'))
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('CREATE TABLE apps (app_id INTEGER PRIMARY KEY, data TEXT)')
+        if baseline:
+            for record in read_records(baseline):
+                app_id = app_id_from_url(record.get('url') or '')
+                if app_id is not None:
+                    conn.execute('INSERT OR REPLACE INTO apps VALUES (?, ?)', (app_id, json.dumps(record)))
+        for path in event_paths:
+            for event in read_records(path):
+                app_id = event['app_id']
+                if event['op'] == DELETE:
+                    conn.execute('DELETE FROM apps WHERE app_id = ?', (app_id,))
+                    continue
+                record = {}
+                if event['op'] == UPDATE:
+                    row = conn.execute('SELECT data FROM apps WHERE app_id = ?', (app_id,)).fetchone()
+                    if row is not None:
+                        record = json.loads(row[0])
+                record.update(event.get('fields', {}))
+                conn.execute('INSERT OR REPLACE INTO apps VALUES (?, ?)', (app_id, json.dumps(record)))
+
+        count = 0
+        with open(output, 'w', encoding='utf-8') as f:
+            for (data,) in conn.execute('SELECT data FROM apps ORDER BY app_id'):
+                f.write(json.dumps(json.loads(data), ensure_ascii=False) + '\n')
+                count += 1
+        conn.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild a full snapshot of the apps from a baseline and change events')
+    parser.add_argument('events', nargs='+', help='Change event files (JSON lines), oldest first')
+    parser.add_argument('--baseline', help='Full output (JSON lines or JSON) or snapshot the events apply to')
+    parser.add_argument('--output', required=True, help='Snapshot file to write (JSON lines)')
+    args = parser.parse_args()
+    count = rebuild(args.baseline, args.events, args.output)
+    print(f"Wrote {count} apps to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+"""
+Periodic crash-safe checkpoints of JOBDIR crawls.
+
+A paused crawl saves its state as the spider closes: pending requests,
+dupefilter, ``spider.state`` and the other files in the job directory. A
+crawl that is killed (``kill -9``, out of memory, a crash) never gets there,
+so resuming it downloads and exports again whatever it did since it was
+last paused.
+
+``CheckpointExtension`` snapshots the crawl every ``CHECKPOINT_INTERVAL``
+seconds and every ``CHECKPOINT_ITEMS`` items, and commits the snapshot in
+the same SQLite transaction as the request queue (see
+``appstore_scraper.squeues``). A checkpoint holds:
+
+* the requests in progress, which are scheduled again on recovery
+* the job files returned by receivers of the ``checkpoint_saving`` signal
+  (dupefilter, storefront batches), ``spider.state`` and the scheduler's
+  list of active queues
+* the size of every local feed file, flushed and synced to disk first.
+  Feeds that can't be cut back to a size (Parquet, post-processed or remote
+  feeds) are closed and continue in a new batch file instead, which needs a
+  ``%(batch_time)s`` or ``%(batch_id)d`` in the feed URI. Single-file JSON
+  and XML feeds are neither, and are left alone.
+
+FeedExporter has no public API for any of this, so ``FeedBatches`` wraps the
+internals used, for the Scrapy versions they are known to work with.
+
+The queue isn't committed between checkpoints, so when the crawl is opened
+after a hard kill, the job files and feeds are put back to where the queue
+is: at most one checkpoint interval of work is done again, and no item is
+exported twice or cut short. A crawl that closes normally (including a
+pause) drops its checkpoint.
+"""
+
+import inspect
+import json
+import logging
+import os
+import pickle
+import time
+from weakref import WeakKeyDictionary
+
+import scrapy
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.extensions.feedexport import FeedExporter, FileFeedStorage
+from scrapy.pqueues import ScrapyPriorityQueue
+from scrapy.utils.job import job_dir
+from scrapy.utils.misc import load_object
+from scrapy.utils.request import request_from_dict
+from twisted.internet import task
+
+from appstore_scraper.squeues import SqliteLifoDiskQueue, SqliteQueueStore, read_checkpoint
+
+logger = logging.getLogger(__name__)
+
+# Sent before every checkpoint with the spider; receivers may return a dict
+# mapping file names in the job directory to their contents (bytes)
+checkpoint_saving = object()
+
+QUEUE_DIR = 'requests.queue'
+SPIDER_STATE_FILE = 'spider.state'
+
+# Seconds to wait between attempts while a response is still exporting its items
+BUSY_RETRY_DELAY = 0.01
+
+
+def write_file(path, content):
+    """Replace a file with new contents, atomically and synced to disk."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def fsync_path(path):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+class FeedBatches:
+    """
+    The open feed files of a crawl's FeedExporter, and starting new batch files.
+
+    FeedExporter has no public API for either: this reads its ``slots`` and
+    calls the private methods it uses itself for FEED_EXPORT_BATCH_ITEM_COUNT.
+    Starting new batch files is only supported with the Scrapy versions in
+    ``VERSIONS``, which have those methods with the parameters in ``METHODS``.
+    """
+
+    METHODS = {
+        '_get_uri_params': ('spider', 'uri_params_function', 'slot'),
+        '_close_slot': ('slot', 'spider'),
+        '_start_new_batch': ('batch_id', 'uri', 'feed_options', 'spider', 'uri_template'),
+    }
+    VERSIONS = ((2, 6), (2, 12))
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self.rotation = self.rotation_supported()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """Return the feed batches of a crawler, or None if it exports no feeds."""
+        exporter = next((ext for ext in crawler.extensions.middlewares if isinstance(ext, FeedExporter)), None)
+        return cls(exporter) if exporter is not None else None
+
+    @classmethod
+    def rotation_supported(cls):
+        """Return whether ``rotate`` works with the installed Scrapy."""
+        low, high = cls.VERSIONS
+        if not low <= scrapy.version_info[:2] < high:
+            return False
+        for name, params in cls.METHODS.items():
+            method = getattr(FeedExporter, name, None)
+            if not callable(method) or tuple(inspect.signature(method).parameters)[1:] != params:
+                return False
+        return True
+
+    @property
+    def slots(self):
+        return list(self.exporter.slots)
+
+    @slots.setter
+    def slots(self, slots):
+        self.exporter.slots = slots
+
+    def rotate(self, slot, spider):
+        """Close a feed batch and return the slot of the next one."""
+        options = self.exporter.feeds[slot.uri_template]
+        uri_params = self.exporter._get_uri_params(spider, options['uri_params'], slot)
+        self.exporter._close_slot(slot, spider)
+        if isinstance(slot.storage, FileFeedStorage) and os.path.exists(slot.storage.path):
+            fsync_path(slot.storage.path)
+        return self.exporter._start_new_batch(
+            batch_id=slot.batch_id + 1,
+            uri=slot.uri_template % uri_params,
+            feed_options=options,
+            spider=spider,
+            uri_template=slot.uri_template,
+        )
+
+
+class CheckpointExtension:
+    """Takes periodic checkpoints of a JOBDIR crawl and recovers from the last one after a hard kill."""
+
+    def __init__(self, crawler, jobdir, interval=30, items=0, max_delay=5):
+        self.crawler = crawler
+        self.jobdir = jobdir
+        self.queue_dir = os.path.join(jobdir, QUEUE_DIR)
+        self.interval = interval
+        self.items = items
+        self.max_delay = max_delay
+        self.seq = 0
+        self.store = None
+        self.feeds = None
+        self.task = None
+        self._call = None
+        self._busy_since = None
+        self._items_since = 0
+        self._first_item = False
+        # Items exported so far for each request still in progress
+        self.exported = WeakKeyDictionary()
+        self.started = time.perf_counter()
+        self.requeue = []
+        self.recovery = self.recover()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        jobdir = job_dir(settings)
+        if not settings.getbool('CHECKPOINT_ENABLED') or not jobdir:
+            raise NotConfigured
+        queue_cls = load_object(settings['SCHEDULER_DISK_QUEUE'])
+        pqueue_cls = load_object(settings['SCHEDULER_PRIORITY_QUEUE'])
+        if not issubclass(queue_cls, SqliteLifoDiskQueue) or not issubclass(pqueue_cls, ScrapyPriorityQueue):
+            logger.warning(
+                "Checkpoints need SCHEDULER_DISK_QUEUE set to an SQLite queue from appstore_scraper.squeues "
+                "and the default SCHEDULER_PRIORITY_QUEUE; crawling without checkpoints"
+            )
+            raise NotConfigured
+        ext = cls(
+            crawler, jobdir, settings.getfloat('CHECKPOINT_INTERVAL', 30), settings.getint('CHECKPOINT_ITEMS'),
+            settings.getfloat('CHECKPOINT_MAX_DELAY', 5),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        return ext
+
+    def recover(self):
+        """Put the job directory and the feeds back to the last checkpoint, if the crawl didn't close normally."""
+        checkpoint = read_checkpoint(self.queue_dir)
+        if checkpoint is None:
+            return None
+        started = time.perf_counter()
+        manifest, files, self.requeue = checkpoint
+        for name, content in files.items():
+            write_file(os.path.join(self.jobdir, name), content)
+        truncated = 0
+        for path, size in manifest['feeds'].items():
+            if not os.path.exists(path):
+                continue
+            current = os.path.getsize(path)
+            if not size:
+                # Started after the checkpoint; a partial Parquet file isn't readable at all
+                os.remove(path)
+                truncated += current
+            elif current > size:
+                os.truncate(path, size)
+                truncated += current - size
+        self.seq = manifest['seq']
+        return {
+            'seq': manifest['seq'],
+            'age': time.time() - manifest['created'],
+            'items': manifest['items'],
+            'requests': len(self.requeue),
+            'feed_bytes_truncated': truncated,
+            'time': time.perf_counter() - started,
+        }
+
+    def spider_opened(self, spider):
+        # Opened here so that the store closes after spider_closed has dropped the checkpoint
+        self.store = SqliteQueueStore.open(self.crawler, self.queue_dir)
+        self.feeds = FeedBatches.from_crawler(self.crawler)
+        for slot in self._feed_slots():
+            if self._truncatable(slot) or self._rotatable(slot):
+                continue
+            if not self.feeds.rotation and self._batched(slot):
+                logger.warning(
+                    "Feed %s can't be checkpointed: starting a new batch file isn't supported with "
+                    "Scrapy %s; use a local jsonlines or csv feed", slot.uri_template, scrapy.__version__,
+                )
+            else:
+                logger.warning(
+                    "Feed %s can't be checkpointed: add %%(batch_time)s to its URI, or use a local "
+                    "jsonlines or csv feed", slot.uri_template,
+                )
+        if self.recovery is not None:
+            self._recovered(spider)
+        self.task = task.LoopingCall(self.checkpoint)
+        self.task.start(self.interval, now=False)
+
+    def _recovered(self, spider):
+        stats = self.crawler.stats
+        for request_dict in self.requeue:
+            # Already in the dupefilter, which is back at the checkpoint as well
+            request_dict['dont_filter'] = True
+            self.crawler.engine.crawl(request_from_dict(request_dict, spider=spider))
+        stats.set_value('checkpoint/recovered_seq', self.recovery['seq'])
+        stats.set_value('checkpoint/recovered_requests', self.recovery['requests'])
+        stats.set_value('checkpoint/feed_bytes_truncated', self.recovery['feed_bytes_truncated'])
+        stats.set_value('checkpoint/recovery_time', round(self.recovery['time'], 4))
+        logger.info(
+            "Recovered from checkpoint %(seq)d taken %(age).0fs ago "
+            "(%(items)d items): scheduled %(requests)d requests again and dropped "
+            "%(feed_bytes_truncated)d feed bytes in %(time).3fs",
+            self.recovery, extra={'spider': spider},
+        )
+        self.requeue = []
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        # Everything is saved the regular way from here on; the store commits on close
+        if self.store is not None:
+            self.store.clear_checkpoint()
+
+    def item_scraped(self, item, response, spider):
+        request = getattr(response, 'request', None)
+        if request is not None:
+            self.exported[request] = self.exported.get(request, 0) + 1
+        if not self._first_item:
+            self._first_item = True
+            if self.recovery is not None:
+                self.crawler.stats.set_value('checkpoint/resume_time', round(time.perf_counter() - self.started, 4))
+        self._items_since += 1
+        if self.items and self._items_since >= self.items and self._call is None:
+            from twisted.internet import reactor
+            # Not from inside the item's own signal handlers
+            self._call = reactor.callLater(0, self.checkpoint)
+
+    def checkpoint(self):
+        """Commit a checkpoint, unless a response is still exporting items."""
+        self._call = None
+        engine = self.crawler.engine
+        if engine is None or engine.slot is None or engine.slot.closing:
+            return
+        inprogress = list(engine.slot.inprogress)
+        if any(self.exported.get(request) for request in inprogress):
+            # Those items would be exported again when the request is, so wait for it to finish
+            now = time.monotonic()
+            if self._busy_since is None:
+                self._busy_since = now
+            if now - self._busy_since < self.max_delay:
+                from twisted.internet import reactor
+                self._call = reactor.callLater(BUSY_RETRY_DELAY, self.checkpoint)
+            else:
+                self._busy_since = None
+                self.crawler.stats.inc_value('checkpoint/skipped')
+            return
+        self._busy_since = None
+        self._save(engine, inprogress)
+
+    def _save(self, engine, inprogress):
+        started = time.perf_counter()
+        spider = engine.spider
+        files = {}
+        for _, result in self.crawler.signals.send_catch_log(checkpoint_saving, spider=spider):
+            if isinstance(result, dict):
+                files.update(result)
+        state = getattr(spider, 'state', None)
+        if state is not None:
+            files[SPIDER_STATE_FILE] = pickle.dumps(state, protocol=4)
+        dqs = getattr(engine.slot.scheduler, 'dqs', None)
+        files[os.path.join(QUEUE_DIR, 'active.json')] = json.dumps(list(dqs.queues) if dqs is not None else []).encode()
+
+        requests = []
+        for request in inprogress:
+            try:
+                requests.append(request.to_dict(spider=spider))
+            except ValueError:
+                # Not a crawl request (e.g. robots.txt), it is made again when needed
+                pass
+
+        self.seq += 1
+        manifest = {
+            'seq': self.seq,
+            'created': time.time(),
+            'items': self.crawler.stats.get_value('item_scraped_count', 0),
+            'requests': len(requests),
+            'feeds': self._sync_feeds(spider),
+        }
+        self.store.save_checkpoint(manifest, files, requests)
+        self._items_since = 0
+
+        elapsed = time.perf_counter() - started
+        stats = self.crawler.stats
+        stats.inc_value('checkpoint/count')
+        stats.inc_value('checkpoint/time', elapsed)
+        stats.max_value('checkpoint/max_time', round(elapsed, 4))
+        stats.set_value('checkpoint/requests', len(requests))
+        stats.set_value('checkpoint/files_bytes', sum(len(content) for content in files.values()))
+
+    def _feed_slots(self):
+        return self.feeds.slots if self.feeds is not None else []
+
+    def _truncatable(self, slot):
+        # JSON and XML feeds only become valid once closed, so a cut-back file can't be appended to
+        return (
+            slot.format not in ('json', 'xml')
+            and isinstance(slot.storage, FileFeedStorage)
+            and not slot.feed_options.get('postprocessing')
+            and getattr(slot.exporters[slot.format], 'truncatable', True)
+        )
+
+    def _batched(self, slot):
+        return '%(batch_time)s' in slot.uri_template or '%(batch_id)' in slot.uri_template
+
+    def _rotatable(self, slot):
+        return self.feeds.rotation and self._batched(slot)
+
+    def _sync_feeds(self, spider):
+        """Flush the feeds to disk and return the size to cut every local feed file back to."""
+        feeds = {}
+        slots = []
+        for slot in self._feed_slots():
+            if self._truncatable(slot):
+                if slot.file is not None:
+                    stream = getattr(slot.exporter, 'stream', None)
+                    if stream is not None:
+                        stream.flush()
+                    slot.file.flush()
+                    os.fsync(slot.file.fileno())
+                path = os.path.abspath(slot.storage.path)
+                feeds[path] = os.path.getsize(path) if os.path.exists(path) else 0
+            elif self._rotatable(slot):
+                if slot.itemcount:
+                    slot = self.feeds.rotate(slot, spider)
+                if isinstance(slot.storage, FileFeedStorage):
+                    # Whatever this batch file holds by the next hard kill is dropped
+                    feeds[os.path.abspath(slot.storage.path)] = 0
+            slots.append(slot)
+        if self.feeds is not None:
+            self.feeds.slots = slots
+        return feeds
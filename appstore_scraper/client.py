@@ -0,0 +1,288 @@
+"""
+On-demand lookups of single apps, for services that can't wait for a crawl.
+
+``AppClient`` is an asyncio API that fetches the App Store page of one app by
+id and parses it with the same extraction as ``AppsSpider.parse``
+(``parsing.parse_app_page``). Pages are downloaded by a ``requests`` session
+whose keep-alive connection pool is sized to the number of concurrent
+downloads, running on a thread pool of the same size.
+
+Concurrent lookups of the same id share one download. Parsed apps are kept in
+a bounded cache that evicts the least recently used app, and an app older than
+the TTL is fetched again. Lookup latency (p50/p99), cache hit rate and
+coalesced lookups are kept in a ``Metrics`` instance, as for crawls.
+
+``python -m appstore_scraper.client`` serves the same lookups over HTTP:
+``GET /apps/<id>`` returns the app as JSON, ``/stats`` the client's stats and
+``/metrics`` the metrics in the Prometheus text format.
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from itemadapter import ItemAdapter
+
+from appstore_scraper.items import App, register_adapter, select_fields
+from appstore_scraper.metrics import LATENCY_BUCKETS, Histogram, Metrics
+from appstore_scraper.parsing import BASE_URL, parse_app_page
+
+# Cache hits take microseconds, so lookups get finer buckets than crawl stages
+LOOKUP_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005) + LATENCY_BUCKETS
+
+
+class AppNotFound(LookupError):
+    """The App Store has no app with this id (in this storefront)."""
+
+
+class AppCache:
+    """Bounded mapping of app ids to apps, evicting the least recently used and expiring after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, app_id):
+        entry = self._entries.get(app_id)
+        if entry is None:
+            return None
+        expires, app = entry
+        if self.ttl and time.monotonic() >= expires:
+            del self._entries[app_id]
+            return None
+        self._entries.move_to_end(app_id)
+        return app
+
+    def put(self, app_id, app):
+        if self.maxsize <= 0:
+            return
+        self._entries[app_id] = (time.monotonic() + self.ttl, app)
+        self._entries.move_to_end(app_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class AppClient:
+    """Asyncio client looking up single apps by id, with coalescing and a TTL+LRU cache."""
+
+    def __init__(self, country='us', base_url=BASE_URL, max_connections=16, cache_size=10000, cache_ttl=3600,
+                 timeout=10, user_agent=None, fields=None):
+        register_adapter()
+        self.country = country
+        # Same names as the APP_FIELDS setting
+        self.fields = select_fields(fields)
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cache = AppCache(cache_size, cache_ttl)
+        self.metrics = Metrics()
+        self.metrics.latencies['lookup'] = Histogram(LOOKUP_BUCKETS)
+        self._inflight = {}
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, max_retries=0)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        if user_agent:
+            self._session.headers['User-Agent'] = user_agent
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix='app-client')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def app_url(self, app_id):
+        return f'{self.base_url}/{self.country}/app/id{app_id}'
+
+    async def get_app(self, app_id):
+        """Return the ``App`` with this id; raises ``AppNotFound`` if there is none."""
+        started = time.perf_counter()
+        app_id = int(app_id)
+        self.metrics.inc('lookups')
+        try:
+            app = self.cache.get(app_id)
+            if app is not None:
+                self.metrics.inc('cache_hits')
+            else:
+                future = self._inflight.get(app_id)
+                if future is not None:
+                    self.metrics.inc('coalesced')
+                else:
+                    future = self._inflight[app_id] = asyncio.ensure_future(self._fetch(app_id))
+                    future.add_done_callback(lambda _: self._inflight.pop(app_id, None))
+                # A cancelled caller must not cancel the download others wait for
+                app = await asyncio.shield(future)
+        except AppNotFound:
+            self.metrics.inc('not_found')
+            raise
+        except Exception:
+            self.metrics.inc('errors')
+            raise
+        finally:
+            self.metrics.observe('lookup', time.perf_counter() - started)
+        # Callers get their own copy, so changing it doesn't change the cached app
+        return copy.copy(app)
+
+    async def get_apps(self, app_ids):
+        """Return the apps with these ids, in order, with None for the ids that have no app."""
+        results = await asyncio.gather(*(self.get_app(app_id) for app_id in app_ids), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception) and not isinstance(result, AppNotFound):
+                raise result
+        return [None if isinstance(result, AppNotFound) else result for result in results]
+
+    async def _fetch(self, app_id):
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        app = await loop.run_in_executor(self._executor, self._download_and_parse, app_id)
+        self.metrics.inc('fetches')
+        self.metrics.observe('fetch', time.perf_counter() - started)
+        self.cache.put(app_id, app)
+        return app
+
+    def _download_and_parse(self, app_id):
+        url = self.app_url(app_id)
+        response = self._session.get(url, timeout=self.timeout)
+        if response.status_code == 404:
+            raise AppNotFound(app_id)
+        response.raise_for_status()
+        # Parsed off the event loop too, like pages handed to the parse pool
+        fields = parse_app_page(response.content, response.url.replace(self.base_url, BASE_URL, 1), self.fields)
+        return App(fields)
+
+    def stats(self):
+        """Return the lookup counts, cache hit rate and latency quantiles (seconds)."""
+        counters = {name: value for (name, _), value in self.metrics.counters.items()}
+        lookups = counters.get('lookups', 0)
+        stats = {
+            'lookups': lookups,
+            'fetches': counters.get('fetches', 0),
+            'cache_hits': counters.get('cache_hits', 0),
+            'coalesced': counters.get('coalesced', 0),
+            'not_found': counters.get('not_found', 0),
+            'errors': counters.get('errors', 0),
+            'cache_hit_rate': counters.get('cache_hits', 0) / lookups if lookups else 0.0,
+            'cached_apps': len(self.cache),
+        }
+        for stage in ('lookup', 'fetch'):
+            histogram = self.metrics.latencies.get(stage)
+            stats[f'{stage}_p50'] = histogram.quantile(0.5) if histogram else None
+            stats[f'{stage}_p99'] = histogram.quantile(0.99) if histogram else None
+        return stats
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._session.close()
+
+
+class LookupService:
+    """
+    Minimal HTTP/1.1 server (with keep-alive) answering lookups from an ``AppClient``.
+
+    Request bodies are skipped by their ``Content-Length``; chunked ones are
+    refused and the connection closed.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode('latin-1').split()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                length = headers.get('content-length', '0')
+                if 'transfer-encoding' in headers or not length.isdigit():
+                    # The end of the body is unknown, so the connection can't be reused
+                    status, content_type = '411 Length Required', 'application/json'
+                    body = b'{"error": "request body without a length"}'
+                    keep_alive = False
+                else:
+                    # Lookups take no body, but it has to be read to get to the next request
+                    await reader.readexactly(int(length))
+                    status, content_type, body = await self.respond(parts[1] if len(parts) > 1 else '/')
+                writer.write(
+                    f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n'
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, path):
+        if path.startswith('/apps/'):
+            app_id = path[len('/apps/'):].split('?', 1)[0]
+            if not app_id.isdigit():
+                return '400 Bad Request', 'application/json', b'{"error": "invalid app id"}'
+            try:
+                app = await self.client.get_app(app_id)
+            except AppNotFound:
+                return '404 Not Found', 'application/json', b'{"error": "app not found"}'
+            except Exception as e:
+                return '502 Bad Gateway', 'application/json', json.dumps({'error': str(e)}).encode()
+            return '200 OK', 'application/json', json.dumps(ItemAdapter(app).asdict(), default=str).encode()
+        if path == '/stats':
+            return '200 OK', 'application/json', json.dumps(self.client.stats()).encode()
+        if path == '/metrics':
+            text = self.client.metrics.render_prometheus(prefix='appstore_lookup')
+            return '200 OK', 'text/plain; version=0.0.4', text.encode()
+        return '404 Not Found', 'application/json', b'{"error": "not found"}'
+
+
+async def serve(client, host='127.0.0.1', port=8080):
+    """Start the lookup service and return the ``asyncio`` server."""
+    return await asyncio.start_server(LookupService(client).handle, host, port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve single-app lookups over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--country', default='us')
+    parser.add_argument('--base-url', default=BASE_URL, help='App Store base URL, e.g. a local stand-in server')
+    parser.add_argument('--max-connections', type=int, default=16)
+    parser.add_argument('--cache-size', type=int, default=10000, help='Most apps kept in the cache')
+    parser.add_argument('--cache-ttl', type=float, default=3600, help='Seconds an app is served from the cache')
+    parser.add_argument('--fields', help='Comma-separated app fields to return, or "all" (default: the core fields)')
+    args = parser.parse_args()
+
+    async def run():
+        fields = args.fields.split(',') if args.fields else None
+        async with AppClient(args.country, args.base_url, args.max_connections, args.cache_size, args.cache_ttl,
+                             fields=fields) as client:
+            server = await serve(client, args.host, args.port)
+            print(f"Serving app lookups on http://{args.host}:{args.port}/apps/<id>")
+            async with server:
+                await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
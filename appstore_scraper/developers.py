@@ -0,0 +1,171 @@
+"""
+Developers as entities of their own.
+
+Every app carries its developer's payload, so a publisher with hundreds of
+apps is exported hundreds of times over. With ``DEVELOPERS_FEED`` set,
+``DeveloperMiddleware`` (see ``appstore_scraper.middlewares``) replaces the
+``developer`` of each app with its ``developer_id`` and emits the developer
+as a ``Developer`` item of its own, which goes to the developers feed.
+
+A developer is emitted once per run and, across runs, only when its record
+changed:
+
+- ``SeenDevelopers`` remembers the records of the developers seen in this
+  run, bounded to the ``DEVELOPERS_SEEN_MAX`` most recently seen ids, so
+  most apps are checked without hashing anything.
+- ``DeveloperIndex`` keeps the hash of every developer ever exported to a
+  developers feed, in SQLite (``DEVELOPERS_INDEX``), and is only read for
+  developers missing from the seen-set or changed since they were seen. It
+  is only committed with a checkpoint and when the crawl closes, once the
+  developers feed holds what it records: a crawl killed in between exports
+  those developers again rather than losing them.
+
+The index is kept per feed, and what it holds for a feed is dropped when the
+feed file is missing or empty (e.g. deleted, or written anew elsewhere), as
+none of its developers are in the feed any more.
+"""
+
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+from w3lib.url import file_uri_to_path
+
+from appstore_scraper.items import Developer
+from appstore_scraper.utils import content_hash
+
+
+def developer_from_app(item):
+    """Return the ``Developer`` of an ``App``, or None if it has none."""
+    developers = (getattr(item, 'developer', None) or {}).get('data') or [{}]
+    developer = developers[0]
+    if not developer.get('id'):
+        return None
+    attributes = developer.get('attributes') or {}
+    return Developer(str(developer['id']), attributes.get('name'), attributes.get('url'))
+
+
+class SeenDevelopers:
+    """Records of the developers seen lately, evicting the least recently seen beyond ``maxsize`` ids."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._records = OrderedDict()
+
+    def get(self, developer_id):
+        record = self._records.get(developer_id)
+        if record is not None:
+            self._records.move_to_end(developer_id)
+        return record
+
+    def add(self, developer_id, record):
+        self._records[developer_id] = record
+        self._records.move_to_end(developer_id)
+        while len(self._records) > self.maxsize:
+            self._records.popitem(last=False)
+
+    def __len__(self):
+        return len(self._records)
+
+
+def feed_key(uri):
+    """Return the key of a developers feed in the index: the absolute path of local files, else the URI."""
+    if uri.startswith('file://'):
+        return os.path.abspath(file_uri_to_path(uri))
+    if '://' in uri:
+        return uri
+    return os.path.abspath(uri)
+
+
+def feed_is_empty(uri):
+    """Return whether a local developers feed has nothing in it yet; remote feeds never are."""
+    key = feed_key(uri)
+    if not os.path.isabs(key):
+        return False
+    return not os.path.exists(key) or os.path.getsize(key) == 0
+
+
+class DeveloperIndex:
+    """Content hash of every developer exported to a feed, with when it was first exported and last changed."""
+
+    def __init__(self, path, feed):
+        self.path = path
+        self.feed = feed
+        # Another crawl may hold the write lock, so wait for it instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS developers ('
+            ' feed TEXT,'
+            ' developer_id TEXT,'
+            ' content_hash TEXT,'
+            ' first_exported REAL,'
+            ' last_changed REAL,'
+            ' PRIMARY KEY (feed, developer_id))'
+        )
+
+    def get(self, developer_id):
+        """Return the content hash a developer was last exported to the feed with, or None."""
+        row = self.conn.execute(
+            'SELECT content_hash FROM developers WHERE feed = ? AND developer_id = ?', (self.feed, developer_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def record(self, developer_id, digest, now=None):
+        now = time.time() if now is None else now
+        self.conn.execute(
+            'INSERT INTO developers (feed, developer_id, content_hash, first_exported, last_changed)'
+            ' VALUES (?1, ?2, ?3, ?4, ?4)'
+            ' ON CONFLICT (feed, developer_id) DO UPDATE SET content_hash = excluded.content_hash,'
+            ' last_changed = excluded.last_changed',
+            (self.feed, developer_id, digest, now),
+        )
+
+    def reset(self):
+        """Forget every developer exported to the feed."""
+        with self.conn:
+            self.conn.execute('DELETE FROM developers WHERE feed = ?', (self.feed,))
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM developers WHERE feed = ?', (self.feed,)).fetchone()[0]
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+class DeveloperTracker:
+    """Decides which developers to emit, from the seen-set and the optional index."""
+
+    def __init__(self, seen, index=None):
+        self.seen = seen
+        self.index = index
+
+    def should_emit(self, developer):
+        """Return whether a developer is new to the run or changed since it was last exported."""
+        # Not dataclasses.astuple(), which deep-copies every value
+        record = (developer.id, developer.name, developer.url)
+        if self.seen.get(developer.id) == record:
+            return False
+        self.seen.add(developer.id, record)
+        if self.index is None:
+            return True
+        return self.index.get(developer.id) != content_hash(developer)
+
+    def exported(self, developer):
+        """Record that a developer reached the feed."""
+        if self.index is not None:
+            self.index.record(developer.id, content_hash(developer))
+
+    def commit(self):
+        if self.index is not None:
+            self.index.commit()
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
@@ -0,0 +1,241 @@
+"""
+Duplicate filtering of app requests by their App Store id.
+
+``RFPDupeFilter`` keeps a set of hex SHA1 fingerprints and reloads them from a
+text file on resume, and treats the same app under another slug or query
+string as a new request. ``AppIdDupeFilter`` fingerprints app page requests by
+their numeric id instead and keeps the seen ids in a compact structure that
+is saved to the job directory in binary form:
+
+* by default a sorted array of 64-bit ids (8 bytes per app, exact)
+* with ``DUPEFILTER_BLOOM_CAPACITY`` set, a Bloom filter sized for that many
+  apps at ``DUPEFILTER_BLOOM_ERROR_RATE``. A false positive drops an app from
+  the crawl, so only use it where a fixed memory budget matters more.
+
+Other requests (sitemaps, lookups) go through the regular fingerprint filter.
+A redirect to another slug of the same app (after the app is renamed) is let
+through, as its id was already added for the original request.
+The ids are saved when the crawl is closed or paused; after a hard kill, the
+apps seen since the last save may be downloaded again, but none are lost.
+With ``CHECKPOINT_ENABLED``, the filter is also saved with every checkpoint
+(see ``appstore_scraper.checkpoint``).
+"""
+
+import hashlib
+import heapq
+import math
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.utils.job import job_dir
+
+from appstore_scraper.checkpoint import checkpoint_saving
+from appstore_scraper.utils import app_id_from_url
+
+IDS_FILE = 'requests.seen.ids'
+BLOOM_FILE = 'requests.seen.bloom'
+# Fingerprints of the other requests, kept by RFPDupeFilter
+FINGERPRINTS_FILE = 'requests.seen'
+
+# Smallest number of unsorted ids kept before merging them into the array
+MIN_PENDING = 4096
+
+
+def app_request_id(request):
+    """Return the App Store id an app page request is for, or None."""
+    if '/app/' not in request.url:
+        return None
+    return app_id_from_url(request.url)
+
+
+class SortedIdSet:
+    """
+    Set of integer ids stored as a sorted array, plus a small unsorted buffer.
+
+    The buffer is merged into the array once it holds 1/16 of the array's
+    size, so inserts stay amortized O(1) while memory stays close to 8 bytes
+    per id.
+    """
+
+    def __init__(self, ids=None):
+        self.ids = ids if ids is not None else array('Q')
+        self.pending = set()
+
+    def __contains__(self, value):
+        if value in self.pending:
+            return True
+        i = bisect_left(self.ids, value)
+        return i < len(self.ids) and self.ids[i] == value
+
+    def __len__(self):
+        return len(self.ids) + len(self.pending)
+
+    def add(self, value):
+        self.pending.add(value)
+        if len(self.pending) >= max(MIN_PENDING, len(self.ids) >> 4):
+            self.merge()
+
+    def merge(self):
+        if self.pending:
+            self.ids = array('Q', heapq.merge(self.ids, sorted(self.pending)))
+            self.pending = set()
+
+    def memory_bytes(self):
+        # Each buffered id is an int object referenced from the set's table
+        return self.ids.itemsize * len(self.ids) + sys.getsizeof(self.pending) + 32 * len(self.pending)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    def to_bytes(self):
+        self.merge()
+        return self.ids.tobytes()
+
+    @classmethod
+    def load(cls, path):
+        ids = array('Q')
+        with open(path, 'rb') as f:
+            ids.fromfile(f, os.fstat(f.fileno()).st_size // ids.itemsize)
+        return cls(ids)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter of integer ids, using double hashing of a blake2b digest."""
+
+    HEADER = struct.Struct('<QQQ')
+
+    def __init__(self, capacity, error_rate, bits=None, hashes=None):
+        size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.size = size if bits is None else len(bits) * 8
+        self.hashes = hashes or max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+        self.capacity = capacity
+        self.count = 0
+
+    def _positions(self, value):
+        h1, h2 = struct.unpack('<QQ', hashlib.blake2b(value.to_bytes(8, 'little'), digest_size=16).digest())
+        h2 |= 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, value):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(value))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value):
+        bits = self.bits
+        for p in self._positions(value):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def memory_bytes(self):
+        return len(self.bits)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    def to_bytes(self):
+        return self.HEADER.pack(self.capacity, self.hashes, self.count) + bytes(self.bits)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            capacity, hashes, count = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            bits = bytearray(f.read())
+        # The saved filter keeps its own size, whatever the settings say now
+        bloom = cls(capacity, 0.5, bits=bits, hashes=hashes)
+        bloom.count = count
+        return bloom
+
+
+class AppIdDupeFilter(RFPDupeFilter):
+    """Dupefilter treating every request for the same App Store id as a duplicate."""
+
+    def __init__(self, path=None, debug=False, *, fingerprinter=None, bloom_capacity=0, bloom_error_rate=0.001, stats=None):
+        start = time.perf_counter()
+        super().__init__(path, debug, fingerprinter=fingerprinter)
+        self.stats = stats
+        self.ids_path = None
+        if bloom_capacity:
+            if path:
+                self.ids_path = os.path.join(path, BLOOM_FILE)
+            if self.ids_path and os.path.exists(self.ids_path):
+                self.ids = BloomFilter.load(self.ids_path)
+            else:
+                self.ids = BloomFilter(bloom_capacity, bloom_error_rate)
+        else:
+            if path:
+                self.ids_path = os.path.join(path, IDS_FILE)
+            if self.ids_path and os.path.exists(self.ids_path):
+                self.ids = SortedIdSet.load(self.ids_path)
+            else:
+                self.ids = SortedIdSet()
+        self.load_time = time.perf_counter() - start
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        df = cls(
+            job_dir(settings),
+            settings.getbool('DUPEFILTER_DEBUG'),
+            fingerprinter=crawler.request_fingerprinter,
+            bloom_capacity=settings.getint('DUPEFILTER_BLOOM_CAPACITY'),
+            bloom_error_rate=settings.getfloat('DUPEFILTER_BLOOM_ERROR_RATE'),
+            stats=crawler.stats,
+        )
+        crawler.signals.connect(df.checkpoint_files, signal=checkpoint_saving)
+        return df
+
+    def open(self):
+        if self.stats:
+            self.stats.set_value('dupefilter/load_time', round(self.load_time, 4))
+            self._update_stats()
+
+    def request_seen(self, request):
+        app_id = app_request_id(request)
+        if app_id is None:
+            return super().request_seen(request)
+        redirect_urls = request.meta.get('redirect_urls')
+        if redirect_urls and app_id_from_url(redirect_urls[0]) == app_id:
+            return False
+        if app_id in self.ids:
+            return True
+        self.ids.add(app_id)
+        return False
+
+    def checkpoint_files(self, spider):
+        """Return the contents of the filter's job files, for a checkpoint."""
+        if not self.ids_path:
+            return None
+        return {
+            os.path.basename(self.ids_path): self.ids.to_bytes(),
+            FINGERPRINTS_FILE: ''.join(f'{fp}\n' for fp in self.fingerprints).encode(),
+        }
+
+    def close(self, reason):
+        if isinstance(self.ids, BloomFilter) and self.ids.count > self.ids.capacity:
+            self.logger.warning(
+                "Bloom filter holds %d ids but was sized for %d; its false positive rate "
+                "is above DUPEFILTER_BLOOM_ERROR_RATE", self.ids.count, self.ids.capacity,
+            )
+        if self.ids_path:
+            # Write a new file and swap it in, so a crash never leaves a truncated one
+            tmp_path = self.ids_path + '.tmp'
+            self.ids.save(tmp_path)
+            os.replace(tmp_path, self.ids_path)
+        if self.stats:
+            self._update_stats()
+        super().close(reason)
+
+    def _update_stats(self):
+        self.stats.set_value('dupefilter/seen_ids', len(self.ids))
+        self.stats.set_value('dupefilter/memory_bytes', self.ids.memory_bytes() + sys.getsizeof(self.fingerprints))
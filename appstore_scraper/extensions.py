@@ -1,47 +1,262 @@
+import logging
+import os
 import sys
 import time
 from scrapy import signals
 from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+from twisted.internet.error import CannotListenError
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from appstore_scraper.items import register_adapter
+from appstore_scraper.metrics import Metrics, RollingRate
+from appstore_scraper.sharding import shard_path
+
+logger = logging.getLogger(__name__)
+
+
+class AppAdapterExtension:
+    """
+    Registers ``AppAdapter`` when the crawler is created.
+
+    Pipelines, middlewares and feed exporters read ``App`` items through
+    ``ItemAdapter``, which without it fails on the fields left unset.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        register_adapter()
+        return cls()
+
 
 class InPlaceCounterExtension:
     """
     Extension to display an in-place counter of scraped items.
+
+    Items are only counted as they are scraped; the counter line is redrawn
+    every ``COUNTER_REFRESH_INTERVAL`` seconds with the rate over the last
+    10 seconds next to the average since the start.
     """
-    def __init__(self, stats):
+    def __init__(self, stats, interval=0.5):
         self.stats = stats
         self.items_scraped = 0
         self.start_time = time.time()
-        
+        self.interval = interval
+        self.rate = RollingRate()
+        self.task = None
+        self._width = 0
+
     @classmethod
     def from_crawler(cls, crawler):
         # Only enable the extension if it's enabled in settings
         if not crawler.settings.getbool('EXTENSIONS_ENABLED', True):
             raise NotConfigured
-        
+
         # Instantiate the extension with the stats collector
-        ext = cls(crawler.stats)
-        
+        ext = cls(crawler.stats, crawler.settings.getfloat('COUNTER_REFRESH_INTERVAL', 0.5))
+
         # Connect the extension to the signals
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
         crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
         crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
-        
+
         return ext
-    
+
+    def spider_opened(self, spider):
+        self.task = task.LoopingCall(self.render)
+        self.task.start(self.interval, now=False)
+
     def item_scraped(self, item, spider):
         """Called when an item has been scraped."""
         self.items_scraped += 1
+        self.rate.add()
+
+    def render(self):
+        """Redraw the counter line in place."""
         elapsed_time = time.time() - self.start_time
-        items_per_second = self.items_scraped / elapsed_time if elapsed_time > 0 else 0
-        
-        # Clear the current line and print the counter
-        sys.stdout.write(f"\rItems scraped: {self.items_scraped} | Rate: {items_per_second:.2f} items/sec")
+        average = self.items_scraped / elapsed_time if elapsed_time > 0 else 0
+        line = (
+            f"Items scraped: {self.items_scraped} | Rate: {self.rate.rate(10):.2f} items/sec "
+            f"(last 10s) | Avg: {average:.2f} items/sec"
+        )
+        # Pad over whatever is left of a longer previous line
+        self._width = max(self._width, len(line))
+        sys.stdout.write('\r' + line.ljust(self._width))
         sys.stdout.flush()
-    
+
     def spider_closed(self, spider, reason):
         """Called when the spider is closed."""
+        if self.task and self.task.running:
+            self.task.stop()
         elapsed_time = time.time() - self.start_time
         items_per_second = self.items_scraped / elapsed_time if elapsed_time > 0 else 0
-        
+
         # Print final stats with a newline
-        sys.stdout.write(f"\rCompleted: {self.items_scraped} items | Total time: {elapsed_time:.2f}s | Avg rate: {items_per_second:.2f} items/sec\n")
-        sys.stdout.flush() 
\ No newline at end of file
+        line = f"Completed: {self.items_scraped} items | Total time: {elapsed_time:.2f}s | Avg rate: {items_per_second:.2f} items/sec"
+        sys.stdout.write('\r' + line.ljust(self._width) + '\n')
+
+        # Report what an incremental run skipped and refreshed
+        if spider.settings.getbool('INCREMENTAL_ENABLED'):
+            sys.stdout.write(
+                f"Incremental: {self.stats.get_value('incremental/new', 0)} new | "
+                f"{self.stats.get_value('incremental/refreshed', 0)} refreshed | "
+                f"{self.stats.get_value('incremental/skipped', 0)} skipped | "
+                f"{self.stats.get_value('incremental/changed', 0)} changed\n"
+            )
+        sys.stdout.flush()
+
+
+class MetricsResource(Resource):
+    isLeaf = True
+
+    def __init__(self, extension):
+        super().__init__()
+        self.extension = extension
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+        return self.extension.render().encode('utf-8')
+
+
+class MetricsExtension:
+    """
+    Collects crawl metrics and exports them for monitoring.
+
+    Counts responses by status code, retries, download errors and parse
+    failures, keeps rolling response and item rates, and records download,
+    parse and pipeline latency histograms (see
+    ``appstore_scraper.metrics``). Time to item, from a request reaching the
+    downloader to its item being scraped, is recorded as the
+    ``time_to_item`` stage, summed in the ``items/time_to_item`` stat and
+    summarized in ``items/time_to_item_p50`` and ``items/time_to_item_p99``
+    at close. Event loop lag, how late the reactor runs a call scheduled
+    every ``METRICS_LOOP_LAG_INTERVAL`` seconds, is recorded as the
+    ``loop_lag`` stage and in the ``reactor/loop_lag_max`` and
+    ``reactor/loop_lag_p99`` stats. The metrics are exported in the
+    Prometheus text format to ``METRICS_TEXTFILE`` every
+    ``METRICS_TEXTFILE_INTERVAL`` seconds and/or served at
+    ``http://METRICS_HTTP_HOST:METRICS_HTTP_PORT/metrics``.
+    """
+
+    def __init__(self, crawler, textfile=None, interval=15, port=None, host='127.0.0.1', lag_interval=0.1):
+        self.crawler = crawler
+        self.metrics = Metrics.for_crawler(crawler)
+        self.textfile = textfile
+        self.interval = interval
+        self.port = port
+        self.host = host
+        self.lag_interval = lag_interval
+        self.task = None
+        self.lag_task = None
+        self.listener = None
+        self._lag_due = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED', True):
+            raise NotConfigured
+        textfile = settings.get('METRICS_TEXTFILE')
+        port = settings.getint('METRICS_HTTP_PORT')
+        # Every shard of a sharded crawl exports its own metrics
+        shard_index, shard_count = settings.getint('SHARD_INDEX'), settings.getint('SHARD_COUNT', 1)
+        if shard_count > 1:
+            textfile = textfile and shard_path(textfile, shard_index, shard_count)
+            port = port and port + shard_index
+        ext = cls(
+            crawler, textfile, settings.getfloat('METRICS_TEXTFILE_INTERVAL', 15), port,
+            settings.get('METRICS_HTTP_HOST'), settings.getfloat('METRICS_LOOP_LAG_INTERVAL', 0.1),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(ext.item_error, signal=signals.item_error)
+        crawler.signals.connect(ext.spider_error, signal=signals.spider_error)
+        return ext
+
+    def spider_opened(self, spider):
+        if self.lag_interval > 0:
+            self.lag_task = task.LoopingCall(self.check_loop_lag)
+            self.lag_task.start(self.lag_interval)
+        if self.textfile:
+            self.task = task.LoopingCall(self.write_textfile)
+            self.task.start(self.interval, now=False)
+        if self.port:
+            from twisted.internet import reactor
+            root = Resource()
+            root.putChild(b'metrics', MetricsResource(self))
+            try:
+                self.listener = reactor.listenTCP(self.port, Site(root), interface=self.host)
+            except CannotListenError as e:
+                logger.warning("Can't serve metrics on %s:%s: %s", self.host, self.port, e)
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        if self.lag_task and self.lag_task.running:
+            self.lag_task.stop()
+            lag = self.metrics.latencies.get('loop_lag')
+            if lag is not None and lag.count:
+                self.crawler.stats.set_value('reactor/loop_lag_p99', lag.quantile(0.99))
+        time_to_item = self.metrics.latencies.get('time_to_item')
+        if time_to_item is not None and time_to_item.count:
+            self.crawler.stats.set_value('items/time_to_item_p50', time_to_item.quantile(0.5))
+            self.crawler.stats.set_value('items/time_to_item_p99', time_to_item.quantile(0.99))
+        if self.textfile:
+            self.write_textfile()
+        if self.listener:
+            self.listener.stopListening()
+
+    def check_loop_lag(self):
+        now = time.monotonic()
+        if self._lag_due is not None:
+            lag = max(0.0, now - self._lag_due)
+            self.metrics.observe('loop_lag', lag)
+            self.crawler.stats.max_value('reactor/loop_lag_max', round(lag, 4))
+        self._lag_due = now + self.lag_interval
+
+    def request_reached_downloader(self, request, spider):
+        request.meta['download_started'] = time.monotonic()
+
+    def response_received(self, response, request, spider):
+        self.metrics.inc('responses_total', code=response.status)
+        self.metrics.mark('responses')
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.metrics.observe('download', latency)
+
+    def item_scraped(self, item, response, spider):
+        self.metrics.inc('items_scraped_total')
+        self.metrics.mark('items')
+        self.metrics.item_finished(item)
+        request = getattr(response, 'request', None)
+        started = request.meta.get('download_started') if request is not None else None
+        if started is not None:
+            elapsed = time.monotonic() - started
+            self.metrics.observe('time_to_item', elapsed)
+            self.crawler.stats.inc_value('items/time_to_item', elapsed)
+
+    def item_dropped(self, item, spider):
+        self.metrics.item_finished(item)
+
+    def item_error(self, item, spider):
+        self.metrics.inc('item_errors_total')
+        self.metrics.item_finished(item)
+
+    def spider_error(self, failure, response, spider):
+        callback = getattr(response.request, 'callback', None)
+        self.metrics.inc('parse_failures_total', callback=getattr(callback, '__name__', None) or 'parse')
+
+    def render(self):
+        return self.metrics.render_prometheus(self.crawler.stats.get_stats())
+
+    def write_textfile(self):
+        # Write and rename, so a collector never reads a partial file
+        tmp_path = f'{self.textfile}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.textfile)
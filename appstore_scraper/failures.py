@@ -0,0 +1,230 @@
+"""
+Ledger of the pages a crawl failed to turn into items.
+
+A page that fails once its retries are used up is lost for the run, and
+with logging off nothing says which one. Every such page is recorded in a
+small SQLite ledger instead. There is one row per URL with:
+
+- the callback it was requested for
+- its sitemap ``<lastmod>``
+- the failure class (see ``classify_failure``) and the last HTTP status
+- the number of runs it failed in
+- when it first and last failed
+
+Pages of a later run that succeed are removed from the ledger.
+
+Only requests that can be made again on their own are recorded: app pages
+(``parse``), sitemap shards (``_parse_sitemap``) and the apps of failed
+lookup batches. ``run_spider.py --retry-failed`` requests only the ledger's
+entries instead of the sitemap. An entry is retried once its backoff has
+passed (``FAILURES_BACKOFF``, doubled with every failed run) and until it
+has failed ``FAILURES_MAX_ATTEMPTS`` times. Pages that are gone (404 or 410)
+are never retried.
+"""
+
+import argparse
+import json
+import sqlite3
+import time
+import weakref
+
+from scrapy import signals
+from scrapy.spidermiddlewares.httperror import HttpError
+
+from appstore_scraper.shoebox import ShoeboxNotFound
+
+NO_SHOEBOX = 'no_shoebox'
+BAD_SHOEBOX = 'bad_shoebox'
+MISSING_FIELD = 'missing_field'
+HTTP = 'http'
+GONE = 'gone'
+DOWNLOAD = 'download'
+ERROR = 'error'
+
+GONE_STATUSES = (404, 410)
+
+# Callbacks whose requests only need a URL and a lastmod to be made again
+RETRYABLE_CALLBACKS = ('parse', '_parse_sitemap')
+
+
+def classify_failure(exception, status=None):
+    """Return the failure class of an exception raised for a page."""
+    if isinstance(exception, HttpError):
+        status = exception.response.status
+    if status is not None and not 200 <= status < 300:
+        return GONE if status in GONE_STATUSES else HTTP
+    if isinstance(exception, ShoeboxNotFound):
+        return NO_SHOEBOX
+    if isinstance(exception, ValueError):
+        # Malformed JSON in the script
+        return BAD_SHOEBOX
+    if isinstance(exception, (KeyError, IndexError, TypeError)):
+        # The app record no longer has the layout app_fields expects
+        return MISSING_FIELD
+    return ERROR
+
+
+def ledger_entries(request):
+    """Return ``(url, callback, lastmod)`` for each page a failed request stands for."""
+    # Probes past the last sitemap index file end in a 404 by design, and are made again every run
+    if request.meta.get('sitemap_probe'):
+        return []
+    batch = request.meta.get('lookup_batch')
+    if batch:
+        lastmods = request.meta.get('lastmod') or {}
+        return [(url, 'parse', lastmods.get(app_id)) for app_id, url in batch.items()]
+    callback = getattr(request.callback, '__name__', None) or 'parse'
+    if callback not in RETRYABLE_CALLBACKS:
+        return []
+    # Redirected requests are recorded under the URL the spider asked for
+    url = request.meta.get('redirect_urls', [request.url])[0]
+    return [(url, callback, request.meta.get('lastmod'))]
+
+
+class FailureLedger:
+    """Failed URLs with their failure class, last HTTP status and number of failed runs."""
+
+    _crawlers = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_crawler(cls, crawler):
+        """Return the ledger of a crawler, shared by the middlewares recording into it."""
+        ledger = cls._crawlers.get(crawler)
+        if ledger is None:
+            settings = crawler.settings
+            ledger = cls._crawlers[crawler] = cls(
+                settings.get('FAILURES_LEDGER'), settings.getint('FAILURES_COMMIT_INTERVAL', 100)
+            )
+            crawler.signals.connect(ledger.spider_closed, signal=signals.spider_closed)
+        return ledger
+
+    def __init__(self, path, commit_interval=100):
+        self.path = path
+        self.commit_interval = commit_interval
+        self._pending = 0
+        # Sharded crawls may share the ledger, so wait for other writers instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS failures ('
+            ' url TEXT PRIMARY KEY,'
+            ' callback TEXT,'
+            ' lastmod REAL,'
+            ' failure TEXT,'
+            ' status INTEGER,'
+            ' detail TEXT,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' first_failed REAL,'
+            ' last_failed REAL)'
+        )
+        # Failures are rare, so successes are checked against the failed URLs in memory
+        self.urls = {row[0] for row in self.conn.execute('SELECT url FROM failures')}
+        # URLs that failed in this run count one attempt however often they fail
+        self._failed = set()
+
+    def record(self, url, callback, lastmod, failure, status=None, detail=None, now=None):
+        """Record a failure of ``url``; returns whether it is the page's first failure in this run."""
+        now = time.time() if now is None else now
+        first = url not in self._failed
+        self.conn.execute(
+            'INSERT INTO failures (url, callback, lastmod, failure, status, detail, attempts, first_failed, last_failed)'
+            ' VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)'
+            ' ON CONFLICT (url) DO UPDATE SET callback = excluded.callback,'
+            ' lastmod = COALESCE(excluded.lastmod, lastmod), failure = excluded.failure,'
+            ' status = excluded.status, detail = excluded.detail,'
+            ' attempts = attempts + ?, last_failed = excluded.last_failed',
+            (url, callback, lastmod, failure, status, detail, now, now, int(first)),
+        )
+        self.urls.add(url)
+        self._failed.add(url)
+        self._changed()
+        return first
+
+    def resolve(self, url):
+        """Remove a page that succeeded; returns whether it was in the ledger."""
+        if url not in self.urls:
+            return False
+        self.urls.discard(url)
+        self.conn.execute('DELETE FROM failures WHERE url = ?', (url,))
+        self._changed()
+        return True
+
+    def due(self, now=None, backoff=600, max_backoff=24 * 3600, max_attempts=5):
+        """
+        Return the entries to retry now and the number of entries given up on.
+
+        Entries are ``(url, callback, lastmod)``. An entry is due once
+        ``backoff`` seconds, doubled for every earlier failed run (up to
+        ``max_backoff``), have passed since it last failed.
+        """
+        now = time.time() if now is None else now
+        due, given_up = [], 0
+        rows = self.conn.execute('SELECT url, callback, lastmod, failure, attempts, last_failed FROM failures')
+        for url, callback, lastmod, failure, attempts, last_failed in rows:
+            if failure == GONE or (max_attempts and attempts >= max_attempts):
+                given_up += 1
+                continue
+            if now - last_failed >= min(backoff * 2 ** (attempts - 1), max_backoff):
+                due.append((url, callback, lastmod))
+        return due, given_up
+
+    def summary(self):
+        """Return the number of entries per failure class and HTTP status."""
+        return {
+            (failure, status): count
+            for failure, status, count in self.conn.execute(
+                'SELECT failure, status, COUNT(*) FROM failures GROUP BY failure, status ORDER BY failure, status'
+            )
+        }
+
+    def __len__(self):
+        return len(self.urls)
+
+    def _changed(self):
+        self._pending += 1
+        if self.commit_interval and self._pending >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def spider_closed(self, spider):
+        spider.crawler.stats.set_value('failures/ledger_size', len(self))
+        self.close()
+
+
+def format_summary(summary):
+    lines = []
+    for (failure, status), count in summary.items():
+        lines.append(f"{count:>8}  {failure}" + (f" (HTTP {status})" if status is not None else ''))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the failed pages recorded in a failure ledger')
+    parser.add_argument('ledger', nargs='?', default='failures.db')
+    parser.add_argument('--urls', action='store_true', help='List every failed URL as JSON lines')
+    args = parser.parse_args()
+    ledger = FailureLedger(args.ledger)
+    if args.urls:
+        rows = ledger.conn.execute(
+            'SELECT url, callback, failure, status, detail, attempts, first_failed, last_failed FROM failures ORDER BY url'
+        )
+        keys = ('url', 'callback', 'failure', 'status', 'detail', 'attempts', 'first_failed', 'last_failed')
+        for row in rows:
+            print(json.dumps(dict(zip(keys, row))))
+    else:
+        print(f"{len(ledger)} failed pages in {args.ledger}")
+        if len(ledger):
+            print(format_summary(ledger.summary()))
+    ledger.close()
+
+
+if __name__ == '__main__':
+    main()
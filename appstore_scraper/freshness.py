@@ -0,0 +1,93 @@
+"""
+Freshness priorities for app requests.
+
+A refresh of the whole catalog takes long enough to be cut short, so app
+requests are ordered by the expected value of downloading them: how much the
+app matters (its sitemap ``<priority>``) times the probability that its
+tracked fields (``FRESHNESS_FIELDS``: price and rating by default) changed
+since it was last scraped.
+
+That probability comes from Poisson change models fitted to the app's
+history in the app index: how often its tracked fields changed, and how
+often its ``<lastmod>`` moved, over the time it has been scraped. A moved
+``<lastmod>`` only says that something on the page changed, so the
+probability becomes the chance that the tracked fields were among what
+changed. An unmoved one makes a change unlikely, but not impossible. New
+apps always score 1.
+
+Scores are mapped onto ``FRESHNESS_PRIORITY_LEVELS`` request priorities, so
+the scheduler's priority queue (one SQLite disk queue per level in a job
+directory) hands out the most valuable requests first.
+"""
+
+import math
+
+DAY = 24 * 3600
+
+# Prior of the change rate estimate, so apps with little history get a rate
+# of about one change every two months instead of none
+PRIOR_CHANGES = 0.5
+PRIOR_DAYS = 30.0
+
+# Probability that a change of the tracked fields doesn't move <lastmod>
+LASTMOD_MISS = 0.1
+
+# Importance of apps whose sitemap entry has no (valid) <priority>, as in the sitemap protocol
+DEFAULT_IMPORTANCE = 0.5
+
+
+def sitemap_importance(value):
+    """Return a sitemap ``<priority>`` value as a number between 0 and 1."""
+    try:
+        importance = float(value)
+    except (TypeError, ValueError):
+        return DEFAULT_IMPORTANCE
+    if math.isnan(importance):
+        return DEFAULT_IMPORTANCE
+    return min(1.0, max(0.0, importance))
+
+
+def change_rate(changes, history):
+    """Estimate how many times per day something that changed ``changes`` times in an app's history changes."""
+    last_scraped, first_scraped = history[1], history[2]
+    span = (last_scraped - (first_scraped or last_scraped)) / DAY
+    return (changes + PRIOR_CHANGES) / (span + PRIOR_DAYS)
+
+
+def change_probability(history, lastmod, now):
+    """Return the probability that an app's tracked fields changed since it was last scraped."""
+    if history is None:
+        return 1.0
+    indexed_lastmod, last_scraped, _, _, changes, page_changes = history
+    age = max(0.0, now - last_scraped) / DAY
+    rate = change_rate(changes, history)
+    changed = 1.0 - math.exp(-rate * age)
+    if lastmod is None or indexed_lastmod is None:
+        return changed
+    if lastmod > indexed_lastmod:
+        # The page changed: either the tracked fields did, or something else
+        # (changes of the tracked fields are page changes too)
+        other = 1.0 - math.exp(-change_rate(max(0, page_changes - changes), history) * age)
+        page_changed = 1.0 - (1.0 - changed) * (1.0 - other)
+        return changed / page_changed if page_changed > 0 else 1.0
+    return changed * LASTMOD_MISS
+
+
+class FreshnessScorer:
+    """Scores sitemap entries and maps the scores onto request priorities."""
+
+    def __init__(self, levels=100):
+        self.levels = max(1, levels)
+
+    def score(self, sitemap_priority, lastmod, history, now):
+        """Return the expected value of downloading an app, between 0 and 1."""
+        return sitemap_importance(sitemap_priority) * change_probability(history, lastmod, now)
+
+    def priority(self, score):
+        """
+        Return the request priority for a score.
+
+        Priorities run from ``-levels`` up to 0, so sitemap requests (priority
+        1) still go first and discovery keeps up with the crawl.
+        """
+        return round(score * self.levels) - self.levels
@@ -0,0 +1,245 @@
+"""
+Compact HTTP cache for app pages, revalidated with conditional requests.
+
+Scrapy's ``FilesystemCacheStorage`` writes a directory of uncompressed files
+per request, which doesn't hold up for millions of app pages.
+``AppCacheStorage`` keeps every response in one SQLite database instead,
+zlib-compressed and keyed by App Store id for app pages (by request
+fingerprint for anything else). With ``HTTPCACHE_SHOEBOX_ONLY`` only the
+shoebox script of an app page is kept, which is all the spider reads from it.
+
+``ConditionalPolicy`` revalidates every cached response that has an ``ETag``
+or ``Last-Modified`` header by sending ``If-None-Match``/``If-Modified-Since``.
+On a 304 the cached response is used, so the page isn't downloaded again.
+The fields the spider parsed from an app page are stored with it (sent with
+the ``app_parsed`` signal), so a cached page whose fields are stored for the
+same ``APP_FIELDS`` is exported without parsing it again. Responses without
+validators are downloaded again.
+
+Entries stored more than ``HTTPCACHE_EXPIRATION_SECS`` ago are ignored and
+evicted, and once the compressed entries exceed ``HTTPCACHE_MAX_SIZE_MB`` the
+least recently used ones are evicted down to 90% of that.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+import zlib
+
+from scrapy.extensions.httpcache import DummyPolicy
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.gz import gunzip
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+from appstore_scraper.dupefilters import app_request_id
+from appstore_scraper.shoebox import SHOEBOX_ID, find_shoebox
+
+logger = logging.getLogger(__name__)
+
+# Sent by the spider with the fields it parsed from an app page: fields, response, spider
+app_parsed = object()
+
+# Headers that no longer describe a stored body once it is decoded or trimmed
+BODY_HEADERS = (b'Content-Length', b'Content-Encoding', b'Transfer-Encoding')
+
+
+def shoebox_page(payload):
+    """Return a minimal page holding just the shoebox script."""
+    return b'<html><head><script type="fastboot/shoebox" id="' + SHOEBOX_ID + b'">' + payload + b'</script></head></html>'
+
+
+def decoded_body(response):
+    """Return the body of a response without its content encoding, or None if it can't be decoded."""
+    encoding = response.headers.get(b'Content-Encoding', b'').lower()
+    if not encoding or encoding == b'identity':
+        return response.body
+    try:
+        if encoding in (b'gzip', b'x-gzip'):
+            return gunzip(response.body)
+        if encoding == b'deflate':
+            try:
+                return zlib.decompress(response.body)
+            except zlib.error:
+                # Some servers send raw deflate data without the zlib header
+                return zlib.decompress(response.body, -15)
+    except (OSError, zlib.error):
+        pass
+    return None
+
+
+class ConditionalPolicy(DummyPolicy):
+    """Cache successful GET responses and revalidate them on every request."""
+
+    def should_cache_request(self, request):
+        return request.method == 'GET' and super().should_cache_request(request)
+
+    def should_cache_response(self, response, request):
+        return response.status == 200 and super().should_cache_response(response, request)
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        headers = cachedresponse.headers
+        if b'ETag' in headers:
+            request.headers[b'If-None-Match'] = headers[b'ETag']
+        if b'Last-Modified' in headers:
+            request.headers[b'If-Modified-Since'] = headers[b'Last-Modified']
+        return False
+
+    def is_cached_response_valid(self, cachedresponse, response, request):
+        return response.status == 304
+
+
+class AppCacheStorage:
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.max_size = int(settings.getfloat('HTTPCACHE_MAX_SIZE_MB') * 1024 * 1024)
+        self.shoebox_only = settings.getbool('HTTPCACHE_SHOEBOX_ONLY', True)
+        self.compression_level = settings.getint('HTTPCACHE_COMPRESSION_LEVEL', 6)
+        self.commit_interval = settings.getint('HTTPCACHE_COMMIT_INTERVAL', 1000)
+        self.conn = None
+        self.stats = None
+        self.size = 0
+        self._pending = 0
+
+    def open_spider(self, spider):
+        path = os.path.join(self.cachedir, f'{spider.name}.sqlite3')
+        # Another crawl may hold the write lock, so wait for it instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            ' key TEXT PRIMARY KEY,'
+            ' url TEXT,'
+            ' status INTEGER,'
+            ' headers BLOB,'
+            ' body BLOB,'
+            ' size INTEGER,'
+            ' length INTEGER,'
+            ' stored_at REAL,'
+            ' accessed_at REAL,'
+            ' fields BLOB)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        self.stats = spider.crawler.stats
+        self.evict()
+        logger.debug("Using SQLite cache storage in %s", path, extra={'spider': spider})
+
+    def close_spider(self, spider):
+        self.commit()
+        self.conn.close()
+
+    def _key(self, request):
+        app_id = app_request_id(request)
+        if app_id is not None:
+            return str(app_id)
+        return self._fingerprinter.fingerprint(request).hex()
+
+    def retrieve_response(self, spider, request):
+        """Return the cached response for a request, or None if there isn't a current one."""
+        key = self._key(request)
+        row = self.conn.execute(
+            'SELECT url, status, headers, body, length, stored_at, fields FROM responses WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        url, status, raw_headers, data, length, stored_at, fields = row
+        now = time.time()
+        if 0 < self.expiration_secs < now - stored_at:
+            return None
+        self.conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+        self._written()
+
+        # Size of the original body, for counting what a revalidation saved
+        request.meta['httpcache_length'] = length
+        if fields is not None:
+            # Only used if the cached response is (see AppCacheMiddleware)
+            request.meta['httpcache_fields'] = json.loads(zlib.decompress(fields))
+        body = zlib.decompress(data)
+        headers = Headers(headers_raw_to_dict(raw_headers))
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        """Compress and store a response, replacing any older one for the same key."""
+        body = response.body
+        headers = response.headers.copy()
+        decoded = decoded_body(response)
+        if decoded is not None:
+            body = decoded
+            for name in BODY_HEADERS:
+                headers.pop(name, None)
+            if self.shoebox_only and app_request_id(request) is not None:
+                payload = find_shoebox(body)
+                if payload is not None:
+                    body = shoebox_page(payload)
+
+        data = zlib.compress(body, self.compression_level)
+        now = time.time()
+        key = self._key(request)
+        # A replaced entry no longer counts towards the cache size
+        row = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        replaced = row[0] if row else 0
+        self.conn.execute(
+            'INSERT OR REPLACE INTO responses (key, url, status, headers, body, size, length, stored_at, accessed_at)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, response.url, response.status, headers_dict_to_raw(headers),
+             data, len(data), len(response.body), now, now),
+        )
+        self._written()
+        self.size += len(data) - replaced
+        self.stats.inc_value('httpcache/stored_bytes', len(data), spider=spider)
+        if self.max_size and self.size > self.max_size:
+            self.evict(now)
+
+    def store_fields(self, spider, request, fields):
+        """Store the fields parsed from the cached response to an app page request."""
+        if app_request_id(request) is None:
+            return
+        key = self._key(request)
+        row = self.conn.execute('SELECT length(fields) FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return
+        data = zlib.compress(json.dumps(fields, separators=(',', ':')).encode('utf-8'), self.compression_level)
+        self.conn.execute('UPDATE responses SET fields = ?, size = size + ? WHERE key = ?',
+                          (data, len(data) - (row[0] or 0), key))
+        self._written()
+        self.size += len(data) - (row[0] or 0)
+
+    def evict(self, now=None):
+        """Drop expired entries, then least recently used ones while the cache is over its size limit."""
+        now = time.time() if now is None else now
+        evicted = 0
+        with self.conn:
+            if self.expiration_secs > 0:
+                evicted += self.conn.execute(
+                    'DELETE FROM responses WHERE stored_at < ?', (now - self.expiration_secs,)
+                ).rowcount
+            self.size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if self.max_size and self.size > self.max_size:
+                target = self.max_size * 0.9
+                keys = []
+                for key, size in self.conn.execute('SELECT key, size FROM responses ORDER BY accessed_at'):
+                    if self.size <= target:
+                        break
+                    keys.append((key,))
+                    self.size -= size
+                self.conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+                evicted += len(keys)
+        self._pending = 0
+        if evicted:
+            self.stats.inc_value('httpcache/evicted', evicted)
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
@@ -0,0 +1,122 @@
+"""
+Persistent per-app index used by incremental recrawls.
+
+The index maps each app id to the sitemap ``<lastmod>`` of the page that was
+last scraped for it, a hash of the scraped item and the scrape time. An
+incremental run only schedules apps that are new, whose ``<lastmod>`` moved
+past the indexed one, or whose last scrape is older than the max age.
+
+It also keeps each app's scrape history for freshness priorities (see
+``appstore_scraper.freshness``): when it was first scraped, how many times,
+how many of those scrapes found its tracked fields changed, and how many
+found its ``<lastmod>`` moved.
+"""
+
+import sqlite3
+
+NEW = 'new'
+REFRESHED = 'refreshed'
+SKIPPED = 'skipped'
+
+HISTORY_COLUMNS = (
+    ('first_scraped', 'REAL'),
+    ('scrapes', 'INTEGER NOT NULL DEFAULT 0'),
+    ('changes', 'INTEGER NOT NULL DEFAULT 0'),
+    ('page_changes', 'INTEGER NOT NULL DEFAULT 0'),
+    ('tracked_hash', 'TEXT'),
+)
+
+
+def classify(history, lastmod, max_age, now):
+    """Classify an app seen in the sitemap as NEW, REFRESHED or SKIPPED from its history."""
+    if history is None:
+        return NEW
+    indexed_lastmod, last_scraped = history[0], history[1]
+    if lastmod is not None and (indexed_lastmod is None or lastmod > indexed_lastmod):
+        return REFRESHED
+    if max_age and now - last_scraped > max_age:
+        return REFRESHED
+    return SKIPPED
+
+
+class AppIndex:
+    def __init__(self, path, commit_interval=1000):
+        self.path = path
+        self.commit_interval = commit_interval
+        self._pending = 0
+        # Another crawl may hold the write lock, so wait for it instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS apps ('
+            ' app_id INTEGER PRIMARY KEY,'
+            ' lastmod REAL,'
+            ' content_hash TEXT,'
+            ' last_scraped REAL,'
+            ' first_scraped REAL,'
+            ' scrapes INTEGER NOT NULL DEFAULT 0,'
+            ' changes INTEGER NOT NULL DEFAULT 0,'
+            ' page_changes INTEGER NOT NULL DEFAULT 0,'
+            ' tracked_hash TEXT)'
+        )
+        # Indexes written before the history columns existed get them added
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(apps)')}
+        for column, definition in HISTORY_COLUMNS:
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE apps ADD COLUMN {column} {definition}')
+
+    def get(self, app_id):
+        """Return ``(lastmod, content_hash, last_scraped)`` for an app, or None."""
+        return self.conn.execute(
+            'SELECT lastmod, content_hash, last_scraped FROM apps WHERE app_id = ?', (app_id,)
+        ).fetchone()
+
+    def history(self, app_id):
+        """Return ``(lastmod, last_scraped, first_scraped, scrapes, changes, page_changes)`` for an app, or None."""
+        return self.conn.execute(
+            'SELECT lastmod, last_scraped, first_scraped, scrapes, changes, page_changes FROM apps WHERE app_id = ?',
+            (app_id,),
+        ).fetchone()
+
+    def status(self, app_id, lastmod, max_age, now):
+        """Classify an app seen in the sitemap as NEW, REFRESHED or SKIPPED."""
+        return classify(self.history(app_id), lastmod, max_age, now)
+
+    def record(self, app_id, lastmod, content_hash, scraped_at, tracked_hash=None):
+        """
+        Store a scrape result and return True if the content changed.
+
+        ``tracked_hash`` is a hash of the fields whose changes are counted in
+        the app's history; a change is counted when it differs from the last one.
+        """
+        row = self.get(app_id)
+        # Columns on the right-hand side still hold the values before the update
+        self.conn.execute(
+            'INSERT INTO apps (app_id, lastmod, content_hash, last_scraped, first_scraped, scrapes, changes, tracked_hash)'
+            ' VALUES (?1, ?2, ?3, ?4, ?4, 1, 0, ?5)'
+            ' ON CONFLICT (app_id) DO UPDATE SET'
+            ' lastmod = COALESCE(excluded.lastmod, lastmod),'
+            ' content_hash = excluded.content_hash,'
+            ' last_scraped = excluded.last_scraped,'
+            ' first_scraped = COALESCE(first_scraped, last_scraped),'
+            ' scrapes = scrapes + 1,'
+            ' changes = changes + (tracked_hash IS NOT NULL AND excluded.tracked_hash IS NOT NULL'
+            ' AND tracked_hash != excluded.tracked_hash),'
+            ' page_changes = page_changes + (lastmod IS NOT NULL AND excluded.lastmod IS NOT NULL'
+            ' AND excluded.lastmod > lastmod),'
+            ' tracked_hash = COALESCE(excluded.tracked_hash, tracked_hash)',
+            (app_id, lastmod, content_hash, scraped_at, tracked_hash),
+        )
+        self._pending += 1
+        if self._pending >= self.commit_interval:
+            self.commit()
+        return row is None or row[1] != content_hash
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -3,13 +3,126 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
-import scrapy
+import dataclasses
 
+from itemadapter import ItemAdapter
+from itemadapter.adapter import DataclassAdapter
 
-class App(scrapy.Item):
-    # define the fields for your item here like:
-    name = scrapy.Field()
-    user_rating = scrapy.Field()
-    developer = scrapy.Field()
-    price = scrapy.Field()
-    url = scrapy.Field()
\ No newline at end of file
+# Fields extracted by default, as before field selection existed
+CORE_FIELDS = ('name', 'user_rating', 'developer', 'price', 'url')
+
+# Further fields the shoebox payload of an app page holds (see APP_FIELDS)
+EXTENDED_FIELDS = (
+    'bundle_id',
+    'subtitle',
+    'description',
+    'genres',
+    'content_rating',
+    'release_date',
+    'version',
+    'version_history',
+    'minimum_os_version',
+    'currency',
+    'screenshots',
+)
+
+ALL_FIELDS = CORE_FIELDS + EXTENDED_FIELDS
+
+
+@dataclasses.dataclass(init=False, repr=False, eq=False, slots=True)
+class App:
+    """
+    A scraped app, with the fields selected by ``APP_FIELDS``.
+
+    Values live in slots instead of a per-item dict, so an item in flight
+    costs a fraction of a ``scrapy.Item``. Fields that weren't extracted are
+    left unset rather than None, so feeds only contain the selected ones.
+    Use ``ItemAdapter`` to access the fields like a dict, once
+    ``register_adapter`` has been called (crawls do it in
+    ``AppAdapterExtension``).
+    """
+    name: object
+    user_rating: object
+    developer: object
+    price: object
+    url: object
+    # Replaces developer when developers go to their own feed (DEVELOPERS_FEED)
+    developer_id: object
+    # Country code -> price, availability and user rating (apps_storefronts spider)
+    storefronts: object
+    bundle_id: object
+    subtitle: object
+    description: object
+    genres: object
+    content_rating: object
+    release_date: object
+    version: object
+    # [{version, release_date, release_notes}], newest first
+    version_history: object
+    minimum_os_version: object
+    currency: object
+    # Device type -> screenshot URLs
+    screenshots: object
+
+    def __init__(self, fields=None, **kwargs):
+        for name, value in (fields or {}).items():
+            setattr(self, name, value)
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={value!r}' for name, value in ItemAdapter(self).items())
+        return f'App({fields})'
+
+
+class AppAdapter(DataclassAdapter):
+    """``ItemAdapter`` support for ``App``, whose unset fields are missing keys rather than errors."""
+
+    _fields_dict = {field.name: field for field in dataclasses.fields(App)}
+
+    def __init__(self, item):
+        # The fields are the same for every App, so skip looking them up per item
+        self.item = item
+
+    @classmethod
+    def is_item(cls, item):
+        return isinstance(item, App)
+
+    @classmethod
+    def is_item_class(cls, item_class):
+        return isinstance(item_class, type) and issubclass(item_class, App)
+
+    def __getitem__(self, field_name):
+        try:
+            return super().__getitem__(field_name)
+        except AttributeError:
+            raise KeyError(field_name) from None
+
+
+def register_adapter():
+    """Make ``ItemAdapter`` use ``AppAdapter`` for ``App`` items."""
+    if AppAdapter not in ItemAdapter.ADAPTER_CLASSES:
+        ItemAdapter.ADAPTER_CLASSES.appendleft(AppAdapter)
+
+
+@dataclasses.dataclass(slots=True)
+class Developer:
+    """A developer, exported once to the developers feed and referenced by ``App.developer_id``."""
+    id: object
+    name: object = None
+    url: object = None
+
+
+DEVELOPER_FIELDS = tuple(field.name for field in dataclasses.fields(Developer))
+
+
+def select_fields(names):
+    """Return the fields to extract for an ``APP_FIELDS`` setting, in item order; ``url`` is always included."""
+    names = set(names or CORE_FIELDS)
+    if names & {'*', 'all'}:
+        return ALL_FIELDS
+    unknown = names - set(ALL_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown app fields: {', '.join(sorted(unknown))} (known: {', '.join(ALL_FIELDS)})")
+    names.add('url')
+    return tuple(field for field in ALL_FIELDS if field in names)
@@ -0,0 +1,199 @@
+"""
+Low-overhead crawl metrics.
+
+``Metrics`` holds counters, gauges, per-stage latency histograms and
+rolling-window rates for one crawler. Components record into it as they work, and it is
+rendered in the Prometheus text exposition format by ``MetricsExtension`` (a
+textfile for the node exporter's textfile collector and/or a local HTTP
+endpoint). Recording is a dictionary update or a bucket increment, so it is
+safe to do on every response and item.
+"""
+
+import bisect
+import math
+import time
+import weakref
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Scrapy stats exported as counters, with the metric name and labels they map to
+EXPORTED_STATS = {
+    'retry/count': ('retries_total', {}),
+    'retry/max_reached': ('retries_exhausted_total', {}),
+    'downloader/exception_count': ('download_errors_total', {}),
+    'item_dropped_count': ('items_dropped_total', {}),
+    'dupefilter/filtered': ('duplicates_filtered_total', {}),
+}
+
+# Items yielded but not yet out of the pipelines, beyond which old stamps are dropped
+MAX_PENDING_ITEMS = 100000
+
+
+class RollingRate:
+    """Events per second over a sliding window, kept in one-second buckets."""
+
+    def __init__(self, window=60):
+        self.window = window
+        # One more bucket than the window for the current, incomplete second
+        self.size = window + 1
+        self.buckets = [0] * self.size
+        self.start = self.last = int(time.monotonic())
+
+    def _advance(self, second):
+        if second - self.last >= self.size:
+            self.buckets = [0] * self.size
+        else:
+            for s in range(self.last + 1, second + 1):
+                self.buckets[s % self.size] = 0
+        self.last = max(self.last, second)
+
+    def add(self, count=1, now=None):
+        second = int(time.monotonic() if now is None else now)
+        if second != self.last:
+            self._advance(second)
+        self.buckets[second % self.size] += count
+
+    def rate(self, seconds=None, now=None):
+        """Return the average rate over the last ``seconds`` complete seconds."""
+        second = int(time.monotonic() if now is None else now)
+        self._advance(second)
+        seconds = min(seconds or self.window, self.window, second - self.start)
+        if seconds <= 0:
+            return 0.0
+        return sum(self.buckets[(second - i) % self.size] for i in range(1, seconds + 1)) / seconds
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds, as in Prometheus."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Return the upper bound of the bucket holding the ``q`` quantile.
+
+        Values above the largest bound are reported as that bound, as JSON
+        (stats dumps, the metrics endpoint) has no infinity.
+        """
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return self.bounds[-1]
+
+
+class Metrics:
+    """Counters, gauges, latency histograms and rolling rates of a crawl."""
+
+    _crawlers = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_crawler(cls, crawler):
+        """Return the metrics of a crawler, shared by every component recording into them."""
+        metrics = cls._crawlers.get(crawler)
+        if metrics is None:
+            metrics = cls._crawlers[crawler] = cls()
+        return metrics
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.latencies = {}
+        self.rates = {}
+        self._item_starts = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value):
+        """Set the current value of a gauge, e.g. a queue depth."""
+        self.gauges[name] = value
+
+    def observe(self, stage, seconds):
+        """Record the latency of one request, response or item in a crawl stage."""
+        histogram = self.latencies.get(stage)
+        if histogram is None:
+            histogram = self.latencies[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def mark(self, name, count=1):
+        """Count events towards the rolling rate ``name``."""
+        rate = self.rates.get(name)
+        if rate is None:
+            rate = self.rates[name] = RollingRate()
+        rate.add(count)
+
+    def rate(self, name, seconds=10):
+        rate = self.rates.get(name)
+        return rate.rate(seconds) if rate else 0.0
+
+    def item_started(self, item):
+        """Remember when an item left the spider, to time the pipeline stage."""
+        if len(self._item_starts) >= MAX_PENDING_ITEMS:
+            self._item_starts.clear()
+        self._item_starts[id(item)] = time.perf_counter()
+
+    def item_finished(self, item):
+        start = self._item_starts.pop(id(item), None)
+        if start is not None:
+            self.observe('pipeline', time.perf_counter() - start)
+
+    def render_prometheus(self, stats=None, prefix='appstore_scraper'):
+        """Return the metrics (and exported Scrapy stats) in the Prometheus text format."""
+        lines = []
+        counters = dict(self.counters)
+        for stat, (name, labels) in EXPORTED_STATS.items():
+            value = (stats or {}).get(stat)
+            if value is not None:
+                counters[(name, tuple(sorted(labels.items())))] = value
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f'# TYPE {prefix}_{name} counter')
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f'{prefix}_{name}{_labels(labels)} {value}')
+
+        for name, value in sorted(self.gauges.items()):
+            lines.append(f'# TYPE {prefix}_{name} gauge')
+            lines.append(f'{prefix}_{name} {value}')
+
+        if self.rates:
+            lines.append(f'# TYPE {prefix}_rate_per_second gauge')
+            for name, rate in sorted(self.rates.items()):
+                for window in (10, 60):
+                    labels = (('name', name), ('window', f'{window}s'))
+                    lines.append(f'{prefix}_rate_per_second{_labels(labels)} {rate.rate(window):.3f}')
+
+        if self.latencies:
+            metric = f'{prefix}_stage_latency_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            for stage, histogram in sorted(self.latencies.items()):
+                total = 0
+                for bound, count in zip(histogram.bounds + (math.inf,), histogram.counts):
+                    total += count
+                    le = '+Inf' if bound == math.inf else repr(bound)
+                    lines.append(f'{metric}_bucket{_labels((("stage", stage), ("le", le)))} {total}')
+                lines.append(f'{metric}_sum{_labels((("stage", stage),))} {histogram.sum:.6f}')
+                lines.append(f'{metric}_count{_labels((("stage", stage),))} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
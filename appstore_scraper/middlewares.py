@@ -3,101 +3,497 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+import time
+from weakref import WeakKeyDictionary
+
+from scrapy import Request, signals
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.exceptions import IgnoreRequest, NotConfigured, StopDownload
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import task
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from appstore_scraper.checkpoint import checkpoint_saving
+from appstore_scraper.developers import (
+    DeveloperIndex, DeveloperTracker, SeenDevelopers, developer_from_app, feed_is_empty, feed_key,
+)
+from appstore_scraper.dupefilters import app_request_id
+from appstore_scraper.failures import DOWNLOAD, FailureLedger, classify_failure, ledger_entries
+from appstore_scraper.httpcache import app_parsed
+from appstore_scraper.items import App, Developer
+from appstore_scraper.metrics import Metrics
+from appstore_scraper.shoebox import ShoeboxScanner
+from appstore_scraper.throttle import HostController, parse_retry_after
+
 
 class AppstoreScraperSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    """
+    Records the pages that fail in the failure ledger (see ``appstore_scraper.failures``).
+
+    Exceptions raised while parsing a page are classified and recorded with
+    ``process_spider_exception``; pages that are parsed without one are
+    removed from the ledger. HTTP errors and download errors are recorded by
+    ``FailedDownloadMiddleware``. With ``FAILURES_RETRY``, the start
+    requests are replaced by the ledger entries that are due for a retry.
+    Adds ``failures/<class>``, ``failures/resolved``, ``failures/retried``
+    and ``failures/given_up`` stats.
+    """
+
+    def __init__(self, crawler, ledger):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.ledger = ledger
+        self.retry = settings.getbool('FAILURES_RETRY')
+        self.backoff = settings.getfloat('FAILURES_BACKOFF')
+        self.max_backoff = settings.getfloat('FAILURES_MAX_BACKOFF')
+        self.max_attempts = settings.getint('FAILURES_MAX_ATTEMPTS')
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        if not crawler.settings.get('FAILURES_LEDGER'):
+            raise NotConfigured
+        s = cls(crawler, FailureLedger.for_crawler(crawler))
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
-    def process_spider_input(self, response, spider):
-        # Called for each response that goes through the spider
-        # middleware and into the spider.
-
-        # Should return None or raise an exception.
-        return None
-
     def process_spider_output(self, response, result, spider):
-        # Called with the results returned from the Spider, after
-        # it has processed the response.
+        # Exceptions from the callback reach process_spider_exception first,
+        # so a page is only resolved once its output was produced in full
+        yield from result
+        self._resolve(response)
 
-        # Must return an iterable of Request, or item objects.
-        for i in result:
+    async def process_spider_output_async(self, response, result, spider):
+        async for i in result:
             yield i
+        self._resolve(response)
 
     def process_spider_exception(self, response, exception, spider):
-        # Called when a spider or process_spider_input() method
-        # (from other spider middleware) raises an exception.
-
-        # Should return either None or an iterable of Request or item objects.
-        pass
+        # HTTP errors were already recorded as responses, before HttpErrorMiddleware raised them
+        if isinstance(exception, HttpError):
+            return None
+        detail = f'{type(exception).__name__}: {exception}'[:200]
+        record_failure(self.ledger, self.stats, response.request, classify_failure(exception), response.status, detail)
+        # Let other middlewares (and Scrapy's error logging) see the exception too
+        return None
 
     def process_start_requests(self, start_requests, spider):
-        # Called with the start requests of the spider, and works
-        # similarly to the process_spider_output() method, except
-        # that it doesn’t have a response associated.
-
-        # Must return only requests (not items).
-        for r in start_requests:
-            yield r
+        if not self.retry:
+            yield from start_requests
+            return
+        # Retry mode: only the ledger's due entries, not the sitemap
+        due, given_up = self.ledger.due(
+            backoff=self.backoff, max_backoff=self.max_backoff, max_attempts=self.max_attempts
+        )
+        self.stats.set_value('failures/retried', len(due))
+        self.stats.set_value('failures/given_up', given_up)
+        for url, callback, lastmod in due:
+            meta = {'lastmod': lastmod} if lastmod is not None else {}
+            yield Request(url, callback=getattr(spider, callback), meta=meta, dont_filter=True)
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
 
+    def _resolve(self, response):
+        request = response.request
+        for url, _, _ in ledger_entries(request):
+            if self.ledger.resolve(url):
+                self.stats.inc_value('failures/resolved')
+
+
+def record_failure(ledger, stats, request, failure, status=None, detail=None):
+    """Record the pages a failed request stands for in the failure ledger."""
+    for url, callback, lastmod in ledger_entries(request):
+        if ledger.record(url, callback, lastmod, failure, status, detail):
+            stats.inc_value(f'failures/{failure}')
+
 
 class AppstoreScraperDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    """
+    Adaptive per-host throttling (see ``appstore_scraper.throttle``).
+
+    Requests to each host are paced by that host's token bucket, and the
+    host's downloader slot concurrency follows its controller. Throttling
+    responses (``ADAPTIVE_BACKOFF_HTTP_CODES``) and download errors back
+    off the host before RetryMiddleware retries them, so this middleware
+    has to sit between RetryMiddleware (550) and the downloader. It also
+    sits after the HTTP cache (900): requests the cache answers never reach
+    it, and don't take a token from the bucket or wait for one.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.backoff_codes = set(settings.getlist('ADAPTIVE_BACKOFF_HTTP_CODES'))
+        self.controller_args = {
+            'concurrency': settings.getint('ADAPTIVE_START_CONCURRENCY'),
+            'rate': settings.getfloat('ADAPTIVE_START_RATE'),
+            'max_concurrency': settings.getint('ADAPTIVE_MAX_CONCURRENCY'),
+            'min_rate': settings.getfloat('ADAPTIVE_MIN_RATE'),
+            'max_rate': settings.getfloat('ADAPTIVE_MAX_RATE'),
+            'backoff_factor': settings.getfloat('ADAPTIVE_BACKOFF_FACTOR'),
+            'latency_tolerance': settings.getfloat('ADAPTIVE_LATENCY_TOLERANCE'),
+        }
+        self.controllers = {}
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        if not crawler.settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+        s = cls(crawler)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
     def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
-        return None
+        key, controller = self._controller(request)
+        self._apply(key, controller)
+        delay = controller.delay()
+        if delay <= 0:
+            return None
+        # Hold the request back until the host's bucket allows it
+        self.stats.inc_value('throttle/delayed')
+        from twisted.internet import reactor
+        return task.deferLater(reactor, delay, lambda: None)
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
-
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        # Cached responses say nothing about the host
+        if 'cached' in response.flags:
+            return response
+        key, controller = self._controller(request)
+        if response.status in self.backoff_codes:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            self._backoff(key, controller, retry_after)
+        else:
+            controller.on_success(request.meta.get('download_latency'))
+        self._apply(key, controller)
         return response
 
     def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
-
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+        key, controller = self._controller(request)
+        self._backoff(key, controller)
+        self._apply(key, controller)
+        return None
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+    def _controller(self, request):
+        key = request.meta.get('download_slot') or urlparse_cached(request).hostname or ''
+        controller = self.controllers.get(key)
+        if controller is None:
+            controller = self.controllers[key] = HostController(**self.controller_args)
+        return key, controller
+
+    def _backoff(self, key, controller, retry_after=None):
+        if retry_after:
+            self.stats.inc_value('throttle/retry_after')
+        if controller.on_backoff(retry_after):
+            self.stats.inc_value('throttle/backoffs')
+            self.stats.inc_value(f'throttle/{key}/backoffs')
+
+    def _apply(self, key, controller):
+        """Size the host's downloader slot and publish the controller state in the stats."""
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            slot.concurrency = int(controller.concurrency)
+        self.stats.set_value(f'throttle/{key}/concurrency', int(controller.concurrency))
+        self.stats.set_value(f'throttle/{key}/rate', round(controller.rate, 2))
+        self.stats.set_value(f'throttle/{key}/delay', round(1 / controller.rate, 4))
+
+
+class AppCacheMiddleware(HttpCacheMiddleware):
+    """
+    HTTP cache middleware that also reports how well the cache works.
+
+    Adds ``httpcache/bytes_saved`` (size of the bodies a 304 spared
+    downloading) and ``httpcache/hit_rate`` (fresh hits and revalidations
+    over all cache lookups) to the stats. Use it with
+    ``appstore_scraper.httpcache.AppCacheStorage``, which records the
+    original body size of cached responses.
+
+    The fields sent with ``app_parsed`` are stored with the cached page, and
+    passed on in ``request.meta['httpcache_fields']`` while the page is
+    served from the cache, for the spider to skip parsing it.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        mw = super().from_crawler(crawler)
+        if hasattr(mw.storage, 'store_fields'):
+            crawler.signals.connect(mw.store_fields, signal=app_parsed)
+        return mw
+
+    def process_response(self, request, response, spider):
+        cachedresponse = request.meta.get('cached_response')
+        result = super().process_response(request, response, spider)
+        if cachedresponse is not None and result is cachedresponse:
+            length = request.meta.get('httpcache_length', len(cachedresponse.body))
+            self.stats.inc_value('httpcache/bytes_saved', length, spider=spider)
+        if 'cached' not in result.flags:
+            # The page changed, so the stored fields are stale
+            request.meta.pop('httpcache_fields', None)
+        self._update_hit_rate(spider)
+        return result
+
+    def store_fields(self, fields, response, spider):
+        self.storage.store_fields(spider, response.request, fields)
+
+    def _update_hit_rate(self, spider):
+        hits = self.stats.get_value('httpcache/hit', 0, spider=spider) + self.stats.get_value('httpcache/revalidate', 0, spider=spider)
+        lookups = hits + sum(
+            self.stats.get_value(f'httpcache/{name}', 0, spider=spider) for name in ('miss', 'invalidate')
+        )
+        if lookups:
+            self.stats.set_value('httpcache/hit_rate', round(hits / lookups, 4), spider=spider)
+
+
+class PartialBodyMiddleware:
+    """
+    Stops downloading app pages once their shoebox script has been received.
+
+    App page requests ask for gzip or deflate, the encodings the body can be
+    scanned in while it streams in, and the download is stopped with
+    ``StopDownload(fail=False)`` as soon as the script is complete. The
+    truncated body is decoded by HttpCompressionMiddleware and parsed as
+    usual; the response has the ``download_stopped`` flag. A stopped
+    download loses its connection, so bodies of known length with less than
+    ``PARTIAL_BODY_MIN_SKIP`` bytes left are downloaded in full instead.
+    Adds the ``partial_body/stopped``, ``partial_body/not_stopped``,
+    ``partial_body/bytes_received`` (raw body bytes of app pages) and
+    ``partial_body/bytes_skipped`` (the rest of the bodies stopped early,
+    when their length is known) stats.
+    """
+
+    ACCEPT_ENCODING = b'gzip, deflate'
+
+    def __init__(self, stats, min_skip=0):
+        self.stats = stats
+        self.min_skip = min_skip
+        self.scanners = WeakKeyDictionary()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PARTIAL_BODY_ENABLED'):
+            raise NotConfigured
+        mw = cls(crawler.stats, crawler.settings.getint('PARTIAL_BODY_MIN_SKIP'))
+        crawler.signals.connect(mw.headers_received, signal=signals.headers_received)
+        crawler.signals.connect(mw.bytes_received, signal=signals.bytes_received)
+        return mw
+
+    def process_request(self, request, spider):
+        # Runs before HttpCompressionMiddleware, which would also offer encodings the scanner can't read
+        if app_request_id(request) is not None:
+            request.headers.setdefault(b'Accept-Encoding', self.ACCEPT_ENCODING)
+
+    def headers_received(self, headers, body_length, request, spider):
+        if app_request_id(request) is None:
+            return
+        scanner = ShoeboxScanner(headers.get(b'Content-Encoding'))
+        if not scanner.scannable:
+            self.stats.inc_value('partial_body/unscannable')
+            return
+        self.scanners[request] = (scanner, body_length)
+
+    def bytes_received(self, data, request, spider):
+        state = self.scanners.get(request)
+        if state is None:
+            return
+        scanner, body_length = state
+        self.stats.inc_value('partial_body/bytes_received', len(data))
+        if not scanner.feed(data):
+            return
+        del self.scanners[request]
+        skipped = body_length - scanner.received if body_length > 0 else None
+        if skipped is not None and skipped < self.min_skip:
+            self.stats.inc_value('partial_body/not_stopped')
+            return
+        self.stats.inc_value('partial_body/stopped')
+        if skipped is not None:
+            self.stats.inc_value('partial_body/bytes_skipped', skipped)
+        raise StopDownload(fail=False)
+
+
+class DeveloperMiddleware:
+    """
+    Moves the developers of apps to the developers feed (see ``appstore_scraper.developers``).
+
+    Each app's ``developer`` is replaced by its ``developer_id``, and the
+    developer is emitted as a ``Developer`` item ahead of the app when it is
+    new to the run or changed since it was last exported. Adds
+    ``developers/emitted`` and ``developers/skipped`` stats.
+    """
+
+    def __init__(self, stats, tracker):
+        self.stats = stats
+        self.tracker = tracker
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.get('DEVELOPERS_FEED'):
+            raise NotConfigured
+        index = None
+        if settings.get('DEVELOPERS_INDEX'):
+            feed = settings.get('DEVELOPERS_FEED')
+            index = DeveloperIndex(settings.get('DEVELOPERS_INDEX'), feed_key(feed))
+            if feed_is_empty(feed):
+                # Developers exported to an earlier file of this name aren't in this one
+                index.reset()
+        tracker = DeveloperTracker(SeenDevelopers(settings.getint('DEVELOPERS_SEEN_MAX', 100000)), index)
+        mw = cls(crawler.stats, tracker)
+        crawler.signals.connect(mw.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(mw.checkpoint_saving, signal=checkpoint_saving)
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    def process_spider_output(self, response, result, spider):
+        for output in result:
+            yield from self._split(output)
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for output in result:
+            for i in self._split(output):
+                yield i
+
+    def _split(self, output):
+        """Return the outputs replacing one callback output: the app and, if it has to be emitted, its developer."""
+        if not isinstance(output, App):
+            return (output,)
+        developer = developer_from_app(output)
+        if developer is None:
+            return (output,)
+        del output.developer
+        output.developer_id = developer.id
+        if not self.tracker.should_emit(developer):
+            self.stats.inc_value('developers/skipped')
+            return (output,)
+        self.stats.inc_value('developers/emitted')
+        return (developer, output)
+
+    def item_scraped(self, item, spider):
+        # Only developers that reached the feed count as exported in later runs
+        if isinstance(item, Developer):
+            self.tracker.exported(item)
+
+    def checkpoint_saving(self, spider):
+        # The checkpoint keeps the developers feed up to here, so its developers stay exported
+        self.tracker.commit()
+
+    def spider_closed(self, spider):
+        self.tracker.close()
+
+
+class CallbackTimingMiddleware:
+    """
+    Records the time spent in spider callbacks.
+
+    Adds ``callback/<name>/time`` (seconds) and ``callback/<name>/count``
+    stats and the ``parse`` stage latency metric, and marks when each item
+    leaves the spider so its ``pipeline`` stage can be timed. It should be
+    the middleware closest to the spider, so that only the callback itself
+    runs while its output is being pulled. Callbacks are timed while they
+    produce output, so only generator callbacks are measured in full.
+
+    While a crawl is profiled, ``ProfilingExtension`` sets ``timings``, and
+    the callbacks that aren't async generators are timed with it instead, as
+    ``callback/<name>`` sections of the profile.
+    """
+
+    def __init__(self, stats, metrics):
+        self.stats = stats
+        self.metrics = metrics
+        self.timings = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CALLBACK_TIMING_ENABLED', True):
+            raise NotConfigured
+        return cls(crawler.stats, Metrics.for_crawler(crawler))
+
+    def process_spider_output(self, response, result, spider):
+        name = self._callback_name(response)
+        timings = self.timings
+        elapsed = 0.0
+        try:
+            iterator = iter(result)
+            while True:
+                start = time.perf_counter() if timings is None else timings.start()
+                try:
+                    output = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    if timings is None:
+                        elapsed += time.perf_counter() - start
+                    else:
+                        elapsed += timings.stop(f'callback/{name}', start, calls=0)
+                if not isinstance(output, Request):
+                    self.metrics.item_started(output)
+                yield output
+        finally:
+            if timings is not None:
+                timings.count(f'callback/{name}')
+            self._record(name, elapsed)
+
+    async def process_spider_output_async(self, response, result, spider):
+        name = self._callback_name(response)
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    output = await result.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start
+                if not isinstance(output, Request):
+                    self.metrics.item_started(output)
+                yield output
+        finally:
+            self._record(name, elapsed)
+
+    def _callback_name(self, response):
+        callback = getattr(response.request, 'callback', None)
+        return getattr(callback, '__name__', None) or 'parse'
+
+    def _record(self, name, elapsed):
+        self.stats.inc_value(f'callback/{name}/time', elapsed)
+        self.stats.inc_value(f'callback/{name}/count')
+        self.metrics.observe('parse', elapsed)
+
+
+class FailedDownloadMiddleware:
+    """
+    Records the requests that end in an HTTP error or a download error in the failure ledger.
+
+    It sits below RetryMiddleware (550), so it only sees a request's final
+    response or error, once its retries are used up.
+    """
+
+    def __init__(self, stats, ledger):
+        self.stats = stats
+        self.ledger = ledger
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.get('FAILURES_LEDGER'):
+            raise NotConfigured
+        return cls(crawler.stats, FailureLedger.for_crawler(crawler))
+
+    def process_response(self, request, response, spider):
+        if not 200 <= response.status < 300:
+            record_failure(self.ledger, self.stats, request, classify_failure(None, response.status), response.status)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        # Dropped requests (e.g. by the throttle or robots.txt) didn't fail
+        if not isinstance(exception, IgnoreRequest):
+            detail = f'{type(exception).__name__}: {exception}'[:200]
+            record_failure(self.ledger, self.stats, request, DOWNLOAD, None, detail)
+        return None
@@ -0,0 +1,197 @@
+"""
+App page parsing, inline or in a pool of worker processes.
+
+``parse_app_page`` turns the body of an app page into the plain field dict
+of an ``App`` item, with the fields selected by ``APP_FIELDS``.
+``AppsSpider`` calls it inline by default. With ``PARSE_WORKERS`` set,
+response bodies are sent to a ``ParsePool`` of worker processes instead, so
+that parsing large pages doesn't stall the reactor and can use more than
+one core. At most ``PARSE_MAX_PENDING`` pages are submitted at a time;
+callbacks wait for a free slot beyond that, which holds the responses in
+Scrapy's scraper slot and so slows down downloads once parsing falls
+behind.
+"""
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from parsel import Selector
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet.defer import Deferred, DeferredSemaphore
+
+from appstore_scraper.items import CORE_FIELDS
+from appstore_scraper.shoebox import SHOEBOX_XPATH, decode_shoebox, extract_app_data
+
+BASE_URL = 'https://apps.apple.com'
+
+
+def _ios(data):
+    return data['attributes']['platformAttributes']['ios']
+
+
+def artwork_url(artwork):
+    """Return the full-size URL of an artwork record, whose URL is a ``{w}x{h}{c}.{f}`` template."""
+    template = (artwork or {}).get('url')
+    if not template:
+        return None
+    return (template.replace('{w}', str(artwork.get('width', '')))
+            .replace('{h}', str(artwork.get('height', '')))
+            .replace('{c}', 'bb')
+            .replace('{f}', 'png'))
+
+
+def _genres(data):
+    genres = (data.get('relationships', {}).get('genres') or {}).get('data')
+    if genres:
+        return [genre['attributes']['name'] for genre in genres if 'attributes' in genre]
+    name = data['attributes'].get('genreDisplayName')
+    return [name] if name else []
+
+
+def _content_rating(data):
+    ratings = data['attributes'].get('contentRatingsBySystem') or {}
+    return (ratings.get('appsApple') or {}).get('name')
+
+
+def _version_history(data):
+    return [
+        {
+            'version': entry.get('versionDisplay'),
+            'release_date': entry.get('releaseDate'),
+            'release_notes': entry.get('releaseNotes'),
+        }
+        for entry in _ios(data).get('versionHistory') or ()
+    ]
+
+
+def _version(data):
+    history = _ios(data).get('versionHistory')
+    return history[0].get('versionDisplay') if history else None
+
+
+def _screenshots(data):
+    ios = _ios(data)
+    custom = ((ios.get('customAttributes') or {}).get('default') or {}).get('default') or {}
+    by_type = custom.get('customScreenshotsByType') or ios.get('screenshotsByType') or {}
+    return {device: [artwork_url(artwork) for artwork in artworks] for device, artworks in by_type.items()}
+
+
+# How each field other than url is read from a shoebox app record. The core
+# fields fail on records without them; extended fields are None if missing
+FIELD_EXTRACTORS = {
+    'name': lambda data: data['attributes']['name'],
+    'user_rating': lambda data: data['attributes']['userRating'],
+    'developer': lambda data: data['relationships']['developer'],
+    'price': lambda data: _ios(data)['offers'][0]['price'],
+    'bundle_id': lambda data: _ios(data).get('bundleId'),
+    'subtitle': lambda data: _ios(data).get('subtitle'),
+    'description': lambda data: (_ios(data).get('description') or {}).get('standard'),
+    'genres': _genres,
+    'content_rating': _content_rating,
+    'release_date': lambda data: _ios(data).get('releaseDate'),
+    'version': _version,
+    'version_history': _version_history,
+    'minimum_os_version': lambda data: _ios(data).get('minimumOSVersion'),
+    'currency': lambda data: (_ios(data).get('offers') or [{}])[0].get('currencyCode'),
+    'screenshots': _screenshots,
+}
+
+
+def app_fields(data, url, fields=CORE_FIELDS):
+    """Return the ``fields`` of a decoded shoebox app record, as ``App`` fields."""
+    record = {}
+    for field in fields:
+        if field == 'url':
+            record['url'] = url.replace(BASE_URL, '')  # Strip base URL from the app URL
+        else:
+            record[field] = FIELD_EXTRACTORS[field](data)
+    return record
+
+
+def parse_app_page(body, url, fields=CORE_FIELDS):
+    """Return the ``App`` fields of an app page body."""
+    # Scan the raw bytes for the shoebox script first and only fall back
+    # to building the DOM when the fast path can't locate it
+    data = extract_app_data(body)
+    if data is None:
+        script = Selector(body=body, type='html').xpath(SHOEBOX_XPATH).get()
+        data = decode_shoebox(script)
+    return app_fields(data, url, fields)
+
+
+def _parse_job(body, url, fields):
+    started = time.perf_counter()
+    return parse_app_page(body, url, fields), time.perf_counter() - started
+
+
+class ParsePool:
+    """Worker processes parsing app pages, with a bounded number of pages in flight."""
+
+    def __init__(self, workers, max_pending=0, stats=None, metrics=None):
+        self.workers = workers
+        self.max_pending = max_pending or 2 * workers
+        self.stats = stats
+        self.metrics = metrics
+        self.semaphore = DeferredSemaphore(self.max_pending)
+        self.executor = None
+
+    def start(self):
+        # Fork a clean server process rather than the crawler with its reactor and open files
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=context)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    @property
+    def pending(self):
+        return self.max_pending - self.semaphore.tokens
+
+    async def parse(self, body, url, fields=CORE_FIELDS):
+        """Parse an app page in a worker and return its ``App`` fields."""
+        started = time.perf_counter()
+        await maybe_deferred_to_future(self.semaphore.acquire())
+        waited = time.perf_counter() - started
+        try:
+            self._record_submit(waited)
+            record, parse_time = await maybe_deferred_to_future(self._submit(body, url, fields))
+        finally:
+            self.semaphore.release()
+        if self.stats is not None:
+            self.stats.inc_value('parse_pool/parse_time', parse_time)
+        if self.metrics is not None:
+            self.metrics.observe('parse_worker', parse_time)
+            self.metrics.observe('parse_pool', time.perf_counter() - started)
+        return record
+
+    def _submit(self, body, url, fields):
+        from twisted.internet import reactor
+        deferred = Deferred()
+        future = self.executor.submit(_parse_job, body, url, fields)
+
+        def done(future):
+            # Called in the executor's management thread
+            if future.cancelled():
+                reactor.callFromThread(deferred.cancel)
+                return
+            error = future.exception()
+            if error is None:
+                reactor.callFromThread(deferred.callback, future.result())
+            else:
+                reactor.callFromThread(deferred.errback, error)
+
+        future.add_done_callback(done)
+        return deferred
+
+    def _record_submit(self, waited):
+        pending = self.pending
+        if self.stats is not None:
+            self.stats.inc_value('parse_pool/jobs')
+            self.stats.inc_value('parse_pool/wait_time', waited)
+            self.stats.max_value('parse_pool/max_pending', pending)
+        if self.metrics is not None:
+            self.metrics.gauge('parse_queue_depth', pending + len(self.semaphore.waiting))
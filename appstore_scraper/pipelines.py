@@ -3,11 +3,134 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import time
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from appstore_scraper.cdc import DELETE, ChangeIndex, EventWriter, app_listed
+from appstore_scraper.items import App
+from appstore_scraper.store import AppStore
+from appstore_scraper.utils import app_id_from_url
 
 
 class AppstoreScraperPipeline:
+    """
+    Upserts scraped apps into the local SQLite store (see ``appstore_scraper.store``).
+
+    Items are written in transactions of ``APPSTORE_DB_BATCH_SIZE``; whatever
+    is still buffered is written when the spider closes, including on pause.
+    """
+
+    def __init__(self, path, batch_size, stats):
+        self.path = path
+        self.batch_size = batch_size
+        self.stats = stats
+        self.store = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('APPSTORE_DB_PATH')
+        if not path:
+            raise NotConfigured
+        return cls(path, crawler.settings.getint('APPSTORE_DB_BATCH_SIZE', 1000), crawler.stats)
+
+    def open_spider(self, spider):
+        self.store = AppStore(self.path, self.batch_size)
+
     def process_item(self, item, spider):
+        # Developers exported on their own (DEVELOPERS_FEED) aren't apps
+        if not isinstance(item, App):
+            return item
+        if self.store.upsert(item, time.time()) is not None:
+            self.stats.inc_value('appstore_db/upserts')
         return item
+
+    def close_spider(self, spider):
+        self.store.close()
+
+
+class ChangeCapturePipeline:
+    """
+    Writes insert/update/delete events of changed apps to ``CDC_EVENTS_FILE`` (see ``appstore_scraper.cdc``).
+
+    Deletes are only written when a run finishes, for the apps its sitemap
+    no longer listed. They are skipped when the run didn't see the whole
+    sitemap (a sitemap failed, see ``listing_incomplete``) or didn't read it
+    at all (``FAILURES_RETRY``). If they would remove more than
+    ``CDC_MAX_DELETE_RATIO`` of the index, they are held back as well, since
+    a sitemap that lost entries without failing looks the same.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.index_path = settings.get('CDC_INDEX')
+        self.events_path = settings.get('CDC_EVENTS_FILE')
+        self.commit_interval = settings.getint('CDC_COMMIT_INTERVAL', 1000)
+        self.max_delete_ratio = settings.getfloat('CDC_MAX_DELETE_RATIO', 0.5)
+        # Retry runs only request failed pages, so they list nothing
+        self.retry = settings.getbool('FAILURES_RETRY')
+        self.index = None
+        self.events = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CDC_ENABLED'):
+            raise NotConfigured
+        pipeline = cls(crawler)
+        crawler.signals.connect(pipeline.app_listed, signal=app_listed)
+        # Closed on spider_closed rather than in close_spider, which doesn't know whether the run finished
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.events = EventWriter(self.events_path)
+        self.index = ChangeIndex(self.index_path, self.commit_interval, before_commit=self.events.sync)
+
+    def app_listed(self, app_id):
+        if app_id is not None:
+            self.index.listed(app_id)
+
+    def process_item(self, item, spider):
+        if not isinstance(item, App):
+            return item
+        adapter = ItemAdapter(item)
+        app_id = app_id_from_url(adapter.get('url') or '')
+        if app_id is None:
+            return item
+        event, fields = self.index.compare(app_id, dict(adapter))
+        if event is None:
+            self.stats.inc_value('cdc/unchanged')
+        else:
+            self.stats.inc_value(f'cdc/{event}')
+            self.stats.inc_value('cdc/bytes', self.events.write(event, app_id, self.index.run, fields))
+        return item
+
+    def spider_closed(self, spider, reason):
+        if reason == 'finished':
+            self.finish_run(spider)
+        self.index.close()
+        self.events.close()
+
+    def finish_run(self, spider):
+        if self.retry or getattr(spider, 'listing_incomplete', False):
+            spider.logger.warning("Not writing deletes: this run didn't list every app in the sitemap")
+            self.stats.set_value('cdc/deletes_skipped', len(self.index.unlisted()))
+            self.index.finish_run([])
+            return
+        deleted = self.index.unlisted()
+        size = self.index.size()
+        if deleted and len(deleted) > self.max_delete_ratio * size:
+            spider.logger.error(
+                "Not deleting %d of %d apps missing from the sitemap (more than CDC_MAX_DELETE_RATIO)",
+                len(deleted), size,
+            )
+            self.stats.set_value('cdc/deletes_held', len(deleted))
+            deleted = []
+        for app_id in deleted:
+            self.stats.inc_value('cdc/bytes', self.events.write(DELETE, app_id, self.index.run))
+        self.stats.set_value(f'cdc/{DELETE}', len(deleted))
+        self.index.finish_run(deleted)
@@ -0,0 +1,460 @@
+"""
+Profiling of crawl runs.
+
+With ``PROFILE_ENABLED`` (``run_spider.py --profile``), ``ProfilingExtension``
+instruments the hot path once the spider opens, and records the wall and CPU
+time (of the reactor thread) spent in each of:
+
+- ``callback/<name>``: spider callbacks, while they produce output, as timed
+  by ``CallbackTimingMiddleware`` (so not with ``CALLBACK_TIMING_ENABLED``
+  off, nor for callbacks that are async generators)
+- ``spidermw/<Middleware>.<method>``, ``downloadermw/<Middleware>.<method>``
+  and ``pipeline/<Pipeline>.process_item``
+- ``scheduler/enqueue_request`` and ``scheduler/next_request`` (the disk
+  queue of JOBDIR crawls)
+- ``signal/<signal>/<Receiver>.<method>``: receivers of ``item_scraped``
+  (feed export among them) and ``response_received``
+
+Times are exclusive: a middleware pulling output from the callback isn't
+charged for the callback. Methods that return a Deferred or a coroutine are
+only timed until they return, and what happens in the network is left out,
+so the time that isn't in any section is mostly spent waiting.
+
+There is no public API for any of this: the components are instrumented
+through the internals of the Scrapy versions in
+``ProfilingExtension.VERSIONS``, and with other versions only the memory
+snapshots and dumps below are taken.
+
+Every ``PROFILE_TRACEMALLOC_INTERVAL`` seconds a ``tracemalloc`` snapshot
+records the ``PROFILE_TRACEMALLOC_TOP`` lines that hold the most memory and
+how much each grew since the last snapshot. Tracing allocations slows the
+crawl down noticeably, so it is off (0) by default.
+
+Sending ``PROFILE_DUMP_SIGNAL`` (``SIGUSR1``) to the crawl writes the report
+so far to ``<report>.<n>.json`` and profiles the next
+``PROFILE_CPROFILE_SECONDS`` seconds with ``cProfile`` into
+``<report>.<n>.pstats``, while the crawl carries on. The final report is
+written to ``PROFILE_REPORT`` when the spider closes. Reports of two runs
+are compared with::
+
+    python -m appstore_scraper.profiling profile.json --baseline profile-before.json
+"""
+
+import argparse
+import cProfile
+import functools
+import json
+import logging
+import os
+import signal
+import time
+import tracemalloc
+from inspect import isasyncgenfunction
+
+from pydispatch import dispatcher
+from pydispatch.robustapply import robustApply
+import scrapy
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from appstore_scraper.middlewares import CallbackTimingMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Signals whose receivers are timed, as they run for every response or item
+TIMED_SIGNALS = ('response_received', 'item_scraped')
+DOWNLOADER_METHODS = ('process_request', 'process_response', 'process_exception')
+SPIDER_METHODS = ('process_spider_input', 'process_spider_exception')
+# Allocations of the profiler itself and of imports aren't worth reporting
+TRACEMALLOC_IGNORED = (
+    tracemalloc.__file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>', '<unknown>',
+)
+
+
+class Timings:
+    """Calls, wall and CPU time of named sections, excluding the sections nested in them."""
+
+    def __init__(self):
+        # name -> [calls, wall, cpu]
+        self.sections = {}
+        # Wall and CPU time of the sections nested in each running one
+        self._nested = []
+
+    def start(self):
+        self._nested.append([0.0, 0.0])
+        return time.perf_counter(), time.thread_time()
+
+    def stop(self, name, started, calls=1):
+        """Charge a section started with ``start`` to ``name``, and return its wall time, nested sections included."""
+        wall = time.perf_counter() - started[0]
+        cpu = time.thread_time() - started[1]
+        nested_wall, nested_cpu = self._nested.pop()
+        if self._nested:
+            self._nested[-1][0] += wall
+            self._nested[-1][1] += cpu
+        section = self.sections.get(name)
+        if section is None:
+            section = self.sections[name] = [0, 0.0, 0.0]
+        section[0] += calls
+        section[1] += wall - nested_wall
+        section[2] += cpu - nested_cpu
+        return wall
+
+    def count(self, name, calls=1):
+        section = self.sections.get(name)
+        if section is None:
+            section = self.sections[name] = [0, 0.0, 0.0]
+        section[0] += calls
+
+    def call(self, name, func, *args, **kwargs):
+        started = self.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.stop(name, started)
+
+    def iterate(self, name, iterable):
+        """Yield from ``iterable``, timing the work done to produce each value; one call in all."""
+        iterator = iter(iterable)
+        while True:
+            started = self.start()
+            try:
+                output = next(iterator)
+            except StopIteration:
+                self.stop(name, started)
+                return
+            except BaseException:
+                self.stop(name, started)
+                raise
+            self.stop(name, started, calls=0)
+            yield output
+
+    def wrap(self, name, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            return self.call(name, func, *args, **kwargs)
+        return timed
+
+    def report(self):
+        return {
+            name: {'calls': calls, 'wall': round(wall, 6), 'cpu': round(cpu, 6)}
+            for name, (calls, wall, cpu) in sorted(self.sections.items())
+        }
+
+
+def component_name(method):
+    """Return ``Class.method`` for a bound method, with the class of the instance rather than the one defining it."""
+    method = getattr(method, '__wrapped__', method)
+    owner = getattr(method, '__self__', None)
+    if owner is None:
+        return getattr(method, '__qualname__', repr(method))
+    return f'{type(owner).__name__}.{method.__name__}'
+
+
+def allocation_top(snapshot, previous=None, limit=10):
+    """Return the lines holding the most memory in ``snapshot``, with their growth since ``previous``."""
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, pattern) for pattern in TRACEMALLOC_IGNORED])
+    if previous is not None:
+        stats = snapshot.compare_to(previous, 'lineno')
+    else:
+        stats = snapshot.statistics('lineno')
+    stats.sort(key=lambda stat: stat.size, reverse=True)
+    top = []
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        top.append({
+            'location': f'{frame.filename}:{frame.lineno}',
+            'size': stat.size,
+            'count': stat.count,
+            'size_diff': getattr(stat, 'size_diff', stat.size),
+        })
+    return top
+
+
+class TimedReceiver:
+    """
+    Times a signal receiver, standing in for it in the dispatcher's receivers.
+
+    It takes the place of the receiver's reference, so receivers still run in
+    the order they were connected in, and compares equal to that reference, so
+    disconnecting the receiver removes it.
+    """
+
+    def __init__(self, timings, name, ref):
+        self.timings = timings
+        self.name = name
+        self.ref = ref
+
+    def __call__(self, **kwargs):
+        receiver = self.ref() if isinstance(self.ref, dispatcher.WEAKREF_TYPES) else self.ref
+        if receiver is None:
+            return None
+        return self.timings.call(self.name, robustApply, receiver, **kwargs)
+
+    def __eq__(self, other):
+        return other is self or self.ref == other
+
+    def __hash__(self):
+        return hash(self.ref)
+
+
+class ProfilingExtension:
+    """Times the hot path of a crawl, samples its memory, and writes a profile report."""
+
+    # Scrapy versions whose engine, middleware managers and scheduler are laid
+    # out the way instrument() expects
+    VERSIONS = ((2, 6), (2, 12))
+
+    def __init__(self, crawler, report_path, tracemalloc_interval=0, tracemalloc_top=10, dump_signal='SIGUSR1',
+                 cprofile_seconds=10):
+        self.crawler = crawler
+        self.report_path = report_path
+        self.tracemalloc_interval = tracemalloc_interval
+        self.tracemalloc_top = tracemalloc_top
+        self.dump_signal = getattr(signal, dump_signal, None) if dump_signal else None
+        self.cprofile_seconds = cprofile_seconds
+        self.timings = Timings()
+        self.memory = {'snapshots': []}
+        self.dumps = 0
+        self.task = None
+        self.profiler = None
+        self._snapshot = None
+        self._started = None
+        self._started_cpu = None
+        self._started_tracemalloc = False
+        self._previous_handler = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PROFILE_ENABLED'):
+            raise NotConfigured
+        ext = cls(
+            crawler, settings.get('PROFILE_REPORT'), settings.getfloat('PROFILE_TRACEMALLOC_INTERVAL'),
+            settings.getint('PROFILE_TRACEMALLOC_TOP', 10), settings.get('PROFILE_DUMP_SIGNAL'),
+            settings.getfloat('PROFILE_CPROFILE_SECONDS', 10),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self._started = time.perf_counter()
+        self._started_cpu = time.process_time()
+        if self.instrumentation_supported():
+            self.instrument()
+        else:
+            logger.warning("Profiling can't time the crawl with Scrapy %s; only memory and dumps are recorded",
+                           scrapy.__version__)
+        if self.tracemalloc_interval > 0:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            self.task = task.LoopingCall(self.take_snapshot)
+            self.task.start(self.tracemalloc_interval, now=False)
+        if self.dump_signal is not None:
+            self._previous_handler = signal.signal(self.dump_signal, self._dump_requested)
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        if self.dump_signal is not None:
+            signal.signal(self.dump_signal, self._previous_handler or signal.SIG_DFL)
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler = None
+        if tracemalloc.is_tracing() and self.tracemalloc_interval > 0:
+            self.take_snapshot()
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+        if self.report_path:
+            self.write_report(self.report_path, reason)
+
+    @classmethod
+    def instrumentation_supported(cls):
+        """Return whether ``instrument`` works with the installed Scrapy."""
+        low, high = cls.VERSIONS
+        return low <= scrapy.version_info[:2] < high
+
+    def instrument(self):
+        """Replace the hot-path methods of the crawler's components with timed ones."""
+        engine = self.crawler.engine
+        timings = self.timings
+        methods = engine.downloader.middleware.methods
+        for name in DOWNLOADER_METHODS:
+            methods[name] = type(methods[name])(
+                timings.wrap(f'downloadermw/{component_name(method)}', method) for method in methods[name]
+            )
+
+        methods = engine.scraper.spidermw.methods
+        for name in SPIDER_METHODS:
+            methods[name] = type(methods[name])(
+                method and timings.wrap(f'spidermw/{component_name(method)}', method) for method in methods[name]
+            )
+        output_methods = list(methods['process_spider_output'])
+        for i, method in enumerate(output_methods):
+            if method is None:
+                continue
+            if isinstance(method, tuple):
+                # Sync and async variants; only sync iterables are timed
+                output_methods[i] = (self._timed_output(method[0]), method[1])
+            elif not isasyncgenfunction(method):
+                output_methods[i] = self._timed_output(method)
+        methods['process_spider_output'] = type(methods['process_spider_output'])(output_methods)
+        # Callbacks are timed by the middleware that already does it in every crawl
+        for middleware in engine.scraper.spidermw.middlewares:
+            if isinstance(middleware, CallbackTimingMiddleware):
+                middleware.timings = timings
+
+        methods = engine.scraper.itemproc.methods
+        methods['process_item'] = type(methods['process_item'])(
+            timings.wrap(f'pipeline/{component_name(method)}', method) for method in methods['process_item']
+        )
+
+        scheduler = engine.slot.scheduler
+        for name in ('enqueue_request', 'next_request'):
+            setattr(scheduler, name, timings.wrap(f'scheduler/{name}', getattr(scheduler, name)))
+
+        self._time_receivers()
+
+    def _time_receivers(self):
+        timings = self.timings
+        sender = self.crawler.signals.sender
+        for signal_name in TIMED_SIGNALS:
+            # Replaced in the list the dispatcher sends the signal to, keeping their order
+            receivers = dispatcher.getReceivers(sender, getattr(signals, signal_name))
+            for i, ref in enumerate(receivers):
+                receiver = next(dispatcher.liveReceivers([ref]), None)
+                if receiver is None or isinstance(receiver, TimedReceiver):
+                    continue
+                receivers[i] = TimedReceiver(timings, f'signal/{signal_name}/{component_name(receiver)}', ref)
+
+    def _timed_output(self, method):
+        timings = self.timings
+        name = f'spidermw/{component_name(method)}'
+
+        @functools.wraps(method)
+        def timed(response, result, spider):
+            started = timings.start()
+            try:
+                output = method(response=response, result=result, spider=spider)
+            finally:
+                # Counted once its output is used up
+                timings.stop(name, started, calls=0)
+            if hasattr(output, '__aiter__'):
+                return output
+            return timings.iterate(name, output)
+        return timed
+
+    def take_snapshot(self):
+        started = self.timings.start()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        self.memory['top'] = allocation_top(snapshot, self._snapshot, self.tracemalloc_top)
+        self.memory['snapshots'].append({
+            'elapsed': round(time.perf_counter() - self._started, 3), 'current': current, 'peak': peak,
+        })
+        self._snapshot = snapshot
+        self.timings.stop('profile/tracemalloc_snapshot', started)
+        for entry in self.memory['top'][:3]:
+            logger.info("Memory: %(size)d bytes (%(size_diff)+d) in %(count)d blocks at %(location)s", entry)
+
+    def report(self, reason=None):
+        stats = self.crawler.stats.get_stats()
+        return {
+            'spider': getattr(self.crawler.spider, 'name', None),
+            'reason': reason,
+            'elapsed': round(time.perf_counter() - self._started, 3),
+            'cpu': round(time.process_time() - self._started_cpu, 3),
+            'items': stats.get('item_scraped_count', 0),
+            'responses': stats.get('response_received_count', 0),
+            'sections': self.timings.report(),
+            'memory': self.memory,
+            'stats': stats,
+        }
+
+    def write_report(self, path, reason=None):
+        # Write and rename, so a report is never read half-written
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(reason), f, default=str, indent=2)
+        os.replace(tmp_path, path)
+
+    def _dump_requested(self, signum, frame):
+        # Signal handlers may run in the middle of anything; dump from the reactor instead
+        from twisted.internet import reactor
+        reactor.callFromThread(self.dump)
+
+    def dump(self):
+        """Write the report so far and profile the next ``cprofile_seconds`` seconds, without stopping the crawl."""
+        self.dumps += 1
+        root, ext = os.path.splitext(self.report_path or 'profile.json')
+        path = f'{root}.{self.dumps}{ext or ".json"}'
+        self.write_report(path)
+        self.crawler.stats.inc_value('profile/dumps')
+        logger.info("Wrote profile report %(path)s", {'path': path})
+        if self.cprofile_seconds <= 0 or self.profiler is not None:
+            return
+        self.profiler = cProfile.Profile()
+        try:
+            self.profiler.enable()
+        except ValueError as e:
+            # Another profiler is running
+            logger.warning("Can't start cProfile: %(error)s", {'error': e})
+            self.profiler = None
+            return
+        from twisted.internet import reactor
+        reactor.callLater(self.cprofile_seconds, self._write_cprofile, f'{root}.{self.dumps}.pstats')
+
+    def _write_cprofile(self, path):
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        self.profiler.dump_stats(path)
+        self.profiler = None
+        logger.info("Wrote cProfile stats %(path)s", {'path': path})
+
+
+def format_report(report, baseline=None, limit=20):
+    """Return the sections of a report that took the most wall time, with the time per call in ``baseline``."""
+    elapsed = report['elapsed'] or 1
+    lines = [
+        f"{report['spider']}: {report['elapsed']:.1f}s wall, {report['cpu']:.1f}s CPU, "
+        f"{report['items']} items, {report['responses']} responses"
+    ]
+    sections = sorted(report['sections'].items(), key=lambda item: item[1]['wall'], reverse=True)
+    accounted = sum(section['wall'] for _, section in sections)
+    lines.append(f"{accounted / elapsed:6.1%} of the wall time in the sections below, the rest waiting or untimed")
+    before = (baseline or {}).get('sections', {})
+    for name, section in sections[:limit]:
+        per_call = section['wall'] / section['calls'] * 1e6 if section['calls'] else 0.0
+        line = (f"{section['wall'] / elapsed:6.1%}  {section['wall']:8.3f}s wall  {section['cpu']:8.3f}s cpu  "
+                f"{section['calls']:>8} calls  {per_call:9.1f} us/call  {name}")
+        old = before.get(name)
+        if old and old['calls'] and per_call:
+            old_per_call = old['wall'] / old['calls'] * 1e6
+            line += f"  (was {old_per_call:.1f} us/call, {per_call / old_per_call - 1:+.0%})"
+        lines.append(line)
+    for entry in report.get('memory', {}).get('top', [])[:5]:
+        lines.append(f"{entry['size'] / 1024:10.1f} KiB ({entry['size_diff'] / 1024:+.1f})  {entry['location']}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show a profile report, optionally against an earlier one')
+    parser.add_argument('report', nargs='?', default='profile.json')
+    parser.add_argument('--baseline', help='Earlier report to compare the time per call with')
+    parser.add_argument('--top', type=int, default=20, help='Number of sections to show')
+    args = parser.parse_args()
+    with open(args.report) as f:
+        report = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline, args.top))
+
+
+if __name__ == '__main__':
+    main()
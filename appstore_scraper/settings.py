@@ -20,7 +20,21 @@ NEWSPIDER_MODULE = "appstore_scraper.spiders"
 ROBOTSTXT_OBEY = False
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-#CONCURRENT_REQUESTS = 32
+# Per-host concurrency is sized by the adaptive throttle below, up to this total
+CONCURRENT_REQUESTS = 32
+
+# Sitemap index URLs to start from instead of the spider's own (e.g. a local stand-in server)
+APPSTORE_SITEMAP_URLS = []
+
+# Maximum number of sitemap shards downloaded and parsed at the same time
+SITEMAP_SHARD_CONCURRENCY = 4
+
+# SQLite file for the entries of parsed sitemap shards, by shard URL and index
+# <lastmod>: shards the index lists with the same <lastmod> as last time are
+# replayed from here instead of downloaded ('' to disable). Cached shards older
+# than SITEMAP_CACHE_MAX_AGE seconds are downloaded again (0: never)
+SITEMAP_CACHE = ''
+SITEMAP_CACHE_MAX_AGE = 7 * 24 * 3600
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -44,27 +58,151 @@ ROBOTSTXT_OBEY = False
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    "appstore_scraper.middlewares.AppstoreScraperSpiderMiddleware": 543,
-#}
+# CallbackTimingMiddleware records the time spent in each callback as
+# callback/<name>/time stats (and the callback sections of --profile); it must
+# stay the closest to the spider.
+# AppstoreScraperSpiderMiddleware records pages that fail to parse in the failure ledger.
+# DeveloperMiddleware moves app developers to their own feed (DEVELOPERS_FEED)
+SPIDER_MIDDLEWARES = {
+    "appstore_scraper.middlewares.AppstoreScraperSpiderMiddleware": 543,
+    "appstore_scraper.middlewares.DeveloperMiddleware": 600,
+    "appstore_scraper.middlewares.CallbackTimingMiddleware": 1000,
+}
+
+# Fields extracted from app pages and exported, in one pass over the shoebox
+# payload: any of name, user_rating, developer, price, url (the default),
+# bundle_id, subtitle, description, genres, content_rating, release_date,
+# version, version_history, minimum_os_version, currency and screenshots,
+# or ['all']. The url is always included
+APP_FIELDS = ['name', 'user_rating', 'developer', 'price', 'url']
+
+# With DEVELOPERS_FEED (run_spider.py --developers), apps reference their
+# developer by developer_id, and each developer is appended to this JSON lines
+# file once per run, and in later runs only when its record changed (by the
+# content hashes kept in DEVELOPERS_INDEX; empty: within the run only).
+# DEVELOPERS_SEEN_MAX bounds the developers remembered in memory
+DEVELOPERS_FEED = ''
+DEVELOPERS_INDEX = 'developers.db'
+DEVELOPERS_SEEN_MAX = 100000
+
+# Worker processes parsing app pages off the reactor thread (0: parse inline),
+# and the most pages handed to them at once (0: twice the number of workers)
+PARSE_WORKERS = 0
+PARSE_MAX_PENDING = 0
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "appstore_scraper.middlewares.AppstoreScraperDownloaderMiddleware": 543,
-#}
+# The adaptive throttle has to see throttling responses before RetryMiddleware (550),
+# and FailedDownloadMiddleware only the final response or error after it
+DOWNLOADER_MIDDLEWARES = {
+    "appstore_scraper.middlewares.FailedDownloadMiddleware": 540,
+    "appstore_scraper.middlewares.PartialBodyMiddleware": 580,
+    "scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware": None,
+    "appstore_scraper.middlewares.AppCacheMiddleware": 900,
+    # After the cache, so that requests it answers aren't paced
+    "appstore_scraper.middlewares.AppstoreScraperDownloaderMiddleware": 950,
+}
+
+# Stop downloading app pages once their shoebox script has arrived (disabled
+# by default). Stopped downloads close their connection, so pages with less
+# than PARTIAL_BODY_MIN_SKIP bytes left are downloaded in full
+PARTIAL_BODY_ENABLED = False
+PARTIAL_BODY_MIN_SKIP = 32768
+
+# Adaptive per-host throttling: requests are paced by a token bucket and the
+# rate (requests/sec) and concurrency of each host grow while responses are
+# healthy, and are multiplied by ADAPTIVE_BACKOFF_FACTOR on throttling
+# responses, errors or Retry-After
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_START_CONCURRENCY = 8
+ADAPTIVE_MAX_CONCURRENCY = 32
+ADAPTIVE_START_RATE = 20.0
+ADAPTIVE_MIN_RATE = 0.2
+ADAPTIVE_MAX_RATE = 500.0
+ADAPTIVE_BACKOFF_FACTOR = 0.5
+# Growth pauses while the average latency is above this multiple of the best seen
+ADAPTIVE_LATENCY_TOLERANCE = 3.0
+# The App Store answers rate-limited requests with 403 as well as 429, so both
+# back off the host; 403 is not retried (RETRY_HTTP_CODES is Scrapy's default)
+ADAPTIVE_BACKOFF_HTTP_CODES = [429, 403, 500, 502, 503, 504]
+
+# Failure ledger (empty to disable; run_spider.py --failures sets it): app pages
+# and sitemap shards that fail once their retries are used up are recorded in
+# FAILURES_LEDGER with their failure class, HTTP status and number of failed
+# runs, and removed once they succeed.
+# With FAILURES_RETRY (run_spider.py --retry-failed), only the ledger's entries
+# are requested, each once FAILURES_BACKOFF seconds (doubled per failed run, up
+# to FAILURES_MAX_BACKOFF) have passed since it last failed, until it has
+# failed FAILURES_MAX_ATTEMPTS times
+FAILURES_LEDGER = ''
+FAILURES_RETRY = False
+FAILURES_BACKOFF = 600
+FAILURES_MAX_BACKOFF = 24 * 3600
+FAILURES_MAX_ATTEMPTS = 5
+FAILURES_COMMIT_INTERVAL = 100
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 EXTENSIONS = {
+    # Needed by every crawl exporting App items
+    'appstore_scraper.extensions.AppAdapterExtension': 0,
     'appstore_scraper.extensions.InPlaceCounterExtension': 100,
+    'appstore_scraper.extensions.MetricsExtension': 110,
+    'appstore_scraper.checkpoint.CheckpointExtension': 120,
+    'appstore_scraper.profiling.ProfilingExtension': 130,
 }
 
+# Seconds between redraws of the in-place item counter
+COUNTER_REFRESH_INTERVAL = 0.5
+
+# Crawl metrics in the Prometheus text format: written to METRICS_TEXTFILE
+# (e.g. for the node exporter's textfile collector) every
+# METRICS_TEXTFILE_INTERVAL seconds and/or served at
+# http://METRICS_HTTP_HOST:METRICS_HTTP_PORT/metrics (0 to disable)
+METRICS_ENABLED = True
+METRICS_TEXTFILE = ''
+METRICS_TEXTFILE_INTERVAL = 15
+METRICS_HTTP_HOST = '127.0.0.1'
+METRICS_HTTP_PORT = 0
+# Seconds between checks of how late the reactor runs scheduled calls
+METRICS_LOOP_LAG_INTERVAL = 0.1
+
+# Profiling (disabled by default, see run_spider.py --profile): wall and CPU
+# time of the callbacks, middlewares, pipelines, scheduler and item_scraped
+# handlers, written to PROFILE_REPORT when the spider closes. Every
+# PROFILE_TRACEMALLOC_INTERVAL seconds (0 to disable, as tracing slows the
+# crawl down), the PROFILE_TRACEMALLOC_TOP lines holding the most memory are
+# recorded. PROFILE_DUMP_SIGNAL writes the report so far and profiles the
+# next PROFILE_CPROFILE_SECONDS seconds with cProfile, without stopping the crawl
+PROFILE_ENABLED = False
+PROFILE_REPORT = 'profile.json'
+PROFILE_TRACEMALLOC_INTERVAL = 0
+PROFILE_TRACEMALLOC_TOP = 10
+PROFILE_DUMP_SIGNAL = 'SIGUSR1'
+PROFILE_CPROFILE_SECONDS = 10
+
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "appstore_scraper.pipelines.AppstoreScraperPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "appstore_scraper.pipelines.AppstoreScraperPipeline": 300,
+    "appstore_scraper.pipelines.ChangeCapturePipeline": 400,
+}
+
+# SQLite store every scraped app is upserted into (disabled by default, e.g.
+# 'apps.db' to enable), and the number of items written per transaction
+APPSTORE_DB_PATH = ''
+APPSTORE_DB_BATCH_SIZE = 1000
+
+# Change data capture (disabled by default, see run_spider.py --cdc): scraped
+# apps are compared with the field hashes in CDC_INDEX, and insert/update
+# events with the changed fields are appended to CDC_EVENTS_FILE. A finished
+# run that read the whole sitemap also writes delete events for the apps it no
+# longer lists, unless they are more than CDC_MAX_DELETE_RATIO of the index
+CDC_ENABLED = False
+CDC_INDEX = 'cdc_index.db'
+CDC_EVENTS_FILE = 'changes.jsonl'
+CDC_COMMIT_INTERVAL = 1000
+CDC_MAX_DELETE_RATIO = 0.5
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -79,13 +217,22 @@ EXTENSIONS = {
 # Enable showing throttling stats for every response received:
 #AUTOTHROTTLE_DEBUG = False
 
-# Enable and configure HTTP caching (disabled by default)
+# HTTP cache of app pages (disabled by default): one compressed SQLite database
+# in HTTPCACHE_DIR keyed by App Store id, holding only the shoebox script of
+# app pages. Cached pages are revalidated with If-None-Match/If-Modified-Since,
+# and a 304 reuses the cached page and the fields parsed from it. Entries stored more than
+# HTTPCACHE_EXPIRATION_SECS ago (0: never) are dropped, and least recently used
+# ones once the cache exceeds HTTPCACHE_MAX_SIZE_MB
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-#HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = "httpcache"
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+HTTPCACHE_ENABLED = False
+HTTPCACHE_EXPIRATION_SECS = 30 * 24 * 3600
+HTTPCACHE_DIR = "httpcache"
+HTTPCACHE_STORAGE = "appstore_scraper.httpcache.AppCacheStorage"
+HTTPCACHE_POLICY = "appstore_scraper.httpcache.ConditionalPolicy"
+HTTPCACHE_MAX_SIZE_MB = 1024
+HTTPCACHE_SHOEBOX_ONLY = True
+HTTPCACHE_COMPRESSION_LEVEL = 6
+HTTPCACHE_COMMIT_INTERVAL = 1000
 
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
@@ -99,9 +246,59 @@ JOBDIR = 'crawls/appstore-jobs'
 SCHEDULER_PERSIST = True
 
 # Enable disk-based dupefilter persistence
-SCHEDULER_DISK_QUEUE = 'scrapy.squeues.PickleLifoDiskQueue'
+# Requests are stored compactly (URL, callback, priority, meta) in one SQLite
+# database per job, committed every SCHEDULER_DISK_QUEUE_COMMIT_INTERVAL operations
+SCHEDULER_DISK_QUEUE = 'appstore_scraper.squeues.SqliteLifoDiskQueue'
+SCHEDULER_DISK_QUEUE_COMMIT_INTERVAL = 1000
 SCHEDULER = 'scrapy.core.scheduler.Scheduler'
-DUPEFILTER_CLASS = 'scrapy.dupefilters.RFPDupeFilter'
+# App requests are deduplicated by App Store id, kept in a sorted id array
+# saved to JOBDIR. Set DUPEFILTER_BLOOM_CAPACITY to the expected number of apps
+# to use a fixed-size Bloom filter instead (false positives skip apps)
+DUPEFILTER_CLASS = 'appstore_scraper.dupefilters.AppIdDupeFilter'
+DUPEFILTER_BLOOM_CAPACITY = 0
+DUPEFILTER_BLOOM_ERROR_RATE = 0.001
+
+# Crash-safe checkpoints of JOBDIR crawls, every CHECKPOINT_INTERVAL seconds and
+# every CHECKPOINT_ITEMS items (0: only by time). After a hard kill, resuming
+# goes back to the last checkpoint and redoes at most one interval of work.
+# A checkpoint is put off while a response is still exporting its items, and
+# skipped after CHECKPOINT_MAX_DELAY seconds of that. Off by default, as
+# single-file JSON/XML feeds (the default output) can't be checkpointed
+CHECKPOINT_ENABLED = False
+CHECKPOINT_INTERVAL = 30
+CHECKPOINT_ITEMS = 10000
+CHECKPOINT_MAX_DELAY = 5
+
+# Partition of the catalog crawled by this process (see run_spider.py --shard/--workers)
+SHARD_INDEX = 0
+SHARD_COUNT = 1
+
+# Incremental recrawls: only apps that are new, whose sitemap <lastmod> moved,
+# or that were last scraped more than INCREMENTAL_MAX_AGE seconds ago are requested
+INCREMENTAL_ENABLED = False
+INCREMENTAL_INDEX = 'app_index.db'
+INCREMENTAL_MAX_AGE = 7 * 24 * 3600
+
+# Freshness priorities: app requests are scheduled in order of their sitemap
+# <priority> times the probability that their FRESHNESS_FIELDS changed since
+# the last scrape, estimated from their history in INCREMENTAL_INDEX. Scores
+# are mapped onto FRESHNESS_PRIORITY_LEVELS request priorities below 0
+FRESHNESS_ENABLED = False
+FRESHNESS_FIELDS = ['price', 'user_rating']
+FRESHNESS_PRIORITY_LEVELS = 100
+
+# Batched iTunes lookup backend used by the apps_lookup spider
+LOOKUP_URL = 'https://itunes.apple.com/lookup'
+LOOKUP_BATCH_SIZE = 100
+LOOKUP_COUNTRY = 'us'
+
+# Storefronts (country codes) crawled by the apps_storefronts spider: app pages
+# are downloaded from the first one, the others are looked up in batches
+STOREFRONTS = ['us']
+
+# Parquet feeds (--format parquet, requires pyarrow): items per row group and codec
+PARQUET_ROW_GROUP_SIZE = 10000
+PARQUET_COMPRESSION = 'zstd'
 
 # Minimize logging
 LOG_LEVEL = 'ERROR'  # Only show error messages
@@ -0,0 +1,168 @@
+"""
+Deterministic partitioning of the catalog for multi-process and multi-node crawls.
+
+Every app URL belongs to exactly one of ``SHARD_COUNT`` shards, based on a
+stable hash of its App Store id. Each shard is crawled with its own JOBDIR
+and output file, and ``merge_outputs`` combines the shard outputs into a
+single file with one record per app.
+"""
+
+import csv
+import glob
+import json
+import os
+import zlib
+
+from appstore_scraper.utils import app_id_from_url
+
+
+def shard_for(url, count):
+    """Return the shard (0 to count - 1) an app URL belongs to."""
+    app_id = app_id_from_url(url)
+    key = str(app_id) if app_id is not None else url
+    return zlib.crc32(key.encode('utf-8')) % count
+
+
+def parse_shard(value):
+    """Parse an ``i/N`` shard specification into ``(i, N)``."""
+    index, _, count = value.partition('/')
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError(f"Shard index must be between 0 and {count - 1}, got {index}")
+    return index, count
+
+
+def shard_path(path, index, count):
+    """Return the per-shard variant of a file or directory path."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{index}-of-{count}{ext}"
+
+
+def _read_records(path, fmt):
+    if fmt in ('jsonlines', 'jl'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    elif fmt == 'json':
+        # Resumed crawls append a new array to the file, so decode every
+        # array found instead of expecting a single document
+        with open(path, encoding='utf-8') as f:
+            content = f.read()
+        decoder = json.JSONDecoder()
+        pos = 0
+        while True:
+            while pos < len(content) and content[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(content):
+                break
+            records, pos = decoder.raw_decode(content, pos)
+            yield from records
+    elif fmt == 'csv':
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+    elif fmt == 'parquet':
+        import pyarrow.parquet as pq
+        for part in sorted(glob.glob(os.path.join(path, '*.parquet'))):
+            for batch in pq.ParquetFile(part).iter_batches():
+                yield from batch.to_pylist()
+    else:
+        raise ValueError(f"Can't merge outputs in format {fmt!r}")
+
+
+def merge_outputs(paths, output, fmt, keep_last=False, key=None):
+    """
+    Merge shard outputs into ``output``, keeping the first record seen for each app.
+
+    Records are the same app when their ``url`` has the same App Store id,
+    or with ``key``, when they have the same value of that field (e.g.
+    ``id`` for developers). With ``keep_last``, the last record of each is
+    kept instead, as for developer feeds, which get a record appended
+    whenever one changed. Returns ``(written, duplicates)``.
+    """
+    if fmt == 'parquet':
+        return _merge_parquet(paths, output)
+    if keep_last:
+        records = _latest_records(paths, fmt, key)
+    else:
+        records = _unique_records(paths, fmt, set(), key)
+    written = duplicates = 0
+    with open(output, 'w', newline='', encoding='utf-8') as out:
+        writer = None
+        if fmt == 'json':
+            out.write('[')
+        for record in records:
+            if record is None:
+                duplicates += 1
+                continue
+            if fmt == 'csv':
+                if writer is None:
+                    writer = csv.DictWriter(out, fieldnames=list(record))
+                    writer.writeheader()
+                writer.writerow(record)
+            elif fmt == 'json':
+                out.write(',\n' if written else '\n')
+                out.write(json.dumps(record, ensure_ascii=False))
+            else:
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            written += 1
+        if fmt == 'json':
+            out.write('\n]')
+    return written, duplicates
+
+
+def _record_key(record, key=None):
+    if key is not None:
+        return record.get(key)
+    url = record.get('url') or ''
+    return app_id_from_url(url) or url
+
+
+def _unique_records(paths, fmt, seen, key=None):
+    """Yield the records of every output, with None in place of duplicates."""
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for record in _read_records(path, fmt):
+            record_key = _record_key(record, key)
+            if record_key in seen:
+                yield None
+                continue
+            seen.add(record_key)
+            yield record
+
+
+def _latest_records(paths, fmt, key=None):
+    """Yield None for every superseded record of the outputs, then the last record of each."""
+    latest = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for record in _read_records(path, fmt):
+            record_key = _record_key(record, key)
+            if record_key in latest:
+                yield None
+            latest[record_key] = record
+    yield from latest.values()
+
+
+def _merge_parquet(paths, output):
+    """Merge Parquet datasets into a single part file in the ``output`` directory."""
+    from appstore_scraper.exporters import ParquetItemExporter
+
+    os.makedirs(output, exist_ok=True)
+    for part in glob.glob(os.path.join(output, '*.parquet')):
+        os.remove(part)
+    written = duplicates = 0
+    with open(os.path.join(output, 'part-merged.parquet'), 'wb') as out:
+        exporter = ParquetItemExporter(out)
+        exporter.start_exporting()
+        for record in _unique_records(paths, 'parquet', set()):
+            if record is None:
+                duplicates += 1
+                continue
+            exporter.write_row(record)
+            written += 1
+        exporter.finish_exporting()
+    return written, duplicates
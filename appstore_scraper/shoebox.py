@@ -0,0 +1,155 @@
+"""
+Fast extraction of the ``shoebox-media-api-cache-apps`` payload from app pages.
+
+Every app page embeds the catalog API response for the app in a
+``<script id="shoebox-media-api-cache-apps">`` block. The script is a JSON
+object mapping a cache key to a JSON *string*, so getting at the app record
+means locating the script and decoding twice. Building a full HTML tree just
+to locate one script dominates the cost of parsing a page, so this module
+scans the raw response bytes for the block instead and only decodes the
+first cache entry.
+
+``ShoeboxScanner`` does the same scan on a body while it is still being
+downloaded, so the download can stop once the script is complete.
+"""
+
+import json
+import zlib
+from json.decoder import scanstring
+
+SHOEBOX_ID = b'shoebox-media-api-cache-apps'
+SHOEBOX_XPATH = '//script[@id="shoebox-media-api-cache-apps"]/text()'
+
+_WHITESPACE = ' \t\n\r'
+SCRIPT_END = b'</script>'
+
+# Decoded bytes kept while looking for the shoebox id, enough to hold the start of its <script> tag
+SCAN_WINDOW = 4096
+
+
+class ShoeboxNotFound(ValueError):
+    """The page has no shoebox script to read the app from."""
+
+
+def find_shoebox(body):
+    """Return the raw bytes inside the shoebox script, or None if not present."""
+    start = body.find(SHOEBOX_ID)
+    while start != -1:
+        # Make sure the id belongs to a <script> tag that is still open.
+        if _is_script_id(body, start):
+            content_start = body.find(b'>', start)
+            if content_start == -1:
+                return None
+            content_end = body.find(SCRIPT_END, content_start)
+            if content_end == -1:
+                return None
+            return body[content_start + 1:content_end]
+        start = body.find(SHOEBOX_ID, start + len(SHOEBOX_ID))
+    return None
+
+
+def _is_script_id(text, pos):
+    """Return whether the shoebox id at ``pos`` is inside a ``<script>`` tag that is still open."""
+    tag_start = text.rfind(b'<script', 0, pos)
+    return tag_start != -1 and text.rfind(b'>', tag_start, pos) == -1
+
+
+class ShoeboxScanner:
+    """
+    Tells when the shoebox script of a page body being downloaded is complete.
+
+    Chunks of the raw body are fed as they arrive. Gzip and deflate encoded
+    bodies are decoded incrementally; other encodings can't be scanned, and
+    ``feed`` never reports them complete. Only a small window of the decoded
+    body is kept, so matches split across chunks are still found.
+    """
+
+    def __init__(self, encoding=b''):
+        self.encoding = (encoding or b'').lower()
+        self.complete = False
+        self.scannable = True
+        self.received = 0
+        self._decompressor = None
+        self._in_script = False
+        self._window = b''
+        if self.encoding in (b'gzip', b'x-gzip'):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == b'deflate':
+            self._decompressor = zlib.decompressobj()
+        elif self.encoding not in (b'', b'identity'):
+            self.scannable = False
+
+    def feed(self, data):
+        """Feed a chunk of the raw body and return True once the shoebox script is complete."""
+        self.received += len(data)
+        if self.complete or not self.scannable:
+            return self.complete
+        try:
+            data = self._decode(data)
+        except zlib.error:
+            self.scannable = False
+            return False
+        text = self._window + data
+        if not self._in_script:
+            pos = text.find(SHOEBOX_ID)
+            while pos != -1 and not _is_script_id(text, pos):
+                pos = text.find(SHOEBOX_ID, pos + len(SHOEBOX_ID))
+            if pos == -1:
+                self._window = text[-SCAN_WINDOW:]
+                return False
+            self._in_script = True
+            text = text[pos + len(SHOEBOX_ID):]
+        if text.find(SCRIPT_END) != -1:
+            self.complete = True
+            self._window = b''
+            return True
+        self._window = text[-(len(SCRIPT_END) - 1):]
+        return False
+
+    def _decode(self, data):
+        if self._decompressor is None:
+            return data
+        try:
+            return self._decompressor.decompress(data)
+        except zlib.error:
+            if self.encoding != b'deflate' or self._decompressor.unused_data or self._window or self._in_script:
+                raise
+            # Some servers send raw deflate data without the zlib header
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decompressor.decompress(data)
+
+
+def _skip(text, pos, expected):
+    while pos < len(text) and text[pos] in _WHITESPACE:
+        pos += 1
+    if text[pos:pos + 1] != expected:
+        raise ValueError(f"Expected {expected!r} at position {pos} of shoebox payload")
+    return pos + 1
+
+
+def decode_shoebox(payload):
+    """
+    Decode a shoebox payload and return the first app record (``d[0]``).
+
+    Only the first cache entry is decoded; the outer object is never
+    materialised as a dict. Raises ``ShoeboxNotFound`` for a missing script.
+    """
+    if payload is None:
+        raise ShoeboxNotFound('No shoebox script in the page')
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    pos = _skip(payload, 0, '{')
+    pos = _skip(payload, pos, '"')
+    _, pos = scanstring(payload, pos)
+    pos = _skip(payload, pos, ':')
+    pos = _skip(payload, pos, '"')
+    value, _ = scanstring(payload, pos)
+    return json.loads(value)['d'][0]
+
+
+def extract_app_data(body):
+    """Return the app record from a page body, or None if the fast path can't find it."""
+    payload = find_shoebox(body)
+    if payload is None:
+        return None
+    return decode_shoebox(payload)
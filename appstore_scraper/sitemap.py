@@ -0,0 +1,440 @@
+"""
+Streaming sitemap ingestion.
+
+``SitemapSpider`` buffers every sitemap body, decompresses it in one go and
+builds a full tree before yielding a single URL. The App Store index fans out
+to many large gzipped shards, so instead ``StreamingSitemapSpider`` feeds the
+body chunks to an incremental parser from the ``bytes_received`` signal while
+the shard is still downloading, schedules app requests as soon as their
+``<url>`` entries are complete and caps the number of shards in flight.
+
+Numbered index files (``sitemaps_apps_index_app_1.xml``, ``_2.xml``, ...)
+are enumerated by probing the next one once an index parses, until one
+answers 404. Shards that are listed with the same ``<lastmod>`` as in an
+earlier run are replayed from the shard cache (see
+``appstore_scraper.sitemapcache``) instead of being downloaded again. A
+replayed shard takes a slot like a downloaded one, and its entries are
+replayed one cached chunk per reactor iteration, as they would arrive.
+"""
+
+import logging
+import time
+import zlib
+from collections import deque
+
+from lxml import etree
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.http import Request
+from scrapy.spiders import SitemapSpider
+from scrapy.spiders.sitemap import iterloc
+from scrapy.spidermiddlewares.httperror import HttpError
+
+from appstore_scraper.checkpoint import checkpoint_saving
+from appstore_scraper.sitemapcache import ShardCache
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+ENTRY_TAGS = ('url', 'sitemap')
+CHUNK_SIZE = 64 * 1024
+URLSET = 'urlset'
+SITEMAP_INDEX = 'sitemapindex'
+# Responses to probes past the last index file
+INDEX_END_STATUSES = (404, 410)
+
+
+def _localname(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+class SitemapStreamParser:
+    """
+    Incremental parser for (optionally gzipped) sitemap and sitemap index bodies.
+
+    Chunks are fed as they arrive and completed entries are returned as dicts
+    in the same shape as ``scrapy.utils.sitemap.Sitemap`` yields. Parsed
+    elements are discarded straight away, so memory use does not grow with
+    the size of the sitemap.
+    """
+
+    def __init__(self, max_size=0):
+        self.type = None
+        self.size = 0
+        self.max_size = max_size
+        self.error = None
+        self._head = b''
+        self._decompressor = None
+        self._sniffed = False
+        self._parser = etree.XMLPullParser(
+            events=('start', 'end'),
+            recover=True,
+            remove_comments=True,
+            resolve_entities=False,
+        )
+
+    def feed(self, data):
+        """Feed a chunk of the raw body and return the entries completed by it."""
+        if self.error is not None:
+            return []
+        if not self._sniffed:
+            self._head += data
+            if len(self._head) < len(GZIP_MAGIC):
+                return []
+            data, self._head = self._head, b''
+            self._sniffed = True
+            if data.startswith(GZIP_MAGIC):
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            if self._decompressor is not None:
+                data = self._decompressor.decompress(data)
+            return self._parse(data)
+        except (zlib.error, ValueError) as e:
+            self.error = e
+            return []
+
+    def close(self):
+        """Signal the end of the body and return any remaining entries."""
+        if self.error is not None:
+            return []
+        entries = []
+        if self._head:
+            self._sniffed = True
+            entries.extend(self._parse(self._head))
+            self._head = b''
+        try:
+            if self._decompressor is not None:
+                entries.extend(self._parse(self._decompressor.flush()))
+            self._parser.close()
+        except (zlib.error, ValueError, etree.XMLSyntaxError) as e:
+            self.error = e
+        entries.extend(self._read_events())
+        return entries
+
+    def _parse(self, data):
+        if not data:
+            return []
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            raise ValueError(f"Sitemap larger than {self.max_size} bytes after decompression")
+        self._parser.feed(data)
+        return self._read_events()
+
+    def _read_events(self):
+        entries = []
+        for event, elem in self._parser.read_events():
+            name = _localname(elem.tag)
+            if event == 'start':
+                if self.type is None:
+                    self.type = name
+                continue
+            if name not in ENTRY_TAGS:
+                continue
+            entry = {}
+            for child in elem:
+                child_name = _localname(child.tag)
+                if child_name == 'link':
+                    if 'href' in child.attrib:
+                        entry.setdefault('alternate', []).append(child.get('href'))
+                else:
+                    entry[child_name] = (child.text or '').strip()
+            if 'loc' in entry:
+                entries.append(entry)
+            # Drop the element and everything parsed before it
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+        return entries
+
+    def parse_body(self, body):
+        """Parse a complete body at once, still chunk by chunk."""
+        entries = []
+        for start in range(0, len(body), CHUNK_SIZE):
+            entries.extend(self.feed(body[start:start + CHUNK_SIZE]))
+        entries.extend(self.close())
+        return entries
+
+
+class StreamingSitemapSpider(SitemapSpider):
+    """
+    ``SitemapSpider`` that parses sitemaps while they are being downloaded.
+
+    Index files are streamed like shards. Shard URLs found in an index are
+    queued locally and at most ``SITEMAP_SHARD_CONCURRENCY`` of them are
+    downloaded at once; the queue is kept in ``spider.state`` so it survives
+    pause/resume when ``JOBDIR`` is set. ``sitemap_rules``, ``sitemap_follow``,
+    ``sitemap_filter`` and ``sitemap_alternate_links`` behave as in
+    ``SitemapSpider``. Subclasses customise the requests made for matched
+    entries by overriding ``sitemap_requests``.
+
+    Requests found while a sitemap is still downloading are handed to the
+    engine directly, as there is no response to pass them through the spider
+    middlewares with yet. They skip ``process_spider_output`` of every spider
+    middleware (Depth, Referer, UrlLength and the project's own, which only
+    deal with items and parsed pages), while downloader middlewares and the
+    dupefilter still apply. Only the requests returned once the sitemap
+    finishes, such as ``sitemap_closed``'s, go through the spider middlewares.
+
+    With ``sitemap_index_pattern`` (a regex whose first group is the number
+    of an index file), every index that parses is followed by a probe of the
+    next number. With ``SITEMAP_CACHE``, shards are looked up in the shard
+    cache first, and the requests of a cached shard are handed to the engine
+    as its chunks are replayed, like those of a shard still downloading. ``listing_incomplete`` is set once a sitemap fails to
+    download or parse, or an index probe fails other than with a 404/410, so
+    that the apps missing from the crawl aren't taken as delisted (it is
+    kept in ``spider.state``). Adds ``sitemap/failed``, ``sitemap/indexes``, ``sitemap/shards_downloaded``,
+    ``sitemap/shards_cached`` and ``sitemap/discovery_time`` (seconds until
+    the last known shard was parsed) stats.
+    """
+
+    sitemap_shard_concurrency = 4
+    sitemap_index_pattern = None
+    # Sitemaps go ahead of the requests found in them, so discovery isn't held up by the crawl
+    sitemap_priority = 1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Parsers of the sitemaps being downloaded, by URL
+        self._streams = {}
+        self._pending_shards = deque()
+        self._shards_in_flight = set()
+        # Scheduled replay of the next chunk of each cached shard in flight, by URL
+        self._replays = {}
+        # <lastmod> of the shards found in index files, the cache key of their entries
+        self._shard_lastmods = {}
+        self._discovery_started = time.monotonic()
+        self.sitemap_cache = None
+        self.listing_incomplete = False
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.sitemap_shard_concurrency = crawler.settings.getint(
+            'SITEMAP_SHARD_CONCURRENCY', spider.sitemap_shard_concurrency)
+        if crawler.settings.get('SITEMAP_CACHE'):
+            spider.sitemap_cache = ShardCache(
+                crawler.settings.get('SITEMAP_CACHE'), crawler.settings.getfloat('SITEMAP_CACHE_MAX_AGE'))
+            crawler.signals.connect(spider._close_sitemap_cache, signal=signals.spider_closed)
+            crawler.signals.connect(spider._replaying_shards, signal=signals.spider_idle)
+        crawler.signals.connect(spider._sitemap_headers_received, signal=signals.headers_received)
+        crawler.signals.connect(spider._sitemap_bytes_received, signal=signals.bytes_received)
+        crawler.signals.connect(spider._save_sitemap_state, signal=signals.spider_closed)
+        crawler.signals.connect(spider._save_sitemap_state, signal=checkpoint_saving)
+        return spider
+
+    def start_requests(self):
+        state = getattr(self, 'state', {})
+        self._discovery_started = time.monotonic()
+        self._shards_in_flight.update(state.get('sitemap_shards_in_flight', ()))
+        self._pending_shards.extend(state.get('sitemap_pending_shards', ()))
+        self._shard_lastmods.update(state.get('sitemap_shard_lastmods', {}))
+        self.listing_incomplete = state.get('sitemap_listing_incomplete', False)
+        yield from self._next_shards()
+        for url in self.sitemap_urls:
+            yield Request(url, callback=self._parse_sitemap, errback=self._sitemap_failed, priority=self.sitemap_priority)
+
+    def sitemap_requests(self, entry, loc, callback):
+        """Return the requests to make for a sitemap entry matched by ``sitemap_rules``."""
+        yield Request(loc, callback=callback)
+
+    def sitemap_closed(self, response):
+        """
+        Called after a sitemap body has been fully parsed; may return requests.
+
+        ``response`` is None for shards replayed from the shard cache.
+        """
+        return ()
+
+    def _streamed(self, request):
+        return request.callback == self._parse_sitemap and not request.url.endswith('/robots.txt')
+
+    def _sitemap_headers_received(self, headers, body_length, request, spider):
+        # Every download attempt (e.g. a retry after a 5xx) starts a new parser,
+        # replacing whatever the previous attempt left behind
+        if self._streamed(request):
+            self._streams[request.url] = self._stream_for(request.url)
+
+    def _sitemap_bytes_received(self, data, request, spider):
+        if not self._streamed(request):
+            return
+        stream = self._streams.get(request.url)
+        if stream is None:
+            stream = self._streams[request.url] = self._stream_for(request.url)
+        # The type is only known once the first chunk is parsed
+        entries = stream.feed(data)
+        self._cache_entries(request.url, entries)
+        for r in self._sitemap_entries(stream.type, entries):
+            self.crawler.engine.crawl(r)
+
+    def _stream_for(self, url):
+        # Only shards whose <lastmod> the index gave can be looked up in the cache later
+        if self.sitemap_cache is not None and self._shard_lastmods.get(url):
+            self.sitemap_cache.begin(url)
+        return SitemapStreamParser(max_size=self._max_size)
+
+    def _cache_entries(self, url, entries):
+        # Written as they are parsed, so the shard's entries are never all in memory
+        if self.sitemap_cache is not None:
+            self.sitemap_cache.add(url, entries)
+
+    def _parse_sitemap(self, response):
+        if response.url.endswith('/robots.txt'):
+            yield from super()._parse_sitemap(response)
+            return
+
+        stream = self._streams.pop(response.request.url, None)
+        if stream is None:
+            # The body did not arrive through the HTTP download handler
+            # (e.g. cached or file:// responses), parse it now instead
+            stream = self._stream_for(response.request.url)
+            entries = stream.parse_body(response.body)
+        else:
+            entries = stream.close()
+        self._cache_entries(response.request.url, entries)
+        yield from self._sitemap_entries(stream.type, entries)
+
+        if stream.error is not None or stream.type is None:
+            logger.warning(
+                "Ignoring invalid sitemap: %(response)s (%(error)s)",
+                {'response': response, 'error': stream.error},
+                extra={'spider': self},
+            )
+            # A probe past the last index file may get a page that isn't a sitemap
+            if not response.meta.get('sitemap_probe'):
+                self._listing_failed()
+        elif stream.type == SITEMAP_INDEX:
+            self.crawler.stats.inc_value('sitemap/indexes')
+            yield from self._probe_next_index(response.url)
+        elif stream.type == URLSET and response.request.url in self._shards_in_flight:
+            self.crawler.stats.inc_value('sitemap/shards_downloaded')
+            if self.sitemap_cache is not None:
+                url = response.request.url
+                self.sitemap_cache.finish(url, self._shard_lastmods.get(url))
+        if self.sitemap_cache is not None:
+            # Whatever was written and not finished above (an invalid shard) can't be replayed
+            self.sitemap_cache.discard(response.request.url)
+        yield from self.sitemap_closed(response)
+        self._shards_in_flight.discard(response.request.url)
+        yield from self._next_shards()
+
+    def _sitemap_failed(self, failure):
+        request = failure.request
+        self._streams.pop(request.url, None)
+        if self.sitemap_cache is not None:
+            self.sitemap_cache.discard(request.url)
+        self._shards_in_flight.discard(request.url)
+        self._listing_failed()
+        return self._next_shards()
+
+    def _listing_failed(self):
+        self.listing_incomplete = True
+        self.crawler.stats.inc_value('sitemap/failed')
+
+    def _probe_next_index(self, url):
+        """Request the index file numbered after ``url``, if index files are numbered."""
+        match = self.sitemap_index_pattern.search(url) if self.sitemap_index_pattern else None
+        if match is None:
+            return
+        next_url = f'{url[:match.start(1)]}{int(match.group(1)) + 1}{url[match.end(1):]}'
+        yield Request(next_url, callback=self._parse_sitemap, errback=self._index_probe_failed,
+                      priority=self.sitemap_priority, meta={'sitemap_probe': True})
+
+    def _index_probe_failed(self, failure):
+        request = failure.request
+        self._streams.pop(request.url, None)
+        if failure.check(HttpError) and failure.value.response.status in INDEX_END_STATUSES:
+            logger.debug("No sitemap index at %(url)s, all index files found", {'url': request.url},
+                         extra={'spider': self})
+        else:
+            logger.warning(
+                "Probing sitemap index %(url)s failed, later index files are not crawled: %(error)s",
+                {'url': request.url, 'error': failure.value},
+                extra={'spider': self},
+            )
+            self._listing_failed()
+        return self._next_shards()
+
+    def _sitemap_entries(self, sitemap_type, entries):
+        if not entries:
+            return
+        it = self.sitemap_filter(entries)
+        if sitemap_type == SITEMAP_INDEX:
+            for entry in it:
+                for loc in iterloc([entry], self.sitemap_alternate_links):
+                    if any(x.search(loc) for x in self._follow):
+                        self._pending_shards.append(loc)
+                        self._shard_lastmods[loc] = entry.get('lastmod')
+            yield from self._next_shards()
+        elif sitemap_type == URLSET:
+            for entry in it:
+                for loc in iterloc([entry], self.sitemap_alternate_links):
+                    for r, c in self._cbs:
+                        if r.search(loc):
+                            yield from self.sitemap_requests(entry, loc, c)
+                            break
+
+    def _next_shards(self):
+        while self._pending_shards and len(self._shards_in_flight) < self.sitemap_shard_concurrency:
+            url = self._pending_shards.popleft()
+            chunks = None
+            if self.sitemap_cache is not None:
+                chunks = self.sitemap_cache.get(url, self._shard_lastmods.get(url))
+            self._shards_in_flight.add(url)
+            if chunks is not None:
+                # Unchanged since it was cached: replay its entries instead of downloading it
+                self.crawler.stats.inc_value('sitemap/shards_cached')
+                self._schedule_replay(url, chunks)
+                continue
+            # Shards are tracked here, so they must not be dropped by the dupefilter
+            yield Request(url, callback=self._parse_sitemap, errback=self._sitemap_failed, dont_filter=True,
+                          priority=self.sitemap_priority)
+        if not self._pending_shards and not self._shards_in_flight:
+            # Until a later index file adds shards
+            self.crawler.stats.set_value('sitemap/discovery_time', round(time.monotonic() - self._discovery_started, 3))
+
+    def _schedule_replay(self, url, chunks):
+        from twisted.internet import reactor
+        # Not from the handler or callback that freed the slot
+        self._replays[url] = reactor.callLater(0, self._replay_chunk, url, chunks)
+
+    def _replay_chunk(self, url, chunks):
+        """Hand the requests of the next cached chunk of a shard to the engine, or finish the shard."""
+        engine = self.crawler.engine
+        chunk = next(chunks, None)
+        if chunk is not None:
+            for r in self._sitemap_entries(URLSET, chunk):
+                engine.crawl(r)
+            self._schedule_replay(url, chunks)
+            return
+        del self._replays[url]
+        requests = list(self.sitemap_closed(None))
+        self._shards_in_flight.discard(url)
+        requests.extend(self._next_shards())
+        for r in requests:
+            engine.crawl(r)
+
+    def _replaying_shards(self, spider):
+        # The engine may find nothing to do between two chunks
+        if self._replays:
+            raise DontCloseSpider
+
+    def _save_sitemap_state(self, spider):
+        state = getattr(self, 'state', None)
+        if state is not None:
+            # Shards being replayed have no request to resume with, so they are replayed again
+            state['sitemap_pending_shards'] = list(self._replays) + list(self._pending_shards)
+            state['sitemap_shards_in_flight'] = [url for url in self._shards_in_flight if url not in self._replays]
+            state['sitemap_listing_incomplete'] = self.listing_incomplete
+            unfinished = self._shards_in_flight.union(self._pending_shards)
+            state['sitemap_shard_lastmods'] = {
+                url: lastmod for url, lastmod in self._shard_lastmods.items() if url in unfinished
+            }
+
+    def _close_sitemap_cache(self, spider):
+        for call in self._replays.values():
+            if call.active():
+                call.cancel()
+        self._replays.clear()
+        self.sitemap_cache.close()
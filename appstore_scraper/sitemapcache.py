@@ -0,0 +1,115 @@
+"""
+Local cache of parsed sitemap shards.
+
+The sitemap index lists every shard with its ``<lastmod>``, and most shards
+don't change between runs. The entries of every shard parsed are kept in
+SQLite (``SITEMAP_CACHE``), keyed by the shard URL and the ``<lastmod>`` the
+index listed it with. They are written as compressed chunks while the shard
+streams in, so a shard is never held in memory as a whole, and the shard is
+only marked complete once it parsed to the end. A later run that finds a
+shard listed with the same ``<lastmod>`` replays its entries from here, a
+chunk at a time, instead of downloading and parsing it again (see
+``StreamingSitemapSpider``). Shards the index lists without a ``<lastmod>``
+are always downloaded, and cached shards older than ``SITEMAP_CACHE_MAX_AGE``
+are downloaded again in case the index failed to move their ``<lastmod>``.
+"""
+
+import json
+import sqlite3
+import time
+import zlib
+
+class ShardCache:
+    def __init__(self, path, max_age=0):
+        self.path = path
+        self.max_age = max_age
+        # Chunks and entries written so far for the shards being downloaded
+        self._chunks = {}
+        self._counts = {}
+        # --workers shards each get a file of their own, but separate crawls
+        # given the same SITEMAP_CACHE share it, so wait for their write lock
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS shards ('
+            ' url TEXT PRIMARY KEY,'
+            ' lastmod TEXT,'
+            ' entry_count INTEGER,'
+            ' fetched REAL)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS shard_entries ('
+            ' url TEXT,'
+            ' seq INTEGER,'
+            ' entries BLOB,'
+            ' PRIMARY KEY (url, seq))'
+        )
+
+    def get(self, url, lastmod, now=None):
+        """Return the chunks of cached entries of a shard listed with ``lastmod``, or None if it has to be downloaded."""
+        if not lastmod:
+            return None
+        row = self.conn.execute('SELECT lastmod, fetched FROM shards WHERE url = ?', (url,)).fetchone()
+        if row is None or row[0] != lastmod:
+            return None
+        now = time.time() if now is None else now
+        if self.max_age and now - row[1] > self.max_age:
+            return None
+        seqs = [row[0] for row in self.conn.execute(
+            'SELECT seq FROM shard_entries WHERE url = ? ORDER BY seq', (url,))]
+        return self._replay(url, seqs)
+
+    def _replay(self, url, seqs):
+        # One chunk in memory at a time
+        for seq in seqs:
+            row = self.conn.execute(
+                'SELECT entries FROM shard_entries WHERE url = ? AND seq = ?', (url, seq)
+            ).fetchone()
+            if row is not None:
+                yield json.loads(zlib.decompress(row[0]))
+
+    def begin(self, url):
+        """Start writing the entries of a shard download, dropping whatever was cached for it."""
+        self.conn.execute('DELETE FROM shards WHERE url = ?', (url,))
+        self.conn.execute('DELETE FROM shard_entries WHERE url = ?', (url,))
+        self._chunks[url] = 0
+        self._counts[url] = 0
+
+    def add(self, url, entries):
+        """Write the entries of a shard parsed so far."""
+        if not entries or url not in self._chunks:
+            return
+        data = zlib.compress(json.dumps(entries, separators=(',', ':')).encode('utf-8'))
+        self.conn.execute('INSERT INTO shard_entries (url, seq, entries) VALUES (?, ?, ?)',
+                          (url, self._chunks[url], data))
+        self._chunks[url] += 1
+        self._counts[url] += len(entries)
+
+    def finish(self, url, lastmod, now=None):
+        """Mark a shard downloaded while the index listed it with ``lastmod`` as complete."""
+        if url not in self._chunks:
+            return
+        now = time.time() if now is None else now
+        del self._chunks[url]
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO shards (url, lastmod, entry_count, fetched) VALUES (?, ?, ?, ?)',
+                (url, lastmod, self._counts.pop(url), now),
+            )
+
+    def discard(self, url):
+        """Drop the entries written for a shard that failed to download or parse."""
+        if url not in self._chunks:
+            return
+        del self._chunks[url]
+        del self._counts[url]
+        with self.conn:
+            self.conn.execute('DELETE FROM shard_entries WHERE url = ?', (url,))
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM shards').fetchone()[0]
+
+    def close(self):
+        # Shards still being written were never marked complete, so they aren't replayed
+        self.conn.close()
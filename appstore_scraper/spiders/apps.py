@@ -1,11 +1,24 @@
+import re
+import time
+from urllib.parse import urlparse
+
 import scrapy
-from scrapy.spiders import SitemapSpider
-import json
+from itemadapter import ItemAdapter
+from scrapy import signals
 
-from appstore_scraper.items import App
+from appstore_scraper.cdc import app_listed
+from appstore_scraper.freshness import FreshnessScorer
+from appstore_scraper.httpcache import app_parsed
+from appstore_scraper.incremental import AppIndex, SKIPPED, classify
+from appstore_scraper.items import App, DEVELOPER_FIELDS, Developer, select_fields
+from appstore_scraper.metrics import Metrics
+from appstore_scraper.parsing import BASE_URL, ParsePool, parse_app_page
+from appstore_scraper.sharding import shard_for
+from appstore_scraper.sitemap import StreamingSitemapSpider
+from appstore_scraper.utils import app_id_from_url, content_hash, fields_hash, parse_lastmod
 
 
-class AppsSpider(SitemapSpider):
+class AppsSpider(StreamingSitemapSpider):
     name = "apps"
     allowed_domains = ["apps.apple.com"]
     sitemap_urls = [
@@ -14,6 +27,10 @@ class AppsSpider(SitemapSpider):
     sitemap_rules = [
         ('/us/', 'parse'),
     ]
+    # The catalog is split over numbered index files, probed until one is missing
+    sitemap_index_pattern = re.compile(r'sitemaps_apps_index_app_(\d+)\.xml')
+    # Item fields set by the spider itself, exported after the APP_FIELDS
+    extra_item_fields = ()
     
     def __init__(self, output_file='apps.json', output_format='json', *args, **kwargs):
         """Initialize the spider with output file and format parameters."""
@@ -21,33 +38,180 @@ class AppsSpider(SitemapSpider):
         self.output_file = output_file
         self.output_format = output_format
         
-        # Set the feed export settings
-        self.custom_settings = {
-            'FEEDS': {
-                output_file: {
-                    'format': output_format,
-                    'encoding': 'utf8',
-                    'store_empty': False,
-                    'overwrite': False,  # Append to existing file if resuming
-                }
+        # Parquet files can't be appended to, so each run (including a resumed
+        # one) writes a new part file into the output directory
+        feed_uri = output_file
+        if output_format == 'parquet':
+            feed_uri = f'{output_file}/part-%(batch_time)s.parquet'
+
+        # Set the feed export settings (no output file: no feed, e.g. when only
+        # change events are written)
+        feeds = {}
+        if output_file:
+            feeds[feed_uri] = {
+                'format': output_format,
+                'encoding': 'utf8',
+                'store_empty': False,
+                'overwrite': False,  # Append to existing file if resuming
             }
+        self.custom_settings = {
+            'FEEDS': feeds,
+            'FEED_EXPORTERS': {
+                'parquet': 'appstore_scraper.exporters.ParquetItemExporter',
+            },
         }
         
+        self.app_index = None
+        self.incremental = False
+        self.freshness = None
+        self.cdc = False
+        self.parse_pool = None
+        self.http_cache = False
+        
         self.logger.info(f"Spider initialized with output file: {output_file}, format: {output_format}")
 
-    def parse(self, response):
-        script = response.xpath('//script[@id="shoebox-media-api-cache-apps"]/text()').get()
-        raw_data = json.loads(script)
-        key_0 = list(raw_data.keys())[0]
-        data = json.loads(raw_data[key_0])['d'][0]
-
-        yield App(
-            {
-                'name': data['attributes']['name'],
-                'user_rating': data['attributes']['userRating'],
-                'developer': data['relationships']['developer'],
-                'price': data['attributes']['platformAttributes']['ios']['offers'][0]['price'],
-                'url': response.url.replace('https://apps.apple.com', ''),  # Strip base URL from the app URL
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        
+        # Fields extracted from app pages (APP_FIELDS), which are also the fields the feed exports
+        spider.app_fields = select_fields(crawler.settings.getlist('APP_FIELDS'))
+        feed_fields = spider.app_fields + spider.extra_item_fields
+        feeds = spider.custom_settings['FEEDS']
+        
+        # Developers go to a feed of their own and apps reference them by id (see DeveloperMiddleware)
+        developers_feed = crawler.settings.get('DEVELOPERS_FEED')
+        if developers_feed and 'developer' in feed_fields:
+            feed_fields = tuple('developer_id' if field == 'developer' else field for field in feed_fields)
+            for feed in feeds.values():
+                feed['item_classes'] = [App]
+            feeds[developers_feed] = {
+                'format': 'jsonlines',
+                'encoding': 'utf8',
+                'store_empty': False,
+                'overwrite': False,
+                'item_classes': [Developer],
+                'fields': list(DEVELOPER_FIELDS),
             }
+        for feed in feeds.values():
+            feed.setdefault('fields', list(feed_fields))
+        
+        # custom_settings is only read from the class before the spider exists,
+        # so apply the per-instance feed settings while they can still change
+        crawler.settings.setdict(spider.custom_settings, priority='spider')
+        
+        # Allow pointing the spider at another sitemap index, e.g. a local stand-in server
+        sitemap_urls = crawler.settings.getlist('APPSTORE_SITEMAP_URLS')
+        if sitemap_urls:
+            spider.sitemap_urls = sitemap_urls
+            spider.allowed_domains = list(spider.allowed_domains) + [urlparse(url).hostname for url in sitemap_urls]
+        
+        # Sharded crawls only request the apps in their own partition
+        spider.shard_index = crawler.settings.getint('SHARD_INDEX')
+        spider.shard_count = crawler.settings.getint('SHARD_COUNT', 1)
+        
+        # Incremental mode: only schedule apps that are new or changed since the last run.
+        # Freshness mode: schedule apps in order of how likely they changed, from their history
+        spider.incremental = crawler.settings.getbool('INCREMENTAL_ENABLED')
+        if crawler.settings.getbool('FRESHNESS_ENABLED'):
+            spider.freshness = FreshnessScorer(crawler.settings.getint('FRESHNESS_PRIORITY_LEVELS', 100))
+        if spider.incremental or spider.freshness is not None:
+            spider.app_index = AppIndex(crawler.settings.get('INCREMENTAL_INDEX'))
+            spider.max_age = crawler.settings.getfloat('INCREMENTAL_MAX_AGE')
+            spider.tracked_fields = crawler.settings.getlist('FRESHNESS_FIELDS')
+            crawler.signals.connect(spider.index_item, signal=signals.item_scraped)
+            crawler.signals.connect(spider.close_index, signal=signals.spider_closed)
+        
+        # Change data capture needs to know every app the sitemap lists
+        spider.cdc = crawler.settings.getbool('CDC_ENABLED')
+        
+        # Cached app pages are exported from the fields stored with them (see AppCacheMiddleware)
+        spider.http_cache = crawler.settings.getbool('HTTPCACHE_ENABLED')
+        
+        # Parse app pages in worker processes instead of on the reactor thread
+        if crawler.settings.getint('PARSE_WORKERS') > 0:
+            crawler.signals.connect(spider.start_parse_pool, signal=signals.spider_opened)
+            crawler.signals.connect(spider.close_parse_pool, signal=signals.spider_closed)
+        return spider
+
+    def sitemap_requests(self, entry, loc, callback):
+        if self.shard_count > 1 and shard_for(loc, self.shard_count) != self.shard_index:
+            return
+        if self.cdc:
+            self.crawler.signals.send_catch_log(app_listed, app_id=app_id_from_url(loc))
+        if self.app_index is None:
+            yield scrapy.Request(loc, callback=callback)
+            return
+        
+        lastmod = parse_lastmod(entry.get('lastmod'))
+        history = self.app_index.history(app_id_from_url(loc))
+        now = time.time()
+        if self.incremental:
+            status = classify(history, lastmod, self.max_age, now)
+            self.crawler.stats.inc_value(f'incremental/{status}')
+            if status == SKIPPED:
+                return
+        priority = 0
+        if self.freshness is not None:
+            priority = self.freshness.priority(self.freshness.score(entry.get('priority'), lastmod, history, now))
+        yield scrapy.Request(loc, callback=callback, priority=priority, meta={'lastmod': lastmod})
+
+    def index_item(self, item, response, spider):
+        """Record a scraped app in the incremental index."""
+        if not isinstance(item, App):
+            return
+        app_id = app_id_from_url(ItemAdapter(item)['url'])
+        if app_id is None:
+            return
+        lastmod = response.meta.get('lastmod')
+        if isinstance(lastmod, dict):
+            # Batched responses carry one lastmod per app id
+            lastmod = lastmod.get(str(app_id))
+        tracked = fields_hash(item, self.tracked_fields) if self.tracked_fields else None
+        changed = self.app_index.record(app_id, lastmod, content_hash(item), time.time(), tracked)
+        if changed:
+            self.crawler.stats.inc_value('incremental/changed')
+
+    def close_index(self, spider):
+        self.app_index.close()
+
+    def start_parse_pool(self, spider):
+        settings = self.crawler.settings
+        self.parse_pool = ParsePool(
+            settings.getint('PARSE_WORKERS'),
+            settings.getint('PARSE_MAX_PENDING'),
+            self.crawler.stats,
+            Metrics.for_crawler(self.crawler),
         )
+        self.parse_pool.start()
+
+    def close_parse_pool(self, spider):
+        self.parse_pool.close()
+
+    def parse(self, response):
+        fields = response.meta.get('httpcache_fields')
+        if fields is not None and list(fields) == list(self.app_fields):
+            self.crawler.stats.inc_value('httpcache/fields_reused')
+            return [self.app_item(fields, response)]
+        if self.parse_pool is not None:
+            return self.parse_in_pool(response)
+        return self.parse_inline(response)
+
+    def parse_inline(self, response):
+        fields = parse_app_page(response.body, response.url, self.app_fields)
+        self.fields_parsed(fields, response)
+        yield self.app_item(fields, response)
+
+    async def parse_in_pool(self, response):
+        fields = await self.parse_pool.parse(response.body, response.url, self.app_fields)
+        self.fields_parsed(fields, response)
+        return [self.app_item(fields, response)]
+
+    def fields_parsed(self, fields, response):
+        if self.http_cache:
+            self.crawler.signals.send_catch_log(app_parsed, fields=fields, response=response, spider=self)
+
+    def app_item(self, fields, response):
+        """Build the item for the fields parsed from an app page."""
+        return App(fields)
 
@@ -0,0 +1,151 @@
+import json
+from urllib.parse import urlparse
+
+import scrapy
+
+from appstore_scraper.items import App
+from appstore_scraper.spiders.apps import BASE_URL, AppsSpider
+from appstore_scraper.utils import app_id_from_url
+
+
+# How each App field is read from a lookup result; the lookup has no subtitle
+# and only the current version of the version history
+LOOKUP_EXTRACTORS = {
+    'name': lambda result: result.get('trackName'),
+    'user_rating': lambda result: {
+        'value': result.get('averageUserRating', 0),
+        'ratingCount': result.get('userRatingCount', 0),
+    },
+    'developer': lambda result: {
+        'data': [
+            {
+                'id': str(result.get('artistId')),
+                'type': 'developers',
+                'attributes': {
+                    'name': result.get('artistName'),
+                    'url': result.get('artistViewUrl'),
+                },
+            }
+        ],
+    },
+    'price': lambda result: result.get('price'),
+    'bundle_id': lambda result: result.get('bundleId'),
+    'description': lambda result: result.get('description'),
+    'genres': lambda result: result.get('genres') or [],
+    'content_rating': lambda result: result.get('contentAdvisoryRating'),
+    'release_date': lambda result: (result.get('releaseDate') or '')[:10] or None,
+    'version': lambda result: result.get('version'),
+    'version_history': lambda result: [{
+        'version': result.get('version'),
+        'release_date': (result.get('currentVersionReleaseDate') or '')[:10] or None,
+        'release_notes': result.get('releaseNotes'),
+    }] if result.get('version') else [],
+    'minimum_os_version': lambda result: result.get('minimumOsVersion'),
+    'currency': lambda result: result.get('currency'),
+    'screenshots': lambda result: {
+        device: urls
+        for device, urls in (('iphone', result.get('screenshotUrls')), ('ipad', result.get('ipadScreenshotUrls')))
+        if urls
+    },
+}
+
+
+class LookupSpider(AppsSpider):
+    """
+    Spider that resolves apps through the batched iTunes lookup endpoint.
+
+    App ids found in the sitemap are grouped into multi-id lookup requests
+    instead of downloading one HTML page per app. Ids the lookup doesn't
+    return are requested through the regular HTML ``parse`` path.
+    """
+    name = "apps_lookup"
+    allowed_domains = AppsSpider.allowed_domains + ["itunes.apple.com"]
+
+    def __init__(self, *args, **kwargs):
+        super(LookupSpider, self).__init__(*args, **kwargs)
+        self._batch = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.lookup_url = crawler.settings.get('LOOKUP_URL')
+        spider.lookup_batch_size = crawler.settings.getint('LOOKUP_BATCH_SIZE')
+        spider.lookup_country = crawler.settings.get('LOOKUP_COUNTRY')
+        spider.allowed_domains = list(spider.allowed_domains) + [urlparse(spider.lookup_url).hostname]
+        return spider
+
+    def sitemap_requests(self, entry, loc, callback):
+        for request in super().sitemap_requests(entry, loc, callback):
+            app_id = app_id_from_url(request.url)
+            if app_id is None or request.callback != self.parse:
+                yield request
+                continue
+            self._batch[str(app_id)] = request
+            if len(self._batch) >= self.lookup_batch_size:
+                yield from self.batch_requests()
+
+    def sitemap_closed(self, response):
+        if self._batch:
+            yield from self.batch_requests()
+
+    def batch_requests(self):
+        """Yield the requests resolving the apps batched so far."""
+        yield self.lookup_request()
+
+    def lookup_request(self):
+        """Build a lookup request for the apps batched so far."""
+        batch, self._batch = self._batch, {}
+        self.crawler.stats.inc_value('lookup/batches')
+        self.crawler.stats.inc_value('lookup/ids', len(batch))
+        return scrapy.Request(
+            f"{self.lookup_url}?id={','.join(batch)}&country={self.lookup_country}",
+            callback=self.parse_lookup,
+            errback=self.lookup_failed,
+            # With freshness priorities, a batch goes as early as its most valuable app
+            priority=max(request.priority for request in batch.values()),
+            meta={
+                'lookup_batch': {app_id: request.url for app_id, request in batch.items()},
+                'lastmod': {app_id: request.meta.get('lastmod') for app_id, request in batch.items()},
+            },
+        )
+
+    def parse_lookup(self, response):
+        urls = dict(response.meta['lookup_batch'])
+        try:
+            results = json.loads(response.text).get('results', [])
+        except ValueError:
+            # E.g. an HTML error page served with a 200
+            self.logger.warning("Invalid lookup response from %(url)s, falling back to the app pages",
+                                {'url': response.url})
+            self.crawler.stats.inc_value('lookup/invalid')
+            results = []
+        for result in results:
+            app_id = str(result.get('trackId'))
+            if app_id not in urls or result.get('kind') != 'software':
+                continue
+            yield self.app_from_lookup(result, urls.pop(app_id))
+        yield from self.fallback_requests(urls, response.meta['lastmod'])
+
+    def lookup_failed(self, failure):
+        """Fall back to the app pages of a whole batch whose lookup failed (after its retries)."""
+        meta = failure.request.meta
+        self.logger.warning("Lookup %(url)s failed, falling back to the app pages: %(error)s",
+                            {'url': failure.request.url, 'error': failure.value})
+        self.crawler.stats.inc_value('lookup/failed_batches')
+        return self.fallback_requests(meta['lookup_batch'], meta['lastmod'])
+
+    def fallback_requests(self, urls, lastmods):
+        """Request the HTML page of each app the lookup did not return."""
+        for app_id, url in urls.items():
+            self.crawler.stats.inc_value('lookup/fallback')
+            yield scrapy.Request(url, callback=self.parse, meta={'lastmod': lastmods.get(app_id)})
+
+    def app_from_lookup(self, result, url):
+        """Map a lookup result onto the same fields ``parse`` extracts from the page."""
+        fields = {}
+        for field in self.app_fields:
+            if field == 'url':
+                fields['url'] = url.replace(BASE_URL, '')
+            elif field in LOOKUP_EXTRACTORS:
+                fields[field] = LOOKUP_EXTRACTORS[field](result)
+        return App(fields)
@@ -0,0 +1,182 @@
+import json
+import os
+import re
+
+import scrapy
+from itemadapter import ItemAdapter
+from scrapy import signals
+
+from appstore_scraper.checkpoint import checkpoint_saving
+from appstore_scraper.spiders.lookup import LookupSpider
+from appstore_scraper.utils import json_hash
+
+STOREFRONT_RE = re.compile(r'^(https?://[^/]+)?/[a-z]{2}/')
+
+# File in JOBDIR holding the batches whose storefront lookups are still running
+BATCHES_FILE = 'storefront_batches.json'
+
+
+def storefront_url(url, country):
+    """Return an app URL moved to another storefront."""
+    return STOREFRONT_RE.sub(lambda m: f'{m.group(1) or ""}/{country}/', url, count=1)
+
+
+def storefront_record(result):
+    """Return the storefront-specific fields of a lookup result; no result means the app isn't sold there."""
+    if result is None:
+        return {'available': False}
+    return {
+        'available': True,
+        'price': result.get('price'),
+        'currency': result.get('currency'),
+        'user_rating': {
+            'value': result.get('averageUserRating', 0),
+            'ratingCount': result.get('userRatingCount', 0),
+        },
+    }
+
+
+class StorefrontsSpider(LookupSpider):
+    """
+    Spider that crawls several storefronts while downloading each app page once.
+
+    The full metadata of an app comes from its page in the first storefront
+    of ``STOREFRONTS``. Only price, availability and user rating vary between
+    storefronts, so those are gathered with batched lookup requests: one per
+    other storefront and batch of ``LOOKUP_BATCH_SIZE`` apps. Once every
+    lookup of a batch is back, the app pages are requested with their
+    storefront records in the request meta, so each app is yielded once with
+    a ``storefronts`` field mapping country codes to those records.
+
+    Batches waiting for lookups are saved to the job directory when the
+    crawl is paused. Requests per storefront are in the
+    ``storefronts/<country>/requests`` stats.
+    """
+    name = "apps_storefronts"
+    extra_item_fields = ('storefronts',)
+
+    def __init__(self, *args, **kwargs):
+        super(StorefrontsSpider, self).__init__(*args, **kwargs)
+        self.batches = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.storefronts = [country.strip().lower() for country in crawler.settings.getlist('STOREFRONTS')] or ['us']
+        spider.jobdir = crawler.settings.get('JOBDIR')
+        # Loaded once the spider opens, after a checkpoint may have been recovered
+        crawler.signals.connect(spider.load_batches, signal=signals.spider_opened)
+        crawler.signals.connect(spider.save_batches, signal=signals.spider_closed)
+        crawler.signals.connect(spider.checkpoint_batches, signal=checkpoint_saving)
+        return spider
+
+    def batch_requests(self):
+        """Yield the storefront lookups of the apps batched so far."""
+        batch, self._batch = self._batch, {}
+        self.crawler.stats.inc_value('lookup/batches')
+        self.crawler.stats.inc_value('lookup/ids', len(batch))
+        apps = {
+            app_id: [storefront_url(request.url, self.storefronts[0]), request.meta.get('lastmod')]
+            for app_id, request in batch.items()
+        }
+        countries = self.storefronts[1:]
+        if not countries:
+            yield from self.page_requests(apps, {})
+            return
+
+        key = json_hash(','.join(apps))
+        self.batches[key] = {'apps': apps, 'remaining': list(countries), 'storefronts': {app_id: {} for app_id in apps}}
+        for country in countries:
+            yield self.storefront_request(key, apps, country)
+
+    def storefront_request(self, key, apps, country):
+        self.crawler.stats.inc_value(f'storefronts/{country}/requests')
+        return scrapy.Request(
+            f"{self.lookup_url}?id={','.join(apps)}&country={country}",
+            callback=self.parse_storefront,
+            errback=self.storefront_failed,
+            meta={'storefront_batch': key, 'storefront': country},
+        )
+
+    def parse_storefront(self, response):
+        try:
+            results = json.loads(response.text).get('results', [])
+        except ValueError:
+            # E.g. an HTML error page served with a 200: unknown, as for a failed request
+            self.logger.warning("Invalid lookup response from %(url)s", {'url': response.url})
+            self.crawler.stats.inc_value(f"storefronts/{response.meta['storefront']}/errors")
+            return self.storefront_done(response.meta, None)
+        results = {
+            str(result.get('trackId')): result
+            for result in results
+            if result.get('kind') == 'software'
+        }
+        return self.storefront_done(response.meta, results)
+
+    def storefront_failed(self, failure):
+        # Record the storefront as unknown rather than holding back the whole batch
+        request = failure.request
+        self.crawler.stats.inc_value(f"storefronts/{request.meta['storefront']}/errors")
+        return self.storefront_done(request.meta, None)
+
+    def storefront_done(self, meta, results):
+        key, country = meta['storefront_batch'], meta['storefront']
+        batch = self.batches.get(key)
+        if batch is None or country not in batch['remaining']:
+            return
+        for app_id, storefronts in batch['storefronts'].items():
+            if results is None:
+                storefronts[country] = None
+                continue
+            record = storefront_record(results.get(app_id))
+            storefronts[country] = record
+            if record['available']:
+                self.crawler.stats.inc_value(f'storefronts/{country}/available')
+        batch['remaining'].remove(country)
+        if not batch['remaining']:
+            del self.batches[key]
+            yield from self.page_requests(batch['apps'], batch['storefronts'])
+
+    def page_requests(self, apps, storefronts):
+        for app_id, (url, lastmod) in apps.items():
+            self.crawler.stats.inc_value(f'storefronts/{self.storefronts[0]}/requests')
+            yield scrapy.Request(
+                url, callback=self.parse, meta={'lastmod': lastmod, 'storefronts': storefronts.get(app_id, {})}
+            )
+
+    def app_item(self, fields, response):
+        item = super().app_item(fields, response)
+        adapter = ItemAdapter(item)
+        # The page itself carries the first storefront's price and rating
+        rating = adapter.get('user_rating') or {}
+        storefronts = {
+            self.storefronts[0]: {
+                'available': True,
+                'price': adapter.get('price'),
+                'user_rating': {'value': rating.get('value', 0), 'ratingCount': rating.get('ratingCount', 0)},
+            },
+        }
+        storefronts.update(response.meta.get('storefronts') or {})
+        adapter['storefronts'] = storefronts
+        return item
+
+    def _batches_path(self):
+        return os.path.join(self.jobdir, BATCHES_FILE) if self.jobdir else None
+
+    def load_batches(self, spider):
+        path = self._batches_path()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.batches = json.load(f)
+
+    def save_batches(self, spider):
+        path = self._batches_path()
+        if not path:
+            return
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.batches, f)
+        os.replace(tmp_path, path)
+
+    def checkpoint_batches(self, spider):
+        return {BATCHES_FILE: json.dumps(self.batches).encode()}
@@ -0,0 +1,256 @@
+"""
+Compact persistent request queues for JOBDIR crawls.
+
+``PickleLifoDiskQueue`` pickles every request into its own queue file per
+priority. The app requests this project schedules only need a URL, a
+callback name, a priority and a few meta keys to be rebuilt, so these queues
+store exactly that as a row in a single SQLite database per queue directory.
+Requests that carry anything else (headers, a body, cookies, errbacks,
+non-JSON meta) fall back to a pickled ``Request.to_dict()`` in the same row.
+
+Writes are grouped into transactions of ``SCHEDULER_DISK_QUEUE_COMMIT_INTERVAL``
+operations, and per-queue sizes are kept in a side table so resuming never
+has to count the pending rows. With ``CHECKPOINT_ENABLED``, the queue is only
+committed together with a checkpoint (see ``appstore_scraper.checkpoint``),
+which is stored in the same database.
+"""
+
+import json
+import os
+import pickle
+import sqlite3
+
+from scrapy import Request, signals
+from scrapy.utils.request import request_from_dict
+
+DB_NAME = 'requests.sqlite3'
+
+
+def read_checkpoint(directory):
+    """Return the manifest, job files and in-progress requests of the checkpoint in a queue directory, or None."""
+    path = os.path.join(directory, DB_NAME)
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(path)
+    try:
+        row = conn.execute('SELECT manifest, files, requests FROM checkpoint WHERE id = 1').fetchone()
+    except sqlite3.OperationalError:
+        # Written before checkpoints existed
+        row = None
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    manifest, files, requests = row
+    return json.loads(manifest), pickle.loads(files), pickle.loads(requests)
+
+
+class SqliteQueueStore:
+    """All the disk queues of one queue directory, kept in one SQLite database."""
+
+    _stores = {}
+
+    @classmethod
+    def open(cls, crawler, directory):
+        store = cls._stores.get(directory)
+        if store is None:
+            commit_interval = crawler.settings.getint('SCHEDULER_DISK_QUEUE_COMMIT_INTERVAL', 1000)
+            checkpoints = crawler.settings.getbool('CHECKPOINT_ENABLED')
+            # With checkpoints, the queue on disk must only ever move from one checkpoint to the next
+            store = cls._stores[directory] = cls(directory, 0 if checkpoints else commit_interval, durable=checkpoints)
+            # Priority queues are closed whenever they run empty, so the store
+            # stays open until the spider is closed
+            crawler.signals.connect(store.close, signal=signals.spider_closed)
+        return store
+
+    def __init__(self, directory, commit_interval=1000, durable=False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, DB_NAME)
+        self.commit_interval = commit_interval
+        self._ops = 0
+        self._dirty = set()
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # Durable stores sync every commit, so a checkpoint also survives a power loss
+        self.conn.execute(f"PRAGMA synchronous={'FULL' if durable else 'NORMAL'}")
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS requests ('
+            ' id INTEGER PRIMARY KEY,'
+            ' queue TEXT NOT NULL,'
+            ' url TEXT,'
+            ' callback TEXT,'
+            ' meta TEXT,'
+            ' priority INTEGER,'
+            ' dont_filter INTEGER,'
+            ' blob BLOB)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS requests_queue ON requests (queue, id)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS counts (queue TEXT PRIMARY KEY, size INTEGER)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS checkpoint ('
+            ' id INTEGER PRIMARY KEY CHECK (id = 1),'
+            ' manifest TEXT,'
+            ' files BLOB,'
+            ' requests BLOB)'
+        )
+        self.counts = dict(self.conn.execute('SELECT queue, size FROM counts'))
+
+    def push(self, queue, row):
+        self.conn.execute(
+            'INSERT INTO requests (queue, url, callback, meta, priority, dont_filter, blob)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (queue,) + row,
+        )
+        self.counts[queue] = self.counts.get(queue, 0) + 1
+        self._changed(queue)
+
+    def peek(self, queue, lifo):
+        order = 'DESC' if lifo else 'ASC'
+        return self.conn.execute(
+            'SELECT id, url, callback, meta, priority, dont_filter, blob FROM requests'
+            f' WHERE queue = ? ORDER BY id {order} LIMIT 1',
+            (queue,),
+        ).fetchone()
+
+    def pop(self, queue, lifo):
+        row = self.peek(queue, lifo)
+        if row is None:
+            return None
+        self.conn.execute('DELETE FROM requests WHERE id = ?', (row[0],))
+        self.counts[queue] -= 1
+        self._changed(queue)
+        return row
+
+    def _changed(self, queue):
+        self._dirty.add(queue)
+        self._ops += 1
+        if self.commit_interval and self._ops >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        """Persist every operation so far, including the queue sizes."""
+        for queue in self._dirty:
+            if self.counts[queue]:
+                self.conn.execute('INSERT OR REPLACE INTO counts (queue, size) VALUES (?, ?)', (queue, self.counts[queue]))
+            else:
+                self.conn.execute('DELETE FROM counts WHERE queue = ?', (queue,))
+        self._dirty.clear()
+        self._ops = 0
+        self.conn.commit()
+
+    def save_checkpoint(self, manifest, files, requests):
+        """Commit the queue together with a checkpoint, atomically."""
+        self.conn.execute(
+            'INSERT OR REPLACE INTO checkpoint (id, manifest, files, requests) VALUES (1, ?, ?, ?)',
+            (json.dumps(manifest), pickle.dumps(files, protocol=4), pickle.dumps(requests, protocol=4)),
+        )
+        self.commit()
+
+    def clear_checkpoint(self):
+        """Drop the checkpoint with the next commit, once the crawl state is saved the regular way."""
+        self.conn.execute('DELETE FROM checkpoint')
+
+    def close(self):
+        if self._stores.get(self.directory) is not self:
+            return
+        del self._stores[self.directory]
+        self.commit()
+        empty = not any(self.counts.values())
+        self.conn.close()
+        if empty:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+
+
+class SqliteLifoDiskQueue:
+    """Scheduler disk queue storing requests compactly in a shared SQLite database."""
+
+    lifo = True
+
+    def __init__(self, crawler, key):
+        self.spider = crawler.spider
+        directory, self.name = os.path.split(key)
+        self.store = SqliteQueueStore.open(crawler, directory)
+
+    @classmethod
+    def from_crawler(cls, crawler, key, *args, **kwargs):
+        return cls(crawler, key)
+
+    def push(self, request):
+        row = self._compact_row(request)
+        if row is None:
+            # Raises ValueError for callbacks that aren't spider methods, which
+            # makes the scheduler keep the request in memory instead
+            d = request.to_dict(spider=self.spider)
+            row = (None, None, None, None, None, pickle.dumps(d, protocol=4))
+        self.store.push(self.name, row)
+
+    def pop(self):
+        return self._request(self.store.pop(self.name, self.lifo))
+
+    def peek(self):
+        return self._request(self.store.peek(self.name, self.lifo))
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return self.store.counts.get(self.name, 0)
+
+    def _compact_row(self, request):
+        """
+        Return the compact row for a plain GET request to a spider method, else None.
+
+        Checked directly on the request rather than through ``Request.to_dict()``,
+        whose callback lookup dominates the cost of pushing a request.
+        """
+        callback = request.callback
+        if (
+            type(request) is not Request
+            or request.method != 'GET'
+            or request.body
+            or request.headers
+            or request.cookies
+            or request.errback is not None
+            or request.flags
+            or request.cb_kwargs
+            or request.encoding != 'utf-8'
+        ):
+            return None
+        if callback is not None:
+            name = getattr(callback, '__name__', None)
+            if getattr(callback, '__self__', None) is not self.spider or getattr(self.spider, name, None) != callback:
+                return None
+            callback = name
+        meta = ''
+        if request.meta:
+            try:
+                meta = json.dumps(request.meta, separators=(',', ':'))
+            except (TypeError, ValueError):
+                return None
+            # Only keep it compact if it survives the round trip unchanged
+            if json.loads(meta) != request.meta:
+                return None
+        return (request.url, callback, meta or None, request.priority, int(request.dont_filter), None)
+
+    def _request(self, row):
+        if row is None:
+            return None
+        _, url, callback, meta, priority, dont_filter, blob = row
+        if blob is not None:
+            d = pickle.loads(blob)
+        else:
+            d = {
+                'url': url,
+                'callback': callback,
+                'meta': json.loads(meta) if meta else {},
+                'priority': priority,
+                'dont_filter': bool(dont_filter),
+            }
+        return request_from_dict(d, spider=self.spider)
+
+
+class SqliteFifoDiskQueue(SqliteLifoDiskQueue):
+    lifo = False
@@ -0,0 +1,90 @@
+"""
+Local SQLite store of scraped apps.
+
+Every app is kept once, keyed by its App Store id, together with the full
+item as JSON, a hash of its content and when it was first seen, last seen and
+last changed. Upserts are buffered and written in one transaction per batch,
+and ``changed_since`` lists the apps whose content changed after a given time.
+"""
+
+import json
+import sqlite3
+
+from itemadapter import ItemAdapter
+
+from appstore_scraper.utils import app_id_from_url, item_json, json_hash
+
+
+class AppStore:
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self._batch = []
+        # Another crawl may hold the write lock, so wait for it instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS apps ('
+            ' app_id INTEGER PRIMARY KEY,'
+            ' url TEXT,'
+            ' data TEXT,'
+            ' content_hash TEXT,'
+            ' first_seen REAL,'
+            ' last_seen REAL,'
+            ' last_changed REAL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS apps_last_changed ON apps (last_changed)')
+
+    def upsert(self, item, seen_at):
+        """Buffer an item for writing and return its app id, or None if it has none."""
+        adapter = ItemAdapter(item)
+        app_id = app_id_from_url(adapter.get('url') or '')
+        if app_id is None:
+            return None
+        data = item_json(item)
+        self._batch.append((app_id, adapter.get('url'), data, json_hash(data), seen_at))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+        return app_id
+
+    def flush(self):
+        """Write the buffered items in a single transaction."""
+        if not self._batch:
+            return
+        with self.conn:
+            # Apps whose content hash didn't change keep their stored data and last_changed
+            self.conn.executemany(
+                'INSERT INTO apps (app_id, url, data, content_hash, first_seen, last_seen, last_changed)'
+                ' VALUES (?1, ?2, ?3, ?4, ?5, ?5, ?5)'
+                ' ON CONFLICT (app_id) DO UPDATE SET'
+                ' url = excluded.url,'
+                ' last_seen = excluded.last_seen,'
+                ' data = CASE WHEN content_hash = excluded.content_hash THEN data ELSE excluded.data END,'
+                ' last_changed = CASE WHEN content_hash = excluded.content_hash'
+                ' THEN last_changed ELSE excluded.last_changed END,'
+                ' content_hash = excluded.content_hash',
+                self._batch,
+            )
+        self._batch = []
+
+    def get(self, app_id):
+        """Return the stored item of an app as a dict, or None."""
+        row = self.conn.execute('SELECT data FROM apps WHERE app_id = ?', (app_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def changed_since(self, timestamp):
+        """Yield ``(app_id, item, last_changed)`` for every app changed after ``timestamp``, oldest change first."""
+        cursor = self.conn.execute(
+            'SELECT app_id, data, last_changed FROM apps WHERE last_changed > ? ORDER BY last_changed',
+            (timestamp,),
+        )
+        for app_id, data, last_changed in cursor:
+            yield app_id, json.loads(data), last_changed
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM apps').fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,132 @@
+"""
+Adaptive per-host request rate and concurrency.
+
+Each host gets a ``HostController`` that paces requests with a token bucket
+and sizes the host's downloader slot. While responses come back healthy
+(no throttling status and latency close to the best seen) the rate and
+concurrency grow additively, by about one step per round trip. On 429/403/5xx
+responses or download errors they are cut multiplicatively, at most once
+per cooldown so that one burst of errors counts as a single congestion
+signal. A ``Retry-After`` header also pauses the host until it expires.
+
+Until the first backoff, a host is in slow start: like TCP, its rate and
+concurrency grow by one per response (doubling every round trip), so the
+limit is found quickly instead of after a long linear ramp.
+"""
+
+import email.utils
+import time
+
+# Weight of the newest sample in the latency moving average
+LATENCY_EWMA_WEIGHT = 0.2
+
+# Responses averaged before the best latency is tracked, so that a few fast
+# responses (e.g. sitemaps) don't become the baseline for app pages
+LATENCY_WARMUP = 20
+
+
+def parse_retry_after(value, now=None):
+    """Return the number of seconds a ``Retry-After`` header value asks to wait, or None."""
+    if not value:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode('latin-1')
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - (time.time() if now is None else now))
+
+
+class TokenBucket:
+    """Token bucket that hands out the wait time for each request instead of refusing it."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, now=None):
+        """Take a token and return how long to wait before using it."""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class HostController:
+    """AIMD controller of one host's request rate and concurrency."""
+
+    def __init__(self, concurrency=8, rate=20.0, min_concurrency=1, max_concurrency=32,
+                 min_rate=0.2, max_rate=500.0, backoff_factor=0.5, latency_tolerance=3.0):
+        self.concurrency = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.backoff_factor = backoff_factor
+        self.latency_tolerance = latency_tolerance
+        self.bucket = TokenBucket(float(rate), max(1.0, self.concurrency))
+        self.latency = None
+        self.best_latency = None
+        self.samples = 0
+        self.slow_start = True
+        self.paused_until = 0.0
+        self.last_backoff = 0.0
+        self.backoffs = 0
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def delay(self, now=None):
+        """Reserve a request slot and return how long the request has to wait."""
+        now = time.monotonic() if now is None else now
+        return max(self.bucket.reserve(now), self.paused_until - now)
+
+    def healthy(self):
+        return self.best_latency is None or self.latency <= self.best_latency * self.latency_tolerance
+
+    def on_success(self, latency):
+        if latency is not None:
+            self.samples += 1
+            self.latency = latency if self.latency is None else (
+                LATENCY_EWMA_WEIGHT * latency + (1 - LATENCY_EWMA_WEIGHT) * self.latency
+            )
+            if self.samples >= LATENCY_WARMUP:
+                self.best_latency = self.latency if self.best_latency is None else min(self.best_latency, self.latency)
+        if not self.healthy():
+            return
+        if self.slow_start:
+            concurrency_step, rate_step = 1, 1
+        else:
+            # About +1 concurrency per round of responses and +1 request/sec per second
+            concurrency_step, rate_step = 1 / self.concurrency, 1 / self.bucket.rate
+        self.concurrency = min(self.max_concurrency, self.concurrency + concurrency_step)
+        self.bucket.rate = min(self.max_rate, self.bucket.rate + rate_step)
+        self.bucket.burst = max(1.0, self.concurrency)
+
+    def on_backoff(self, retry_after=None, now=None):
+        """Back off after a throttling response or an error. Returns True if the limits were cut."""
+        now = time.monotonic() if now is None else now
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+        # Responses to requests sent before the last cut don't count again
+        cooldown = max(1.0, self.latency or 0.0)
+        if now - self.last_backoff < cooldown:
+            return False
+        self.last_backoff = now
+        self.backoffs += 1
+        self.slow_start = False
+        self.concurrency = max(self.min_concurrency, self.concurrency * self.backoff_factor)
+        self.bucket.rate = max(self.min_rate, self.bucket.rate * self.backoff_factor)
+        self.bucket.burst = max(1.0, self.concurrency)
+        self.bucket.tokens = min(self.bucket.tokens, 0.0)
+        return True
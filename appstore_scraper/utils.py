@@ -0,0 +1,50 @@
+import hashlib
+import json
+import re
+from datetime import datetime, timezone
+
+from itemadapter import ItemAdapter
+
+APP_ID_RE = re.compile(r'/id(\d+)')
+
+
+def app_id_from_url(url):
+    """Return the numeric App Store id in an app URL, or None if there isn't one."""
+    match = APP_ID_RE.search(url)
+    return int(match.group(1)) if match else None
+
+
+def parse_lastmod(value):
+    """Convert a sitemap ``<lastmod>`` value to a POSIX timestamp, or None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def item_json(item):
+    """Return an item's fields as key-sorted JSON."""
+    # Field values are plain JSON data, so a shallow copy serializes the same as
+    # ItemAdapter.asdict() without its recursive per-value type checks
+    return json.dumps(dict(ItemAdapter(item)), sort_keys=True, default=str)
+
+
+def json_hash(data):
+    """Return a short, stable hash of a JSON string."""
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+
+
+def content_hash(item):
+    """Return a short, stable hash of an item's fields."""
+    return json_hash(item_json(item))
+
+
+def fields_hash(item, fields):
+    """Return a short, stable hash of some of an item's fields."""
+    adapter = ItemAdapter(item)
+    return json_hash(json.dumps([adapter.get(field) for field in fields], sort_keys=True, default=str))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Throughput comparison of the HTML backend (apps) and the lookup backend (apps_lookup).
+
+Both spiders crawl the same synthetic catalog served by the local stand-in.
+
+    python -m benchmarks.bench_backends --apps 2000 --lookup-miss-rate 0.02
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from benchmarks.runner import run_crawl
+from benchmarks.standin import Catalog, index_url, serve
+
+
+def summarize(spider, stats):
+    elapsed = stats['benchmark/elapsed']
+    items = stats.get('item_scraped_count', 0)
+    return {
+        'spider': spider,
+        'items': items,
+        'requests': stats.get('downloader/request_count', 0),
+        'response_bytes': stats.get('downloader/response_bytes', 0),
+        'lookup_fallbacks': stats.get('lookup/fallback', 0),
+        'elapsed': elapsed,
+        'items_per_sec': items / elapsed if elapsed else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the HTML and lookup backends')
+    parser.add_argument('--apps', type=int, default=2000)
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--lookup-miss-rate', type=float, default=0.01)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    server = serve(Catalog(args.apps, args.shards, lookup_miss_rate=args.lookup_miss_rate))
+    host, port = server.server_address[:2]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for spider in ('apps', 'apps_lookup'):
+            settings = {
+                'APPSTORE_SITEMAP_URLS': index_url(server),
+                'LOOKUP_URL': f'http://{host}:{port}/lookup',
+                'LOOKUP_BATCH_SIZE': args.batch_size,
+            }
+            output = os.path.join(tmp, f'{spider}.jsonl')
+            stats = run_crawl(spider, settings, {'output_file': output, 'output_format': 'jsonlines'})
+            results.append(summarize(spider, stats))
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print(f"{r['spider']:>12}: {r['items']} items in {r['elapsed']:.2f}s "
+              f"({r['items_per_sec']:.1f} items/sec) | {r['requests']} requests | "
+              f"{r['response_bytes'] / 1e6:.1f} MB | {r['lookup_fallbacks']} fallbacks")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Full output vs. change events over a series of recrawls, against the local stand-in.
+
+Crawls the catalog ``--runs`` times with ``CDC_ENABLED``, writing the full
+output of every run as well. Before each recrawl, ``--changed-rate`` of the
+apps get a new price and rating, and ``--churn`` of them are dropped from
+the sitemap while as many new ones are added. Reports the bytes and records
+of the full output and of the events per run, the events by type, items/sec
+and peak RSS. Then checks that ``rebuild`` turns the first run's output plus
+the events of the later runs into the last run's output:
+
+    python -m benchmarks.bench_cdc --apps 5000 --runs 3 --changed-rate 0.05 --churn 0.01
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from appstore_scraper.cdc import read_records, rebuild
+from benchmarks.runner import run_crawl
+from benchmarks.standin import FIRST_APP_ID, Catalog, index_url, serve
+
+
+def snapshot(path):
+    return {record['url']: record for record in read_records(path)}
+
+
+def split_events(path):
+    """Write the events of each run to their own file, and return the paths and sizes."""
+    files = {}
+    for event in read_records(path):
+        files.setdefault(event['run'], []).append(json.dumps(event))
+    paths = []
+    for run in sorted(files):
+        run_path = f'{path}.run-{run}'
+        with open(run_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(files[run]) + '\n')
+        paths.append(run_path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark change events against full output over recrawls')
+    parser.add_argument('--apps', type=int, default=3000)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--changed-rate', type=float, default=0.05, help='Fraction of apps changed before each recrawl')
+    parser.add_argument('--churn', type=float, default=0.01, help='Fraction of apps replaced before each recrawl')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        events_path = os.path.join(tmp, 'changes.jsonl')
+        settings = {
+            'CDC_ENABLED': True,
+            'CDC_INDEX': os.path.join(tmp, 'cdc_index.db'),
+            'CDC_EVENTS_FILE': events_path,
+        }
+        outputs = []
+        # One server throughout, since app URLs include its port
+        server = serve(Catalog(args.apps, 4))
+        for run in range(args.runs):
+            server.catalog = Catalog(args.apps, 4, revision=run, changed_rate=args.changed_rate,
+                                     first_app=FIRST_APP_ID + round(run * args.churn * args.apps))
+            output = os.path.join(tmp, f'full-{run}.jsonl')
+            events_before = os.path.getsize(events_path) if os.path.exists(events_path) else 0
+            stats = run_crawl('apps', {**settings, 'APPSTORE_SITEMAP_URLS': index_url(server)},
+                              {'output_file': output, 'output_format': 'jsonlines'})
+            outputs.append(output)
+            items = stats.get('item_scraped_count', 0)
+            events = {op: stats.get(f'cdc/{op}', 0) for op in ('insert', 'update', 'delete')}
+            results.append({
+                'run': run + 1,
+                'items': items,
+                'items_per_sec': items / stats['benchmark/elapsed'],
+                'full_bytes': os.path.getsize(output),
+                'events_bytes': os.path.getsize(events_path) - events_before,
+                'events': events,
+                'unchanged': stats.get('cdc/unchanged', 0),
+                'peak_rss_mb': stats['benchmark/peak_rss_kb'] / 1024,
+            })
+        server.shutdown()
+
+        rebuilt = os.path.join(tmp, 'rebuilt.jsonl')
+        run_files = split_events(events_path)
+        rebuild(outputs[0], run_files[1:], rebuilt)
+        from_baseline = snapshot(rebuilt) == snapshot(outputs[-1])
+        rebuild(None, run_files, rebuilt)
+        from_events = snapshot(rebuilt) == snapshot(outputs[-1])
+
+    if args.json:
+        print(json.dumps({'runs': results, 'rebuild_from_baseline_ok': from_baseline,
+                          'rebuild_from_events_ok': from_events}, indent=2))
+        return
+    for r in results:
+        e = r['events']
+        print(f"run {r['run']}: {r['items']} items ({r['items_per_sec']:.0f}/s, peak RSS {r['peak_rss_mb']:.0f} MB) | "
+              f"full output {r['full_bytes'] / 1024:.0f} KB | events {r['events_bytes'] / 1024:.0f} KB: "
+              f"{e['insert']} inserts, {e['update']} updates, {e['delete']} deletes, {r['unchanged']} unchanged")
+    print(f"rebuilt last snapshot from first output + events: {'ok' if from_baseline else 'MISMATCH'}, "
+          f"from events only: {'ok' if from_events else 'MISMATCH'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Recovery from hard kills with and without checkpoints, against the local stand-in.
+
+For each ``CHECKPOINT_INTERVAL`` in ``--intervals`` (0: checkpoints off),
+crawls the catalog into a job directory. The crawl is killed with SIGKILL
+``--kill-after`` seconds after it starts, ``--kills`` times, and resumed
+until it finishes. The jsonlines output is then checked for truncated
+lines, duplicate and missing apps. Also reports the app pages downloaded
+more than once (work lost to the kills) and the resume time: seconds from
+starting a resumed crawl to its first item, including recovery.
+
+    python -m benchmarks.bench_checkpoint --apps 5000 --intervals 0 2 10 --kills 3 --kill-after 8
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import tempfile
+import time
+
+from benchmarks.runner import crawl_command
+from benchmarks.standin import Catalog, index_url, serve
+
+
+def check_output(path, apps):
+    urls, truncated = [], 0
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    urls.append(json.loads(line)['url'])
+                except ValueError:
+                    truncated += 1
+    unique = len(set(urls))
+    return {'items': len(urls), 'duplicates': len(urls) - unique, 'missing': apps - unique, 'truncated': truncated}
+
+
+def run(server, apps, interval, kills, kill_after, tmp):
+    jobdir = os.path.join(tmp, f'job-{interval}')
+    output = os.path.join(tmp, f'apps-{interval}.jsonl')
+    stats_file = os.path.join(tmp, f'stats-{interval}.json')
+    settings = {
+        'APPSTORE_SITEMAP_URLS': index_url(server),
+        'JOBDIR': jobdir,
+        'CHECKPOINT_ENABLED': bool(interval),
+        'CHECKPOINT_INTERVAL': interval or 30,
+    }
+    cmd = crawl_command('apps', stats_file, settings, {'output_file': output, 'output_format': 'jsonlines'})
+    server.catalog.served_pages = 0
+
+    killed, resume_times, recovery_times = 0, [], []
+    while True:
+        if os.path.exists(stats_file):
+            os.remove(stats_file)
+        started = time.perf_counter()
+        process = subprocess.Popen(cmd)
+        try:
+            process.wait(timeout=kill_after if killed < kills else None)
+        except subprocess.TimeoutExpired:
+            process.send_signal(signal.SIGKILL)
+            process.wait()
+            killed += 1
+            continue
+        if process.returncode != 0:
+            raise RuntimeError(f"Crawl failed with exit code {process.returncode}")
+        break
+
+    with open(stats_file) as f:
+        stats = json.load(f)
+    if killed:
+        resume_times.append(stats.get('benchmark/first_item_time'))
+        recovery_times.append(stats.get('checkpoint/recovery_time'))
+    return {
+        'interval': interval,
+        'kills': killed,
+        'pages_downloaded': server.catalog.served_pages,
+        'pages_redownloaded': server.catalog.served_pages - apps,
+        'resume_first_item_s': resume_times[0] if resume_times else None,
+        'recovery_s': recovery_times[0] if recovery_times else None,
+        'elapsed_last_run_s': time.perf_counter() - started,
+        **check_output(output, apps),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark recovery from hard kills with and without checkpoints')
+    parser.add_argument('--apps', type=int, default=5000)
+    parser.add_argument('--intervals', type=float, nargs='+', default=[0, 2, 10],
+                        help='CHECKPOINT_INTERVAL values in seconds (0: checkpoints off)')
+    parser.add_argument('--kills', type=int, default=3, help='Hard kills before the crawl may finish')
+    parser.add_argument('--kill-after', type=float, default=8, help='Seconds after starting that a crawl is killed')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    server = serve(Catalog(args.apps, 4))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for interval in args.intervals:
+            results.append(run(server, args.apps, interval, args.kills, args.kill_after, tmp))
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        mode = f"every {r['interval']:g}s" if r['interval'] else 'off'
+        resume = f"{r['resume_first_item_s']:.2f}s" if r['resume_first_item_s'] is not None else 'n/a'
+        print(f"checkpoints {mode:>9}: {r['kills']} kills | {r['items']} items, {r['duplicates']} duplicates, "
+              f"{r['missing']} missing, {r['truncated']} truncated lines | "
+              f"{r['pages_redownloaded']} pages downloaded again | resume to first item {resume}")
+
+
+if __name__ == '__main__':
+    main()
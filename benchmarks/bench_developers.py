@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Output volume and serialization time with developers inline vs. in their own feed.
+
+Exports ``--items`` synthetic apps as JSON lines, for each number of apps
+per developer, twice:
+
+- ``inline``: every app carries its developer's payload
+- ``normalized``: ``DeveloperMiddleware`` replaces it with the
+  ``developer_id`` and emits each developer once; the developers are
+  exported to a second feed
+
+Reports bytes per app (both feeds together), the time to serialize them
+(best of ``--repeat``), and the time the middleware takes to normalize
+them. With ``--apps``, also crawls the local stand-in twice with
+``DEVELOPERS_FEED`` to show that an unchanged developer isn't exported again:
+
+    python -m benchmarks.bench_developers --items 100000 --apps-per-developer 1 10 100 --apps 2000
+"""
+
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+
+from scrapy.exporters import JsonLinesItemExporter
+from scrapy.utils.test import get_crawler
+
+from appstore_scraper.items import App, CORE_FIELDS, DEVELOPER_FIELDS, Developer, register_adapter
+from appstore_scraper.middlewares import DeveloperMiddleware
+from appstore_scraper.parsing import app_fields
+from benchmarks.fixtures import make_app_record
+from benchmarks.runner import run_crawl
+from benchmarks.standin import FIRST_APP_ID, Catalog, index_url, serve
+
+
+def make_items(count, developers):
+    # Exported outside a crawl, so nothing else registers it
+    register_adapter()
+    return [
+        App(app_fields(make_app_record(app_id, developers=developers), f'/us/app/app-{app_id}/id{app_id}'))
+        for app_id in range(FIRST_APP_ID, FIRST_APP_ID + count)
+    ]
+
+
+def export(items, fields, developers=()):
+    """Return the bytes of the app (and developer) feeds of ``items`` and the seconds taken to write them."""
+    start = time.perf_counter()
+    apps_out, developers_out = io.BytesIO(), io.BytesIO()
+    apps_exporter = JsonLinesItemExporter(apps_out, fields_to_export=list(fields))
+    developers_exporter = JsonLinesItemExporter(developers_out, fields_to_export=list(DEVELOPER_FIELDS))
+    for item in items:
+        apps_exporter.export_item(item)
+    for developer in developers:
+        developers_exporter.export_item(developer)
+    return apps_out.tell() + developers_out.tell(), time.perf_counter() - start
+
+
+def best_export(repeat, *args):
+    runs = [export(*args) for _ in range(repeat)]
+    return runs[0][0], min(elapsed for _, elapsed in runs)
+
+
+def normalize(items):
+    """Run ``items`` through ``DeveloperMiddleware``; return the apps, the developers and the seconds taken."""
+    crawler = get_crawler(settings_dict={'DEVELOPERS_FEED': 'developers.jsonl', 'DEVELOPERS_INDEX': ''})
+    middleware = DeveloperMiddleware.from_crawler(crawler)
+    start = time.perf_counter()
+    output = list(middleware.process_spider_output(None, items, None))
+    elapsed = time.perf_counter() - start
+    apps = [item for item in output if isinstance(item, App)]
+    return apps, [item for item in output if isinstance(item, Developer)], elapsed
+
+
+def crawl_runs(apps, apps_per_developer):
+    server = serve(Catalog(apps, 4, developers=max(1, apps // apps_per_developer)))
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = {
+            'APPSTORE_SITEMAP_URLS': index_url(server),
+            'DEVELOPERS_FEED': os.path.join(tmp, 'developers.jsonl'),
+            'DEVELOPERS_INDEX': os.path.join(tmp, 'developers.db'),
+        }
+        for run in range(2):
+            output = os.path.join(tmp, f'apps-{run}.jsonl')
+            stats = run_crawl('apps', settings, {'output_file': output, 'output_format': 'jsonlines'})
+            runs.append({
+                'developers_emitted': stats.get('developers/emitted', 0),
+                'developers_skipped': stats.get('developers/skipped', 0),
+                'app_bytes': os.path.getsize(output),
+            })
+    server.shutdown()
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark exporting developers inline vs. in their own feed')
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--apps-per-developer', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--apps', type=int, default=0, help='Also crawl this many apps from the stand-in, twice')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    normalized_fields = ['developer_id' if field == 'developer' else field for field in CORE_FIELDS]
+    for ratio in args.apps_per_developer:
+        items = make_items(args.items, max(1, args.items // ratio))
+        size, serialize = best_export(args.repeat, items, CORE_FIELDS)
+        results.append({'apps_per_developer': ratio, 'mode': 'inline', 'bytes_per_app': size / args.items,
+                        'developers': 0, 'serialize': serialize, 'normalize': 0.0})
+        apps, developers, normalize_time = normalize(items)
+        size, serialize = best_export(args.repeat, apps, normalized_fields, developers)
+        results.append({'apps_per_developer': ratio, 'mode': 'normalized', 'bytes_per_app': size / args.items,
+                        'developers': len(developers), 'serialize': serialize, 'normalize': normalize_time})
+    crawls = crawl_runs(args.apps, args.apps_per_developer[-1]) if args.apps else None
+
+    if args.json:
+        print(json.dumps({'export': results, 'crawls': crawls}, indent=2))
+        return
+    for r in results:
+        extra = ''
+        if r['mode'] == 'normalized':
+            extra = f" + normalize {r['normalize'] / args.items * 1e6:4.1f} us/app, {r['developers']} developers"
+        print(f"{r['apps_per_developer']:4d} apps/developer {r['mode']:>10}: {r['bytes_per_app']:6.1f} B/app, "
+              f"serialize {r['serialize'] / args.items * 1e6:5.1f} us/app{extra}")
+    for run, r in enumerate(crawls or ()):
+        print(f"crawl {run + 1}: {r['developers_emitted']} developers exported, {r['developers_skipped']} skipped, "
+              f"{r['app_bytes'] / args.apps:.0f} B/app")
+
+
+if __name__ == '__main__':
+    main()
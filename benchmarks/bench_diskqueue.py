@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Benchmark of the scheduler disk queues: pickle queue vs. compact SQLite queue.
+
+Pushes N app requests, reopens the queue as a resumed crawl would and pops
+them all, reporting enqueue/dequeue rates, reopen time and on-disk size.
+
+    python -m benchmarks.bench_diskqueue --requests 200000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from scrapy import Request
+from scrapy.squeues import PickleLifoDiskQueue
+from scrapy.utils.test import get_crawler
+
+from appstore_scraper.spiders.apps import AppsSpider
+from appstore_scraper.squeues import SqliteLifoDiskQueue, SqliteQueueStore
+
+QUEUES = {
+    'pickle': PickleLifoDiskQueue,
+    'sqlite': SqliteLifoDiskQueue,
+}
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def close(queue):
+    queue.close()
+    # The SQLite store is normally closed on spider_closed
+    for store in list(SqliteQueueStore._stores.values()):
+        store.close()
+
+
+def run(name, spider, requests, tmp):
+    crawler = get_crawler(settings_dict={'SCHEDULER_DISK_QUEUE_COMMIT_INTERVAL': 1000})
+    crawler.spider = spider
+    key = os.path.join(tmp, name, '0')
+    queue_cls = QUEUES[name]
+
+    queue = queue_cls.from_crawler(crawler, key)
+    start = time.perf_counter()
+    for request in requests:
+        queue.push(request)
+    push_time = time.perf_counter() - start
+    close(queue)
+    size = dir_size(os.path.join(tmp, name))
+
+    start = time.perf_counter()
+    queue = queue_cls.from_crawler(crawler, key)
+    pending = len(queue)
+    reopen_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    while queue.pop() is not None:
+        pass
+    pop_time = time.perf_counter() - start
+    close(queue)
+    return {
+        'queue': name,
+        'requests': pending,
+        'enqueue_per_sec': len(requests) / push_time,
+        'dequeue_per_sec': pending / pop_time,
+        'reopen_ms': reopen_time * 1000,
+        'bytes_on_disk': size,
+        'bytes_per_request': size / len(requests),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark scheduler disk queues')
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    spider = AppsSpider()
+    requests = [
+        Request(f'https://apps.apple.com/us/app/app-{i}/id{1000000 + i}', callback=spider.parse, meta={'depth': 1})
+        for i in range(args.requests)
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [run(name, spider, requests, tmp) for name in QUEUES]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print(f"{r['queue']:>6}: enqueue {r['enqueue_per_sec']:9.0f}/s | dequeue {r['dequeue_per_sec']:9.0f}/s | "
+              f"reopen {r['reopen_ms']:7.1f} ms | {r['bytes_on_disk'] / 1e6:7.1f} MB "
+              f"({r['bytes_per_request']:.0f} B/request)")
+
+
+if __name__ == '__main__':
+    main()
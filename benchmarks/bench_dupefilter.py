@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Benchmark of the request fingerprint dupefilter vs. the App Store id dupefilter.
+
+Feeds N unique app requests (plus one duplicate under another slug for each)
+through every filter, then closes it and loads it back as a resumed crawl
+would, reporting throughput, memory, on-disk size and load time.
+
+    python -m benchmarks.bench_dupefilter --requests 200000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+from scrapy import Request
+from scrapy.dupefilters import RFPDupeFilter
+
+from appstore_scraper.dupefilters import AppIdDupeFilter
+
+
+def make_filter(name, path, capacity):
+    if name == 'rfp':
+        return RFPDupeFilter(path)
+    if name == 'app_id':
+        return AppIdDupeFilter(path)
+    return AppIdDupeFilter(path, bloom_capacity=capacity, bloom_error_rate=0.001)
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def run(name, requests, capacity):
+    with tempfile.TemporaryDirectory() as path:
+        df = make_filter(name, path, capacity)
+        start = time.perf_counter()
+        unique = sum(not df.request_seen(request) for request in requests)
+        elapsed = time.perf_counter() - start
+        df.close('finished')
+        size = dir_size(path)
+
+        start = time.perf_counter()
+        df = make_filter(name, path, capacity)
+        load_time = time.perf_counter() - start
+        df.close('finished')
+
+    # Memory is measured separately, tracemalloc slows everything down
+    with tempfile.TemporaryDirectory() as path:
+        tracemalloc.start()
+        df = make_filter(name, None, capacity)
+        for request in requests:
+            df.request_seen(request)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del df
+
+    return {
+        'filter': name,
+        'unique': unique,
+        'requests_per_sec': len(requests) / elapsed,
+        'memory_bytes': memory,
+        'bytes_on_disk': size,
+        'load_ms': load_time * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dupefilters')
+    parser.add_argument('--requests', type=int, default=100000, help='Number of unique apps')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    requests = []
+    for i in range(args.requests):
+        app_id = 300000000 + i * 7
+        requests.append(Request(f'https://apps.apple.com/us/app/app-{i}/id{app_id}'))
+        requests.append(Request(f'https://apps.apple.com/us/app/renamed-{i}/id{app_id}?uo=4'))
+
+    results = [run(name, requests, args.requests) for name in ('rfp', 'app_id', 'bloom')]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print(f"{r['filter']:>6}: {r['unique']:8d} unique | {r['requests_per_sec']:9.0f} requests/s | "
+              f"{r['memory_bytes'] / r['unique']:6.1f} B/app in memory | "
+              f"{r['bytes_on_disk'] / r['unique']:6.1f} B/app on disk | load {r['load_ms']:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Benchmark of the feed formats: JSON and JSON lines vs. Parquet.
+
+Exports N synthetic ``App`` items with each exporter, then reads the file
+back the way an analytics job would, reporting write throughput, file size
+and read time.
+
+    python -m benchmarks.bench_exporters --items 200000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from scrapy.exporters import JsonItemExporter, JsonLinesItemExporter
+
+from appstore_scraper.items import App, register_adapter
+from benchmarks.fixtures import make_app_record
+
+try:
+    import pyarrow.parquet as pq
+    from appstore_scraper.exporters import ParquetItemExporter
+except ImportError:
+    pq = None
+
+
+def make_items(count):
+    # Exported outside a crawl, so nothing else registers it
+    register_adapter()
+    items = []
+    for i in range(count):
+        record = make_app_record(1000000 + i)
+        attributes = record['attributes']
+        items.append(App(
+            name=attributes['name'],
+            user_rating=attributes['userRating'],
+            developer=record['relationships']['developer'],
+            price=attributes['platformAttributes']['ios']['offers'][0]['price'],
+            url=f'/us/app/app-{record["id"]}/id{record["id"]}',
+        ))
+    return items
+
+
+def read_json(path):
+    with open(path, encoding='utf-8') as f:
+        return len(json.load(f))
+
+
+def read_jsonlines(path):
+    with open(path, encoding='utf-8') as f:
+        return sum(1 for line in f if json.loads(line))
+
+
+def read_parquet(path):
+    return pq.read_table(path).num_rows
+
+
+def formats(row_group_size):
+    yield 'json', lambda f: JsonItemExporter(f), read_json
+    yield 'jsonlines', lambda f: JsonLinesItemExporter(f), read_jsonlines
+    if pq is not None:
+        for codec in ('snappy', 'zstd'):
+            yield (
+                f'parquet/{codec}',
+                lambda f, codec=codec: ParquetItemExporter(f, row_group_size=row_group_size, compression=codec),
+                read_parquet,
+            )
+
+
+def run(name, make_exporter, read, items, tmp):
+    path = os.path.join(tmp, name.replace('/', '-'))
+    start = time.perf_counter()
+    with open(path, 'wb') as f:
+        exporter = make_exporter(f)
+        exporter.start_exporting()
+        for item in items:
+            exporter.export_item(item)
+        exporter.finish_exporting()
+    write_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = read(path)
+    read_time = time.perf_counter() - start
+    assert rows == len(items), (name, rows)
+    return {
+        'format': name,
+        'items_per_sec': len(items) / write_time,
+        'bytes': os.path.getsize(path),
+        'read_ms': read_time * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark feed export formats')
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--row-group-size', type=int, default=10000)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    items = make_items(args.items)
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [run(name, make_exporter, read, items, tmp) for name, make_exporter, read in formats(args.row_group_size)]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    if pq is None:
+        print("pyarrow is not installed, skipping Parquet")
+    for r in results:
+        print(f"{r['format']:>15}: write {r['items_per_sec']:9.0f} items/s | "
+              f"{r['bytes'] / 1e6:7.2f} MB | read {r['read_ms']:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
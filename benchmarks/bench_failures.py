@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Recovering from a bad hour: ``--retry-failed`` vs. another full crawl, against the local stand-in.
+
+Crawls the catalog while ``--broken-rate`` of the app pages fail: half of
+them answer 503 (after retries) and half have no shoebox script. The failed
+pages end up in the failure ledger. Then, with the stand-in healthy again,
+recovers the lost apps twice:
+
+- once with ``FAILURES_RETRY``, which only requests the ledger's entries
+- once with a full recrawl
+
+Reports the items, lost apps and ledger entries per failure class of the bad
+crawl, and the requests, time and recovered apps of both recoveries:
+
+    python -m benchmarks.bench_failures --apps 10000 --broken-rate 0.02
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+
+from benchmarks.runner import run_crawl
+from benchmarks.standin import Catalog, index_url, serve
+
+
+def ledger_summary(path):
+    conn = sqlite3.connect(path)
+    rows = conn.execute('SELECT failure, COUNT(*) FROM failures GROUP BY failure ORDER BY failure').fetchall()
+    conn.close()
+    return dict(rows)
+
+
+def scraped_urls(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return {json.loads(line)['url'] for line in f if line.strip()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark re-crawling failed pages against a full recrawl')
+    parser.add_argument('--apps', type=int, default=5000)
+    parser.add_argument('--broken-rate', type=float, default=0.02, help='Fraction of app pages failing in the bad crawl')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ledger = os.path.join(tmp, 'failures.db')
+        server = serve(Catalog(args.apps, 10, broken_rate=args.broken_rate))
+        # Without the adaptive throttle, which would spend the bad crawl backing off from the 503s
+        settings = {'APPSTORE_SITEMAP_URLS': index_url(server), 'FAILURES_LEDGER': ledger, 'RETRY_TIMES': 2,
+                    'ADAPTIVE_THROTTLE_ENABLED': False}
+        bad_output = os.path.join(tmp, 'bad.jsonl')
+        stats = run_crawl('apps', settings, {'output_file': bad_output, 'output_format': 'jsonlines'})
+        scraped = scraped_urls(bad_output)
+        bad = {
+            'items': stats.get('item_scraped_count', 0),
+            'lost': args.apps - len(scraped),
+            'ledger': ledger_summary(ledger),
+            'elapsed': stats['benchmark/elapsed'],
+        }
+
+        server.catalog = Catalog(args.apps, 10)
+        recoveries = {}
+        for mode in ('retry_failed', 'full_recrawl'):
+            output = os.path.join(tmp, f'{mode}.jsonl')
+            mode_settings = dict(settings)
+            if mode == 'retry_failed':
+                mode_settings.update({'FAILURES_RETRY': True, 'FAILURES_BACKOFF': 0})
+            else:
+                # Leave the ledger to the retry run
+                mode_settings['FAILURES_LEDGER'] = ''
+            served_before = server.catalog.served_pages
+            stats = run_crawl('apps', mode_settings, {'output_file': output, 'output_format': 'jsonlines'})
+            recovered = scraped_urls(output) - scraped
+            recoveries[mode] = {
+                'requests': stats.get('downloader/request_count', 0),
+                'app_pages': server.catalog.served_pages - served_before,
+                'elapsed': stats['benchmark/elapsed'],
+                'recovered': len(recovered),
+            }
+        recoveries['retry_failed']['ledger_left'] = sum(ledger_summary(ledger).values())
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps({'bad_crawl': bad, 'recovery': recoveries}, indent=2))
+        return
+    failures = ', '.join(f'{count} {failure}' for failure, count in bad['ledger'].items())
+    print(f"bad crawl: {bad['items']} items, {bad['lost']} apps lost in {bad['elapsed']:.1f}s | ledger: {failures}")
+    for mode, r in recoveries.items():
+        left = f", {r['ledger_left']} left in the ledger" if 'ledger_left' in r else ''
+        print(f"{mode:>13}: {r['requests']} requests ({r['app_pages']} app pages) in {r['elapsed']:.2f}s, "
+              f"recovered {r['recovered']}/{bad['lost']} lost apps{left}")
+
+
+if __name__ == '__main__':
+    main()
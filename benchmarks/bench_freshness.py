@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Replay of a catalog refresh: sitemap order vs. freshness priorities.
+
+Simulates a catalog whose apps change price or rating at very different
+rates (log-normally distributed, from several times a day to once in years)
+and whose pages also change in other ways that move their ``<lastmod>``.
+The catalog is scraped in full every ``--every`` days for ``--runs`` runs,
+recorded in a real app index, and then refreshed once more. All the requests
+of that refresh go through ``AppsSpider.sitemap_requests`` and the
+scheduler's priority queue over the SQLite disk queue, with
+``FRESHNESS_ENABLED`` off and on. Reports the share of the apps that really
+changed which the first 10/25/50% of the dequeued requests cover (also
+weighted by sitemap priority), next to the best possible order, and the
+enqueue/dequeue rate of the queue:
+
+    python -m benchmarks.bench_freshness --apps 100000
+    python -m benchmarks.bench_freshness --apps 100000 --no-lastmod   # history only
+"""
+
+import argparse
+import bisect
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from scrapy.crawler import Crawler
+from scrapy.pqueues import ScrapyPriorityQueue
+
+from appstore_scraper.freshness import DAY
+from appstore_scraper.incremental import AppIndex
+from appstore_scraper.spiders.apps import AppsSpider
+from appstore_scraper.squeues import SqliteLifoDiskQueue, SqliteQueueStore
+from appstore_scraper.utils import app_id_from_url
+
+CUTOFFS = (0.1, 0.25, 0.5)
+IMPORTANCE = (0.2, 0.3, 0.5, 0.5, 0.5, 0.8, 1.0)
+
+
+def poisson_events(rng, rate, start, end):
+    """Return the times of the events of a Poisson process with ``rate`` per day."""
+    events, t = [], start
+    while True:
+        t += rng.expovariate(rate) * DAY
+        if t > end:
+            return events
+        events.append(t)
+
+
+def simulate(args, now):
+    """Return the simulated apps with their change events and the past run times."""
+    rng = random.Random(args.seed)
+    runs = [now - (args.runs - k) * args.every * DAY for k in range(args.runs)]
+    start = runs[0] - 30 * DAY
+    apps = []
+    for i in range(args.apps):
+        tracked = poisson_events(rng, rng.lognormvariate(math.log(1 / args.median_days), args.spread), start, now)
+        other = poisson_events(rng, rng.lognormvariate(math.log(1 / args.other_median_days), 1.0), start, now)
+        apps.append({
+            'app_id': 1000000 + i,
+            'importance': rng.choice(IMPORTANCE),
+            'tracked': tracked,
+            'page': sorted(tracked + other),
+        })
+    rng.shuffle(apps)
+    return apps, runs
+
+
+def version_at(app, t):
+    return bisect.bisect_right(app['tracked'], t)
+
+
+def lastmod_at(app, t):
+    i = bisect.bisect_right(app['page'], t)
+    return app['page'][i - 1] if i else None
+
+
+def record_history(index, apps, runs, use_lastmod):
+    for t in runs:
+        for app in apps:
+            lastmod = lastmod_at(app, t) if use_lastmod else None
+            index.record(app['app_id'], lastmod, 'x', t, str(version_at(app, t)))
+    index.commit()
+
+
+def sitemap_entry(app, now, use_lastmod):
+    entry = {
+        'loc': f"https://apps.apple.com/us/app/app-{app['app_id']}/id{app['app_id']}",
+        'priority': f"{app['importance']:.1f}",
+    }
+    lastmod = lastmod_at(app, now)
+    if use_lastmod and lastmod is not None:
+        entry['lastmod'] = datetime.fromtimestamp(lastmod, timezone.utc).isoformat()
+    return entry
+
+
+def replay(freshness, index_path, entries, tmp):
+    """Schedule the refresh's requests and return the app ids in dequeue order, with the queue rates."""
+    # The spider applies its feed settings in from_crawler, so they can't be frozen yet
+    crawler = Crawler(AppsSpider, {'FRESHNESS_ENABLED': freshness, 'INCREMENTAL_INDEX': index_path})
+    spider = AppsSpider.from_crawler(crawler)
+    crawler.spider = spider
+    key = os.path.join(tmp, f"queue-{'freshness' if freshness else 'sitemap'}")
+
+    start = time.perf_counter()
+    queue = ScrapyPriorityQueue.from_crawler(crawler, SqliteLifoDiskQueue, key)
+    for entry in entries:
+        for request in spider.sitemap_requests(entry, entry['loc'], spider.parse):
+            queue.push(request)
+    enqueue_time = time.perf_counter() - start
+    if spider.app_index is not None:
+        spider.close_index(spider)
+
+    order = []
+    start = time.perf_counter()
+    while True:
+        request = queue.pop()
+        if request is None:
+            break
+        order.append(app_id_from_url(request.url))
+    dequeue_time = time.perf_counter() - start
+    for store in list(SqliteQueueStore._stores.values()):
+        store.close()
+    return order, len(entries) / enqueue_time, len(order) / dequeue_time
+
+
+def coverage(order, changed, weights):
+    """Return the share of changed apps (and of their weight) among the first requests at each cutoff."""
+    total, total_weight = len(changed), sum(weights[a] for a in changed) or 1
+    result = {}
+    for cutoff in CUTOFFS:
+        head = order[:round(len(order) * cutoff)]
+        hits = [a for a in head if a in changed]
+        result[cutoff] = (len(hits) / max(1, total), sum(weights[a] for a in hits) / total_weight)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a catalog refresh in sitemap order and with freshness priorities')
+    parser.add_argument('--apps', type=int, default=50000)
+    parser.add_argument('--runs', type=int, default=8, help='Past full scrapes recorded in the app index')
+    parser.add_argument('--every', type=float, default=7, help='Days between runs')
+    parser.add_argument('--median-days', type=float, default=90, help='Median days between price/rating changes of an app')
+    parser.add_argument('--spread', type=float, default=2.0, help='Sigma of the log-normal change rates')
+    parser.add_argument('--other-median-days', type=float, default=14,
+                        help='Median days between other page changes, which also move <lastmod>')
+    parser.add_argument('--no-lastmod', action='store_true', help='Sitemap without <lastmod>: rely on history only')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    use_lastmod = not args.no_lastmod
+    now = time.time()
+    apps, runs = simulate(args, now)
+    changed = {app['app_id'] for app in apps if version_at(app, now) != version_at(app, runs[-1])}
+    weights = {app['app_id']: app['importance'] for app in apps}
+    entries = [sitemap_entry(app, now, use_lastmod) for app in apps]
+    best = sorted(weights, key=lambda a: (a not in changed, -weights[a]))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        index_path = os.path.join(tmp, 'app_index.db')
+        index = AppIndex(index_path)
+        record_history(index, apps, runs, use_lastmod)
+        index.close()
+        for freshness in (False, True):
+            order, enqueue_rate, dequeue_rate = replay(freshness, index_path, entries, tmp)
+            results.append({
+                'order': 'freshness' if freshness else 'sitemap',
+                'coverage': coverage(order, changed, weights),
+                'enqueue_per_sec': enqueue_rate,
+                'dequeue_per_sec': dequeue_rate,
+            })
+    results.append({'order': 'best', 'coverage': coverage(best, changed, weights)})
+
+    if args.json:
+        print(json.dumps({'apps': args.apps, 'changed': len(changed), 'runs': results}, indent=2))
+        return
+    print(f"{args.apps} apps, {len(changed)} changed since the last run ({len(changed) / args.apps:.1%})")
+    for r in results:
+        cov = ' | '.join(
+            f"first {cutoff:.0%}: {share:.1%} ({weighted:.1%} weighted)" for cutoff, (share, weighted) in r['coverage'].items()
+        )
+        rates = ''
+        if 'enqueue_per_sec' in r:
+            rates = f" | enqueue {r['enqueue_per_sec']:.0f}/s, dequeue {r['dequeue_per_sec']:.0f}/s"
+        print(f"{r['order']:>9}: {cov}{rates}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Benchmark of the SQLite HTTP cache against Scrapy's filesystem cache.
+
+Crawls the local stand-in twice with each cache storage: a cold crawl that
+fills the cache, then a recrawl after ``--changed-rate`` of the apps got a new
+ETag, so the rest are answered with 304 Not Modified. Reports crawl rate,
+bytes downloaded, hit rate, bytes saved, pages exported from their stored
+fields without parsing and the size of the cache on disk,
+next to the same two crawls without a cache.
+
+    python -m benchmarks.bench_httpcache --apps 2000 --changed-rate 0.1
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from benchmarks.runner import run_crawl
+from benchmarks.standin import Catalog, index_url, serve
+
+STORAGES = {
+    'none': None,
+    'filesystem': {
+        'HTTPCACHE_STORAGE': 'scrapy.extensions.httpcache.FilesystemCacheStorage',
+        'HTTPCACHE_GZIP': True,
+    },
+    'sqlite': {'HTTPCACHE_STORAGE': 'appstore_scraper.httpcache.AppCacheStorage'},
+}
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def bench_storage(name, args):
+    server = serve(Catalog(args.apps, 4, padding_kb=args.padding_kb, changed_rate=args.changed_rate))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = os.path.join(tmp, 'httpcache')
+        settings = {'APPSTORE_SITEMAP_URLS': index_url(server), 'HTTPCACHE_ENABLED': STORAGES[name] is not None}
+        settings.update({**(STORAGES[name] or {}), 'HTTPCACHE_DIR': cache_dir})
+        for crawl in ('cold', 'recrawl'):
+            server.catalog.served_bytes = server.catalog.not_modified = 0
+            output = os.path.join(tmp, f'apps-{crawl}.jsonl')
+            stats = run_crawl('apps', settings, {'output_file': output, 'output_format': 'jsonlines'})
+            items = stats.get('item_scraped_count', 0)
+            results.append({
+                'storage': name,
+                'crawl': crawl,
+                'items': items,
+                'items_per_sec': items / stats['benchmark/elapsed'],
+                'downloaded_mb': server.catalog.served_bytes / 1024 / 1024,
+                'not_modified': server.catalog.not_modified,
+                'hit_rate': stats.get('httpcache/hit_rate'),
+                'saved_mb': stats.get('httpcache/bytes_saved', 0) / 1024 / 1024,
+                'fields_reused': stats.get('httpcache/fields_reused', 0),
+                'parse_ms_per_page': stats.get('callback/parse/time', 0) / max(1, stats.get('callback/parse/count', 0)) * 1000,
+                'cache_mb': dir_size(cache_dir) / 1024 / 1024,
+            })
+            # Change some of the apps before the recrawl
+            server.catalog.revision += 1
+    server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SQLite HTTP cache against the filesystem cache')
+    parser.add_argument('--apps', type=int, default=2000)
+    parser.add_argument('--changed-rate', type=float, default=0.1, help='Fraction of apps changed before the recrawl')
+    parser.add_argument('--padding-kb', type=int, default=300, help='Markup around the shoebox of generated pages')
+    parser.add_argument('--storages', type=str, nargs='+', default=list(STORAGES), choices=list(STORAGES))
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = [r for name in args.storages for r in bench_storage(name, args)]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        hit_rate = f"{r['hit_rate']:.0%}" if r['hit_rate'] is not None else '-'
+        print(f"{r['storage']:>10} {r['crawl']:>7}: {r['items']} items ({r['items_per_sec']:.1f}/s) | "
+              f"downloaded {r['downloaded_mb']:.1f} MB | {r['not_modified']} 304s | hit rate {hit_rate} | "
+              f"saved {r['saved_mb']:.1f} MB | {r['fields_reused']} not parsed | parse {r['parse_ms_per_page']:.2f} ms/page | cache {r['cache_mb']:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
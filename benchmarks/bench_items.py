@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Per-item memory and parse cost of the core and the full field sets.
+
+Memory: parses ``--items`` items from the ``--pages`` synthetic app pages
+and measures the memory (tracemalloc) they hold once built, field values
+included. It compares the slotted ``App`` with a ``scrapy.Item`` holding
+the same fields, as items were before, and also reports the size of the
+item objects alone.
+
+Parse cost: parses ``--pages`` synthetic app pages with the default
+``APP_FIELDS`` and with all fields, and reports microseconds per page.
+
+With ``--apps``, also crawls the local stand-in with both field sets and
+reports items/sec, output bytes per item and peak RSS:
+
+    python -m benchmarks.bench_items --items 100000 --pages 2000 --apps 3000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from itertools import cycle, islice
+
+import scrapy
+
+from appstore_scraper.items import ALL_FIELDS, App, CORE_FIELDS
+from appstore_scraper.parsing import parse_app_page
+from benchmarks.fixtures import make_app_page
+from benchmarks.runner import run_crawl
+from benchmarks.standin import FIRST_APP_ID, Catalog, index_url, serve
+
+
+FIELD_SETS = {'core': CORE_FIELDS, 'all': ALL_FIELDS}
+
+
+class DictApp(scrapy.Item):
+    """The same fields in a dict-backed ``scrapy.Item``."""
+    locals().update({field: scrapy.Field() for field in ALL_FIELDS + ('storefronts',)})
+
+
+def item_memory(item_class, pages, fields, count):
+    """Return the bytes held per item by ``count`` items of ``item_class`` parsed from ``pages``, values included."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [item_class(parse_app_page(body, url, fields)) for url, body in islice(cycle(pages), count)]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del items
+    return size / count
+
+
+def container_memory(item_class, record, count):
+    """Return the bytes per item of ``count`` items of ``item_class`` sharing the values of ``record``."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [item_class(record) for _ in range(count)]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del items
+    return size / count
+
+
+def parse_cost(pages, fields, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for url, body in pages:
+            parse_app_page(body, url, fields)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(pages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-item memory and parse cost of the field sets')
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--padding-kb', type=int, default=50, help='Markup around the shoebox per page')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--apps', type=int, default=0, help='Also crawl this many apps from the stand-in')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    pages = [
+        (f'https://apps.apple.com/us/app/app/id{app_id}', make_app_page(app_id, padding_kb=args.padding_kb))
+        for app_id in range(FIRST_APP_ID, FIRST_APP_ID + args.pages)
+    ]
+    results = []
+    for label, fields in FIELD_SETS.items():
+        record = parse_app_page(pages[0][1], pages[0][0], fields)
+        result = {
+            'fields': label,
+            'field_count': len(fields),
+            'scrapy_item_bytes': item_memory(DictApp, pages, fields, args.items),
+            'app_bytes': item_memory(App, pages, fields, args.items),
+            'scrapy_item_container_bytes': container_memory(DictApp, record, args.items),
+            'app_container_bytes': container_memory(App, record, args.items),
+            'parse_us': parse_cost(pages, fields, args.repeat),
+        }
+        results.append(result)
+
+    if args.apps:
+        server = serve(Catalog(args.apps, 4))
+        with tempfile.TemporaryDirectory() as tmp:
+            for result in results:
+                output = os.path.join(tmp, f"{result['fields']}.jsonl")
+                settings = {'APPSTORE_SITEMAP_URLS': index_url(server), 'APP_FIELDS': list(FIELD_SETS[result['fields']])}
+                stats = run_crawl('apps', settings, {'output_file': output, 'output_format': 'jsonlines'})
+                items = stats.get('item_scraped_count', 0)
+                result['crawl_items_per_sec'] = items / stats['benchmark/elapsed']
+                result['output_bytes_per_item'] = os.path.getsize(output) / max(items, 1)
+                result['peak_rss_mb'] = stats['benchmark/peak_rss_kb'] / 1024
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        line = (f"{r['fields']:>4} fields ({r['field_count']:2d}): scrapy.Item {r['scrapy_item_bytes']:6.0f} B/item "
+                f"({r['scrapy_item_container_bytes']:.0f} without values), slotted App {r['app_bytes']:6.0f} B/item "
+                f"({r['app_container_bytes']:.0f} without values) | parse {r['parse_us']:6.1f} us/page")
+        if 'crawl_items_per_sec' in r:
+            line += (f" | crawl {r['crawl_items_per_sec']:.0f} items/s, {r['output_bytes_per_item']:.0f} B/item output, "
+                     f"peak RSS {r['peak_rss_mb']:.0f} MB")
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
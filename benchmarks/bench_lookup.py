@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Single-app lookups with ``AppClient`` vs. one plain request per lookup, against the local stand-in.
+
+Issues ``--lookups`` lookups of ``--ids`` distinct apps, drawn from a Zipf
+distribution (a few popular apps, a long tail), ``--concurrency`` at a
+time. The naive client opens a new connection and downloads the page for
+every lookup. ``AppClient`` reuses pooled keep-alive connections, coalesces
+concurrent lookups of the same app into one download and caches parsed apps.
+Reports lookups/sec, p50/p99 latency, downloads and cache hit rate:
+
+    python -m benchmarks.bench_lookup --lookups 5000 --ids 500 --concurrency 32 --latency 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from appstore_scraper.client import AppClient
+from appstore_scraper.items import App
+from appstore_scraper.parsing import BASE_URL, parse_app_page
+from benchmarks.standin import FIRST_APP_ID, Catalog, serve
+
+
+def zipf_ids(count, ids, seed=1):
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, ids + 1)]
+    return rng.choices(range(FIRST_APP_ID, FIRST_APP_ID + ids), weights, k=count)
+
+
+def quantile(latencies, q):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_lookups(lookup, app_ids, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(app_id):
+        async with semaphore:
+            started = time.perf_counter()
+            await lookup(app_id)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(app_id) for app_id in app_ids))
+    return latencies, time.perf_counter() - started
+
+
+async def naive(base_url, app_ids, concurrency):
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    loop = asyncio.get_running_loop()
+
+    def fetch(app_id):
+        response = requests.get(f'{base_url}/us/app/id{app_id}', timeout=10)
+        return App(parse_app_page(response.content, response.url.replace(base_url, BASE_URL, 1)))
+
+    async def lookup(app_id):
+        return await loop.run_in_executor(executor, fetch, app_id)
+
+    latencies, elapsed = await run_lookups(lookup, app_ids, concurrency)
+    executor.shutdown()
+    return {'client': 'naive', 'downloads': len(app_ids), 'cache_hit_rate': 0.0, 'coalesced': 0}, latencies, elapsed
+
+
+async def pooled(base_url, app_ids, concurrency, cache_size, cache_ttl):
+    async with AppClient(base_url=base_url, max_connections=concurrency, cache_size=cache_size,
+                         cache_ttl=cache_ttl) as client:
+        latencies, elapsed = await run_lookups(client.get_app, app_ids, concurrency)
+        stats = client.stats()
+    return {
+        'client': 'AppClient' if cache_size else 'AppClient, no cache',
+        'downloads': stats['fetches'],
+        'cache_hit_rate': stats['cache_hit_rate'],
+        'coalesced': stats['coalesced'],
+    }, latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark single-app lookups')
+    parser.add_argument('--lookups', type=int, default=3000)
+    parser.add_argument('--ids', type=int, default=500, help='Distinct apps looked up')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds the stand-in takes per app page')
+    parser.add_argument('--cache-size', type=int, default=10000)
+    parser.add_argument('--cache-ttl', type=float, default=3600)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    server = serve(Catalog(args.ids, 4, latency=args.latency))
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    app_ids = zipf_ids(args.lookups, args.ids)
+    runs = [
+        naive(base_url, app_ids, args.concurrency),
+        pooled(base_url, app_ids, args.concurrency, 0, args.cache_ttl),
+        pooled(base_url, app_ids, args.concurrency, args.cache_size, args.cache_ttl),
+    ]
+    results = []
+    for run in runs:
+        result, latencies, elapsed = asyncio.run(run)
+        results.append({
+            **result,
+            'lookups_per_sec': len(app_ids) / elapsed,
+            'p50_ms': quantile(latencies, 0.5) * 1000,
+            'p99_ms': quantile(latencies, 0.99) * 1000,
+        })
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print(f"{r['client']:>20}: {r['lookups_per_sec']:7.0f} lookups/s | p50 {r['p50_ms']:6.1f} ms, "
+              f"p99 {r['p99_ms']:6.1f} ms | {r['downloads']} downloads, {r['coalesced']} coalesced, "
+              f"cache hit rate {r['cache_hit_rate']:.1%}")
+
+
+if __name__ == '__main__':
+    main()
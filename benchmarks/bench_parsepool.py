@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Inline parsing vs. the worker process pool, against the local stand-in.
+
+Crawls the same catalog with ``PARSE_WORKERS`` set to each of ``--workers``
+(0 parses inline on the reactor thread) and reports items/sec, event loop
+lag (max and p99) and how long callbacks waited for a free slot in the pool.
+Parallel parsing only pays off with more than one core and pages that are
+expensive to parse, so use large or recorded pages on a multi-core machine:
+
+    python -m benchmarks.bench_parsepool --apps 5000 --padding-kb 1000 --workers 0 2 4
+    python -m benchmarks.bench_parsepool --apps 5000 --pages-dir saved_pages/
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from benchmarks.runner import run_crawl
+from benchmarks.standin import Catalog, index_url, load_pages, serve
+
+
+def run(server, workers, extra):
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = {'APPSTORE_SITEMAP_URLS': index_url(server), 'PARSE_WORKERS': workers, **extra}
+        output = os.path.join(tmp, 'apps.jsonl')
+        stats = run_crawl('apps', settings, {'output_file': output, 'output_format': 'jsonlines'})
+    items = stats.get('item_scraped_count', 0)
+    jobs = stats.get('parse_pool/jobs', 0)
+    return {
+        'workers': workers,
+        'items': items,
+        'items_per_sec': items / stats['benchmark/elapsed'],
+        'loop_lag_max_ms': stats.get('reactor/loop_lag_max', 0) * 1000,
+        'loop_lag_p99_ms': (stats.get('reactor/loop_lag_p99') or 0) * 1000,
+        'parse_ms_per_page': (
+            stats.get('parse_pool/parse_time', 0) / jobs if jobs
+            else stats.get('callback/parse/time', 0) / max(1, stats.get('callback/parse/count', 0))
+        ) * 1000,
+        'pool_wait_ms_per_page': stats.get('parse_pool/wait_time', 0) / jobs * 1000 if jobs else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark inline parsing against the worker process pool')
+    parser.add_argument('--apps', type=int, default=3000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4], help='PARSE_WORKERS values (0: inline)')
+    parser.add_argument('--padding-kb', type=int, default=300, help='Markup around the shoebox of generated pages')
+    parser.add_argument('--pages-dir', type=str, help='Serve recorded app pages (*.html) instead of generated ones')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE', help='Extra crawl setting')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages_dir) if args.pages_dir else None
+    server = serve(Catalog(args.apps, 4, padding_kb=args.padding_kb, pages=pages))
+    extra = dict(pair.partition('=')[::2] for pair in args.set)
+    results = [run(server, workers, extra) for workers in args.workers]
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps({'cpus': os.cpu_count(), 'runs': results}, indent=2))
+        return
+    print(f"{os.cpu_count()} CPUs")
+    for r in results:
+        mode = 'inline' if not r['workers'] else f"{r['workers']} workers"
+        print(f"{mode:>10}: {r['items']} items ({r['items_per_sec']:.1f}/s) | loop lag max {r['loop_lag_max_ms']:.1f} ms, "
+              f"p99 {r['loop_lag_p99_ms']:.0f} ms | parse {r['parse_ms_per_page']:.2f} ms/page | "
+              f"pool wait {r['pool_wait_ms_per_page']:.1f} ms/page")
+
+
+if __name__ == '__main__':
+    main()
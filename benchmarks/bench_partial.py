@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Full downloads vs. partial-body downloads of app pages, against the local stand-in.
+
+Serves gzipped pages of realistic size and compressibility at a limited
+bandwidth per response, with the shoebox script at each of ``--shoebox-at``
+(fraction of the page before it), and crawls them with
+``PARTIAL_BODY_ENABLED`` off and on. Reports bytes per item (sent by the
+stand-in and received by the crawler), time to item (from a request
+reaching the downloader to its item being scraped) and items/sec:
+
+    python -m benchmarks.bench_partial --apps 1000 --shoebox-at 0.2 0.5 0.8
+    python -m benchmarks.bench_partial --apps 1000 --bandwidth 0   # unlimited, loopback speed
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from benchmarks.runner import run_crawl
+from benchmarks.standin import Catalog, index_url, serve
+
+
+def run(server, partial):
+    server.catalog.served_bytes = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = {'APPSTORE_SITEMAP_URLS': index_url(server), 'PARTIAL_BODY_ENABLED': partial}
+        output = os.path.join(tmp, 'apps.jsonl')
+        stats = run_crawl('apps', settings, {'output_file': output, 'output_format': 'jsonlines'})
+    items = stats.get('item_scraped_count', 0)
+    return {
+        'partial': partial,
+        'items': items,
+        'items_per_sec': items / stats['benchmark/elapsed'],
+        'sent_kb_per_item': server.catalog.served_bytes / max(1, items) / 1024,
+        'received_kb_per_item': stats.get('downloader/response_bytes', 0) / max(1, items) / 1024,
+        'stopped': stats.get('partial_body/stopped', 0),
+        'time_to_item_ms': stats.get('items/time_to_item', 0) / max(1, items) * 1000,
+        'time_to_item_p99_ms': (stats.get('items/time_to_item_p99') or 0) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark full against partial-body downloads of app pages')
+    parser.add_argument('--apps', type=int, default=1000)
+    parser.add_argument('--padding-kb', type=int, default=400, help='Markup around the shoebox of generated pages')
+    parser.add_argument('--shoebox-at', type=float, nargs='+', default=[0.2, 0.5, 0.8],
+                        help='Fractions of the page before the shoebox script')
+    parser.add_argument('--bandwidth', type=int, default=256 * 1024, help='Bytes/sec per response (0: unlimited)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for shoebox_at in args.shoebox_at:
+        catalog = Catalog(args.apps, 4, padding_kb=args.padding_kb, shoebox_at=shoebox_at, varied=True,
+                          compress=True, bandwidth=args.bandwidth)
+        server = serve(catalog)
+        for partial in (False, True):
+            results.append({'shoebox_at': shoebox_at, **run(server, partial)})
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        mode = 'partial' if r['partial'] else 'full'
+        print(f"shoebox at {r['shoebox_at']:.0%} {mode:>7}: {r['items']} items ({r['items_per_sec']:.1f}/s) | "
+              f"sent {r['sent_kb_per_item']:.1f} KB/item, received {r['received_kb_per_item']:.1f} KB/item | "
+              f"time to item {r['time_to_item_ms']:.0f} ms (p99 <= {r['time_to_item_p99_ms']:.0f} ms) | "
+              f"{r['stopped']} stopped early")
+
+
+if __name__ == '__main__':
+    main()
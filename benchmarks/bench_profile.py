@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Overhead of profiling a crawl, and what the profile shows.
+
+Crawls ``--apps`` apps from the local stand-in without profiling, with
+``PROFILE_ENABLED`` (hot-path timings only) and with ``tracemalloc``
+snapshots every ``--memory-interval`` seconds on top. Reports items/sec
+and CPU time of each, and the sections that took the most time in the
+profiled run:
+
+    python -m benchmarks.bench_profile --apps 3000 --memory-interval 10
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from appstore_scraper.profiling import format_report
+from benchmarks.runner import run_crawl
+from benchmarks.standin import Catalog, index_url, serve
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the overhead of profiling a crawl')
+    parser.add_argument('--apps', type=int, default=3000)
+    parser.add_argument('--memory-interval', type=float, default=10, help='Seconds between tracemalloc snapshots')
+    parser.add_argument('--top', type=int, default=12, help='Number of profile sections to show')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    server = serve(Catalog(args.apps, 8))
+    modes = {
+        'off': {},
+        'timings': {'PROFILE_ENABLED': True},
+        'timings+memory': {'PROFILE_ENABLED': True, 'PROFILE_TRACEMALLOC_INTERVAL': args.memory_interval},
+    }
+    results, reports = {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, settings in modes.items():
+            report_path = os.path.join(tmp, f'{name}.json')
+            output = os.path.join(tmp, f'{name}.jsonl')
+            stats = run_crawl('apps', {
+                'APPSTORE_SITEMAP_URLS': index_url(server),
+                'PROFILE_REPORT': report_path,
+                **settings,
+            }, {'output_file': output, 'output_format': 'jsonlines'})
+            items = stats.get('item_scraped_count', 0)
+            results[name] = {'items': items, 'elapsed': stats['benchmark/elapsed'],
+                             'items_per_sec': items / stats['benchmark/elapsed']}
+            if os.path.exists(report_path):
+                with open(report_path) as f:
+                    reports[name] = json.load(f)
+                results[name]['cpu'] = reports[name]['cpu']
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps({'runs': results, 'report': reports.get('timings')}, indent=2, default=str))
+        return
+    baseline = results['off']['items_per_sec']
+    for name, r in results.items():
+        cpu = f", {r['cpu']:.1f}s CPU" if 'cpu' in r else ''
+        print(f"{name:>15}: {r['items']} items in {r['elapsed']:6.2f}s, {r['items_per_sec']:7.1f} items/sec "
+              f"({r['items_per_sec'] / baseline - 1:+.1%}){cpu}")
+    if 'timings' in reports:
+        print()
+        print(format_report(reports['timings'], limit=args.top))
+
+
+if __name__ == '__main__':
+    main()
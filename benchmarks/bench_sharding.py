@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Scaling of run_spider.py --workers against the local stand-in server.
+
+Runs the same crawl with an increasing number of worker processes and
+reports throughput relative to a single worker.
+
+    python -m benchmarks.bench_sharding --apps 5000 --workers 1 2 4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.standin import Catalog, index_url, serve
+
+
+def run_workers(workers, index, tmp):
+    output = os.path.join(tmp, f'apps-{workers}.jsonl')
+    cmd = [
+        sys.executable, 'run_spider.py', '--workers', str(workers),
+        '--output', output, '--format', 'jsonlines',
+        '-s', f'APPSTORE_SITEMAP_URLS={index}',
+        '-s', f"JOBDIR={os.path.join(tmp, f'job-{workers}')}",
+        '-s', 'EXTENSIONS_ENABLED=False',
+        '-s', 'FAILURES_LEDGER=',
+    ]
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    with open(output) as f:
+        items = sum(1 for _ in f)
+    return {'workers': workers, 'items': items, 'elapsed': elapsed, 'items_per_sec': items / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure throughput scaling with worker processes')
+    parser.add_argument('--apps', type=int, default=5000)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    server = serve(Catalog(args.apps, args.shards))
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [run_workers(n, index_url(server), tmp) for n in args.workers]
+    server.shutdown()
+
+    base = results[0]['items_per_sec'] / results[0]['workers']
+    for r in results:
+        r['scaling_efficiency'] = r['items_per_sec'] / (base * r['workers'])
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print(f"{r['workers']:>3} workers: {r['items']} items in {r['elapsed']:.2f}s "
+              f"({r['items_per_sec']:.1f} items/sec, {r['scaling_efficiency']:.0%} of linear)")
+
+
+if __name__ == '__main__':
+    main()
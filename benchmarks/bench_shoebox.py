@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the shoebox extraction paths used by AppsSpider.parse.
+
+Compares the byte-scanning fast path against the XPath path over a set of
+saved app pages (any ``*.html`` files in --pages) or synthetic pages when no
+directory is given.
+
+    python -m benchmarks.bench_shoebox --pages saved_pages/ --repeat 5
+"""
+
+import argparse
+import glob
+import json
+import os
+import statistics
+import time
+
+from scrapy.http import HtmlResponse
+
+from appstore_scraper.shoebox import SHOEBOX_XPATH, decode_shoebox, extract_app_data
+from benchmarks.fixtures import make_app_page
+
+
+def load_pages(pages_dir, count):
+    if pages_dir:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(pages_dir, '*.html'))):
+            with open(path, 'rb') as f:
+                pages.append(f.read())
+        return pages
+    return [make_app_page(app_id) for app_id in range(1, count + 1)]
+
+
+def xpath_path(body):
+    response = HtmlResponse('https://apps.apple.com/us/app/bench', body=body, encoding='utf-8')
+    return decode_shoebox(response.xpath(SHOEBOX_XPATH).get())
+
+
+def fast_path(body):
+    return extract_app_data(body)
+
+
+def run(name, func, pages, repeat):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for body in pages:
+            t0 = time.perf_counter()
+            func(body)
+            latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'path': name,
+        'pages': len(latencies),
+        'pages_per_sec': len(latencies) / elapsed,
+        'latency_ms_mean': statistics.mean(latencies) * 1000,
+        'latency_ms_p50': latencies[len(latencies) // 2] * 1000,
+        'latency_ms_p99': latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark shoebox extraction paths')
+    parser.add_argument('--pages', type=str, help='Directory of saved app pages (*.html)')
+    parser.add_argument('--count', type=int, default=50, help='Number of synthetic pages (default: 50)')
+    parser.add_argument('--repeat', type=int, default=3, help='Passes over the page set (default: 3)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages, args.count)
+    if not pages:
+        parser.error(f"No pages found in {args.pages}")
+    for body in pages:
+        assert fast_path(body) == xpath_path(body), 'fast path and XPath path disagree'
+
+    results = [run('xpath', xpath_path, pages, args.repeat), run('fast', fast_path, pages, args.repeat)]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print(f"{r['path']:>6}: {r['pages_per_sec']:9.1f} pages/sec | "
+              f"mean {r['latency_ms_mean']:.3f} ms | p50 {r['latency_ms_p50']:.3f} ms | "
+              f"p99 {r['latency_ms_p99']:.3f} ms")
+    print(f"speedup: {results[1]['pages_per_sec'] / results[0]['pages_per_sec']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Sitemap coverage and discovery time with a cold vs. warm shard cache.
+
+Serves a ``--apps`` catalog from the local stand-in, its ``--shards``
+shards listed across ``--indexes`` index files, and crawls it with the
+``apps`` spider:
+
+- ``first index``: only ``sitemaps_apps_index_app_1.xml``, as before index
+  files were probed
+- ``cold``: every index file, with an empty ``SITEMAP_CACHE``
+- ``warm``: the same again, replaying the unchanged shards from the cache
+
+The crawls only request one in ``--sample`` apps (``SHARD_COUNT``), so the
+time is spent discovering the catalog rather than fetching it. Reports the
+index files and shards found, the apps the sitemaps listed, and
+``sitemap/discovery_time``:
+
+    python -m benchmarks.bench_sitemaps --apps 200000 --shards 40 --indexes 4 --bandwidth 2000000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from benchmarks.runner import run_crawl
+from benchmarks.standin import Catalog, index_url, serve
+
+
+def crawl(server, output, cache, probe=True, sample=1000):
+    spider_args = {'output_file': output, 'output_format': 'jsonlines'}
+    if not probe:
+        # No pattern: no index file after the first is probed
+        spider_args['sitemap_index_pattern'] = ''
+    settings = {
+        'APPSTORE_SITEMAP_URLS': index_url(server),
+        'SITEMAP_CACHE': cache,
+        'SHARD_COUNT': sample,
+        'SHARD_INDEX': 0,
+    }
+    stats = run_crawl('apps', settings, spider_args)
+    requests = stats.get('downloader/request_count', 0)
+    return {
+        'indexes': stats.get('sitemap/indexes', 0),
+        'shards_downloaded': stats.get('sitemap/shards_downloaded', 0),
+        'shards_cached': stats.get('sitemap/shards_cached', 0),
+        'discovery_time': stats.get('sitemap/discovery_time'),
+        'app_requests': requests - stats.get('sitemap/indexes', 0) - stats.get('sitemap/shards_downloaded', 0),
+        'elapsed': stats['benchmark/elapsed'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sitemap discovery with and without the shard cache')
+    parser.add_argument('--apps', type=int, default=200000)
+    parser.add_argument('--shards', type=int, default=40)
+    parser.add_argument('--indexes', type=int, default=4)
+    parser.add_argument('--bandwidth', type=int, default=2000000, help='Bytes per second each response is sent at')
+    parser.add_argument('--sample', type=int, default=1000, help='Request one in this many apps')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    catalog = Catalog(args.apps, args.shards, bandwidth=args.bandwidth, indexes=args.indexes)
+    server = serve(catalog)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = os.path.join(tmp, 'sitemap_cache.db')
+        output = os.path.join(tmp, 'apps.jsonl')
+        results['first index'] = crawl(server, output, '', probe=False, sample=args.sample)
+        results['cold'] = crawl(server, output, cache, sample=args.sample)
+        results['warm'] = crawl(server, output, cache, sample=args.sample)
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, r in results.items():
+        shards = r['shards_downloaded'] + r['shards_cached']
+        print(f"{name:>11}: {r['indexes']}/{args.indexes} indexes, {shards}/{args.shards} shards "
+              f"({r['shards_cached']} cached), ~{shards * args.apps // args.shards} apps listed, "
+              f"{r['app_requests']} requested, discovery {r['discovery_time']:6.2f}s, total {r['elapsed']:6.2f}s")
+
+
+if __name__ == '__main__':
+    main()
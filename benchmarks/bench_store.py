@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Benchmark of the SQLite app store behind AppstoreScraperPipeline.
+
+Measures upsert throughput for several batch sizes (first insert, unchanged
+re-upsert and changed re-upsert) and the ``changed_since`` query, then, with
+``--apps``, compares the crawl rate against the local stand-in with and
+without the pipeline enabled.
+
+    python -m benchmarks.bench_store --items 100000 --apps 2000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from itemadapter import ItemAdapter
+
+from benchmarks.bench_exporters import make_items
+from benchmarks.runner import run_crawl
+from benchmarks.standin import Catalog, index_url, serve
+
+from appstore_scraper.store import AppStore
+
+
+def bench_upserts(items, batch_size, tmp):
+    path = os.path.join(tmp, f'apps-{batch_size}.db')
+    store = AppStore(path, batch_size)
+    result = {'batch_size': batch_size}
+    for phase in ('insert', 'unchanged', 'changed'):
+        if phase == 'changed':
+            for item in items:
+                adapter = ItemAdapter(item)
+                adapter['price'] = (adapter['price'] or 0) + 1
+        seen_at = time.time()
+        start = time.perf_counter()
+        for item in items:
+            store.upsert(item, seen_at)
+        store.flush()
+        result[f'{phase}_per_sec'] = len(items) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    changed = sum(1 for _ in store.changed_since(seen_at - 1))
+    result['changed_since_ms'] = (time.perf_counter() - start) * 1000
+    assert changed == len(items), changed
+    store.close()
+    return result
+
+
+def bench_crawl(apps):
+    server = serve(Catalog(apps, 4))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for enabled in (False, True):
+            settings = {
+                'APPSTORE_SITEMAP_URLS': index_url(server),
+                'APPSTORE_DB_PATH': os.path.join(tmp, 'apps.db') if enabled else '',
+            }
+            output = os.path.join(tmp, f'apps-{enabled}.jsonl')
+            stats = run_crawl('apps', settings, {'output_file': output, 'output_format': 'jsonlines'})
+            items = stats.get('item_scraped_count', 0)
+            results.append({
+                'pipeline': enabled,
+                'items': items,
+                'upserts': stats.get('appstore_db/upserts', 0),
+                'items_per_sec': items / stats['benchmark/elapsed'],
+            })
+    server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SQLite app store')
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 1000, 10000])
+    parser.add_argument('--apps', type=int, default=0, help='Also compare crawls of this many apps with and without the pipeline')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    items = make_items(args.items)
+    with tempfile.TemporaryDirectory() as tmp:
+        upserts = [bench_upserts(items, batch_size, tmp) for batch_size in args.batch_sizes]
+    crawls = bench_crawl(args.apps) if args.apps else []
+
+    if args.json:
+        print(json.dumps({'upserts': upserts, 'crawls': crawls}, indent=2))
+        return
+    for r in upserts:
+        print(f"batch {r['batch_size']:>6}: insert {r['insert_per_sec']:8.0f}/s | unchanged {r['unchanged_per_sec']:8.0f}/s | "
+              f"changed {r['changed_per_sec']:8.0f}/s | changed_since {r['changed_since_ms']:7.1f} ms")
+    for r in crawls:
+        print(f"crawl, pipeline {'on ' if r['pipeline'] else 'off'}: {r['items']} items "
+              f"({r['items_per_sec']:.1f} items/sec, {r['upserts']} upserts)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Benchmark of multi-storefront crawls against the local stand-in.
+
+Compares the ``apps_storefronts`` spider (app pages downloaded once, other
+storefronts looked up in batches) with the naive approach of crawling every
+storefront's app pages, estimated as one full ``apps`` crawl per storefront.
+Reports requests, bytes downloaded and wall time.
+
+    python -m benchmarks.bench_storefronts --apps 2000 --storefronts us gb de fr jp
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from benchmarks.runner import run_crawl
+from benchmarks.standin import Catalog, index_url, serve
+
+
+def crawl(server, spider, storefronts, tmp):
+    host, port = server.server_address[:2]
+    settings = {
+        'APPSTORE_SITEMAP_URLS': index_url(server),
+        'LOOKUP_URL': f'http://{host}:{port}/lookup',
+        'STOREFRONTS': storefronts,
+    }
+    server.catalog.served_bytes = 0
+    output = os.path.join(tmp, f'{spider}.jsonl')
+    stats = run_crawl(spider, settings, {'output_file': output, 'output_format': 'jsonlines'})
+    return {
+        'items': stats.get('item_scraped_count', 0),
+        'requests': stats.get('downloader/request_count', 0),
+        'downloaded_mb': server.catalog.served_bytes / 1024 / 1024,
+        'elapsed': stats['benchmark/elapsed'],
+        'per_storefront': {
+            country: stats.get(f'storefronts/{country}/requests', 0) for country in storefronts
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark multi-storefront crawls')
+    parser.add_argument('--apps', type=int, default=2000)
+    parser.add_argument('--storefronts', type=str, nargs='+', default=['us', 'gb', 'de', 'fr', 'jp'])
+    parser.add_argument('--padding-kb', type=int, default=300, help='Markup around the shoebox of generated pages')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    server = serve(Catalog(args.apps, 4, padding_kb=args.padding_kb, lookup_miss_rate=0.05))
+    with tempfile.TemporaryDirectory() as tmp:
+        single = crawl(server, 'apps', args.storefronts[:1], tmp)
+        storefronts = crawl(server, 'apps_storefronts', args.storefronts, tmp)
+    server.shutdown()
+
+    count = len(args.storefronts)
+    naive = {key: single[key] * count for key in ('requests', 'downloaded_mb', 'elapsed')}
+    if args.json:
+        print(json.dumps({'naive': naive, 'storefronts': storefronts}, indent=2))
+        return
+    print(f"naive ({count} x apps crawl): {naive['requests']} requests | {naive['downloaded_mb']:.1f} MB | {naive['elapsed']:.1f}s")
+    print(f"apps_storefronts: {storefronts['requests']} requests | {storefronts['downloaded_mb']:.1f} MB | "
+          f"{storefronts['elapsed']:.1f}s | {storefronts['items']} items")
+    print('requests per storefront: ' + ', '.join(f'{c} {n}' for c, n in storefronts['per_storefront'].items()))
+
+
+if __name__ == '__main__':
+    main()
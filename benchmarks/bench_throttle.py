@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Adaptive throttling against a rate-limited stand-in server.
+
+The stand-in answers app pages beyond ``--rate-limit`` per second with 429
+and ``Retry-After``. The same crawl runs with a fixed low concurrency, a
+fixed high concurrency and the adaptive throttle, reporting throughput
+relative to the limit, 429s received and apps lost after exhausting their
+retries, and where the adaptive controller settled.
+
+    python -m benchmarks.bench_throttle --apps 3000 --rate-limit 50 --latency 0.05
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from benchmarks.runner import run_crawl
+from benchmarks.standin import Catalog, index_url, serve
+
+SCENARIOS = {
+    'fixed-2': {'ADAPTIVE_THROTTLE_ENABLED': False, 'CONCURRENT_REQUESTS_PER_DOMAIN': 2},
+    'fixed-32': {'ADAPTIVE_THROTTLE_ENABLED': False, 'CONCURRENT_REQUESTS_PER_DOMAIN': 32},
+    'adaptive': {'ADAPTIVE_THROTTLE_ENABLED': True},
+}
+
+
+def run(name, args):
+    server = serve(Catalog(args.apps, 4, padding_kb=args.padding_kb, rate_limit=args.rate_limit, latency=args.latency))
+    host = server.server_address[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = {'APPSTORE_SITEMAP_URLS': index_url(server), **SCENARIOS[name]}
+        output = os.path.join(tmp, 'apps.jsonl')
+        stats = run_crawl('apps', settings, {'output_file': output, 'output_format': 'jsonlines'})
+    server.shutdown()
+    items = stats.get('item_scraped_count', 0)
+    elapsed = stats['benchmark/elapsed']
+    return {
+        'scenario': name,
+        'items': items,
+        'elapsed': elapsed,
+        'items_per_sec': items / elapsed,
+        'of_limit': items / elapsed / args.rate_limit,
+        'responses_429': stats.get('downloader/response_status_count/429', 0),
+        'lost': args.apps - items,
+        'backoffs': stats.get('throttle/backoffs', 0),
+        'final_rate': stats.get(f'throttle/{host}/rate'),
+        'final_concurrency': stats.get(f'throttle/{host}/concurrency'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark adaptive throttling against a rate-limited server')
+    parser.add_argument('--apps', type=int, default=2000)
+    parser.add_argument('--rate-limit', type=float, default=50, help='App pages per second the server allows')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds each app page takes to serve')
+    parser.add_argument('--padding-kb', type=int, default=50)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = [run(name, args) for name in args.scenarios]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        line = (f"{r['scenario']:>9}: {r['items']} items ({r['items_per_sec']:.1f}/s, {r['of_limit']:.0%} of the limit) | "
+                f"{r['responses_429']} 429s | {r['lost']} lost")
+        if r['final_rate'] is not None:
+            line += f" | settled at {r['final_rate']} req/s, concurrency {r['final_concurrency']}, {r['backoffs']} backoffs"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
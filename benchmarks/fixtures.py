@@ -0,0 +1,138 @@
+"""
+Synthetic App Store fixtures shared by the benchmark scripts.
+
+The generated pages mimic the structure of real app pages: a large amount of
+markup surrounding a single ``shoebox-media-api-cache-apps`` script that holds
+the catalog API response as a JSON string.
+"""
+
+import functools
+import json
+import random
+
+PAGE_PADDING_KB = 300
+
+WORDS = (
+    'app games photo video music health fitness travel weather news sports finance business education '
+    'productivity utilities lifestyle social shopping food drink navigation reference medical kids books '
+    'developer privacy ratings reviews version history compatibility iphone ipad mac watch family sharing'
+).split()
+
+
+def make_app_record(app_id, country='us', seed=None, developers=50000):
+    """Return a catalog API record for a synthetic app, by one of ``developers`` developers."""
+    rng = random.Random(app_id if seed is None else seed)
+    developer_id = str(1000000000 + app_id % developers)
+    ratings = [rng.randint(0, 500) for _ in range(5)]
+    count = sum(ratings)
+    value = round(sum((i + 1) * n for i, n in enumerate(ratings)) / count, 1) if count else 0
+    return {
+        'id': str(app_id),
+        'type': 'apps',
+        'href': f'/v1/catalog/{country}/apps/{app_id}?l=en-US',
+        'attributes': {
+            'name': f'App {app_id}',
+            'userRating': {
+                'value': value,
+                'ratingCount': count,
+                'ratingCountList': ratings,
+                'ariaLabelForRatings': f'{value} stars',
+            },
+            'genreDisplayName': 'Utilities',
+            'contentRatingsBySystem': {'appsApple': {'name': '4+', 'value': 100, 'rank': 1}},
+            'platformAttributes': {
+                'ios': {
+                    'bundleId': f'com.example.app{app_id}',
+                    'subtitle': f'The app number {app_id}',
+                    'releaseDate': '2020-01-01',
+                    'minimumOSVersion': '15.0',
+                    'description': {'standard': 'Lorem ipsum dolor sit amet. ' * 40},
+                    'offers': [{'price': rng.choice([0, 0, 0, 0.99, 2.99]), 'currencyCode': 'USD'}],
+                    'versionHistory': [
+                        {
+                            'versionDisplay': f'1.{n}',
+                            'releaseDate': f'2020-0{n + 1}-01',
+                            'releaseNotes': f'Bug fixes and improvements in 1.{n}.',
+                        }
+                        for n in range(4, -1, -1)
+                    ],
+                    'customAttributes': {'default': {'default': {'customScreenshotsByType': {
+                        device: [
+                            {
+                                'url': f'https://is1-ssl.mzstatic.com/image/thumb/{app_id}/{device}-{n}.png/{{w}}x{{h}}{{c}}.{{f}}',
+                                'width': width,
+                                'height': height,
+                            }
+                            for n in range(5)
+                        ]
+                        for device, width, height in (('iphone_6_5', 1242, 2688), ('ipadPro_2018', 2048, 2732))
+                    }}}},
+                },
+            },
+        },
+        'relationships': {
+            'genres': {
+                'data': [
+                    {'id': '6002', 'type': 'genres', 'attributes': {'name': 'Utilities'}},
+                    {'id': '6007', 'type': 'genres', 'attributes': {'name': 'Productivity'}},
+                ],
+            },
+            'developer': {
+                'href': f'/v1/catalog/{country}/apps/{app_id}/developer?l=en-US',
+                'data': [{
+                    'id': developer_id,
+                    'type': 'developers',
+                    'href': f'/v1/catalog/{country}/developers/{developer_id}?l=en-US',
+                    'attributes': {
+                        'genreNames': [],
+                        'editorialArtwork': {},
+                        'name': f'Developer {developer_id}',
+                        'mediaType': 'Mobile Software Applications',
+                        'url': f'https://apps.apple.com/{country}/developer/dev/id{developer_id}',
+                    },
+                }],
+            },
+        },
+    }
+
+
+@functools.lru_cache(maxsize=8)
+def varied_markup(kb):
+    """Return about ``kb`` KB of varied markup, which compresses about as well as real pages."""
+    rng = random.Random(kb)
+    blocks = []
+    for n in range(kb):
+        text = ' '.join(rng.choice(WORDS) for _ in range(110))
+        blocks.append(
+            f'<div class="section section--{n}"><a href="/us/app/{rng.choice(WORDS)}/id{rng.randrange(10 ** 9)}">'
+            f'{text[:900]}</a><span data-id="{rng.getrandbits(64):x}"></span></div>\n'
+        )
+    return ''.join(blocks)
+
+
+def make_app_page(app_id, country='us', padding_kb=PAGE_PADDING_KB, shoebox_at=0.5, varied=False, seed=None,
+                  developers=50000):
+    """
+    Return the HTML body (bytes) of a synthetic app page.
+
+    ``shoebox_at`` is the fraction of the padding placed before the shoebox
+    script. The padding repeats one block unless ``varied`` is set. Another
+    ``seed`` gives the app another price and rating.
+    """
+    record = make_app_record(app_id, country, seed, developers)
+    cache = {f'as-{app_id}.{country}': json.dumps({'d': [record]})}
+    before_kb = round(padding_kb * shoebox_at)
+    if varied:
+        padding = varied_markup(padding_kb)
+        before, after = padding[:before_kb * 1024], padding[before_kb * 1024:]
+    else:
+        filler = '<div class="section"><p>' + 'x' * 1000 + '</p></div>\n'
+        before, after = filler * before_kb, filler * (padding_kb - before_kb)
+    page = (
+        '<!DOCTYPE html><html><head><title>{name}</title></head><body>\n'
+        '{before}'
+        '<script type="fastboot/shoebox" id="shoebox-media-api-cache-apps">{cache}</script>\n'
+        '{after}'
+        '</body></html>\n'
+    ).format(name=record['attributes']['name'], before=before, after=after, cache=json.dumps(cache))
+    return page.encode('utf-8')
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+End-to-end crawl benchmarks against the local stand-in server.
+
+For every catalog size, crawls the synthetic catalog (or recorded pages) once
+from scratch, then once more with a job directory, stopped halfway and
+resumed, and reports:
+
+* pages/sec and items/sec of the full crawl
+* parse time per page (time spent in the ``parse`` callback)
+* peak RSS of the crawl process
+* resume time: how long the resumed crawl takes to open (loading the job
+  directory) and to scrape its first item
+
+Results are written as JSON, together with the commit and versions they were
+measured with, so runs of different versions can be compared:
+
+    python -m benchmarks.run_benchmarks --apps 1000 10000 --output results.json
+    python -m benchmarks.run_benchmarks --apps 1000 10000 --compare results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import scrapy
+
+from benchmarks.runner import run_crawl
+from benchmarks.standin import Catalog, index_url, load_pages, serve
+
+# Metrics where a lower value is better, used when comparing against a baseline
+LOWER_IS_BETTER = {'elapsed_s', 'parse_ms_per_page', 'peak_rss_mb', 'resume_open_s', 'resume_first_item_s'}
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'scrapy': scrapy.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def crawl_settings(server, extra=None):
+    host, port = server.server_address[:2]
+    return {
+        'APPSTORE_SITEMAP_URLS': index_url(server),
+        'LOOKUP_URL': f'http://{host}:{port}/lookup',
+        **(extra or {}),
+    }
+
+
+def bench_crawl(spider, server, apps, tmp, settings):
+    output = os.path.join(tmp, f'{spider}-{apps}.jsonl')
+    stats = run_crawl(spider, crawl_settings(server, settings), {'output_file': output, 'output_format': 'jsonlines'})
+    elapsed = stats['benchmark/elapsed']
+    items = stats.get('item_scraped_count', 0)
+    parsed = stats.get('callback/parse/count', 0)
+    return {
+        'items': items,
+        'pages': stats.get('response_received_count', 0),
+        'elapsed_s': elapsed,
+        'pages_per_sec': stats.get('response_received_count', 0) / elapsed,
+        'items_per_sec': items / elapsed,
+        'parse_ms_per_page': stats.get('callback/parse/time', 0) / parsed * 1000 if parsed else None,
+        'peak_rss_mb': stats['benchmark/peak_rss_kb'] / 1024,
+    }
+
+
+def bench_resume(spider, server, apps, tmp, settings):
+    """Crawl half the catalog into a job directory, then time resuming it."""
+    output = os.path.join(tmp, f'{spider}-{apps}-resume.jsonl')
+    spider_args = {'output_file': output, 'output_format': 'jsonlines'}
+    settings = crawl_settings(server, {'JOBDIR': os.path.join(tmp, f'job-{spider}-{apps}'), **(settings or {})})
+    run_crawl(spider, {**settings, 'CLOSESPIDER_ITEMCOUNT': max(1, apps // 2)}, spider_args)
+    stats = run_crawl(spider, settings, spider_args)
+    with open(output) as f:
+        urls = {json.loads(line)['url'] for line in f}
+    return {
+        'resume_open_s': stats.get('benchmark/open_time'),
+        'resume_first_item_s': stats.get('benchmark/first_item_time'),
+        'resume_unique_items': len(urls),
+    }
+
+
+def compare(results, baseline):
+    """Print the relative change of every metric against a baseline results file."""
+    base_runs = {(r['spider'], r['apps']): r for r in baseline['runs']}
+    print(f"\nCompared with {baseline['environment'].get('commit')} ({baseline['environment'].get('timestamp')}):")
+    for run in results['runs']:
+        base = base_runs.get((run['spider'], run['apps']))
+        if base is None:
+            continue
+        changes = []
+        for key, value in run.items():
+            old = base.get(key)
+            if not isinstance(value, float) or not old:
+                continue
+            change = (value - old) / old
+            better = change < 0 if key in LOWER_IS_BETTER else change > 0
+            changes.append(f"{key} {change:+.1%}{'' if better or abs(change) < 0.05 else ' (!)'}")
+        print(f"  {run['spider']} / {run['apps']} apps: {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run end-to-end crawl benchmarks against the local stand-in')
+    parser.add_argument('--apps', type=int, nargs='+', default=[1000], help='Catalog sizes to benchmark')
+    parser.add_argument('--shards', type=int, default=10)
+    parser.add_argument('--spider', type=str, nargs='+', default=['apps'], help='Spiders to benchmark')
+    parser.add_argument('--padding-kb', type=int, default=300, help='Markup around the shoebox of generated pages')
+    parser.add_argument('--pages-dir', type=str, help='Serve recorded app pages (*.html) instead of generated ones')
+    parser.add_argument('--no-resume', action='store_true', help='Skip the resume benchmark')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE', help='Extra crawl setting')
+    parser.add_argument('--output', type=str, help='Write the results to this JSON file')
+    parser.add_argument('--compare', type=str, help='Compare against a previous results file')
+    args = parser.parse_args()
+
+    settings = dict(pair.partition('=')[::2] for pair in args.set)
+    pages = load_pages(args.pages_dir) if args.pages_dir else None
+    results = {'environment': environment(), 'runs': []}
+    for apps in args.apps:
+        server = serve(Catalog(apps, args.shards, args.padding_kb, pages=pages))
+        with tempfile.TemporaryDirectory() as tmp:
+            for spider in args.spider:
+                run = {'spider': spider, 'apps': apps}
+                run.update(bench_crawl(spider, server, apps, tmp, settings))
+                if not args.no_resume:
+                    run.update(bench_resume(spider, server, apps, tmp, settings))
+                results['runs'].append(run)
+                print(json.dumps(run), file=sys.stderr)
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
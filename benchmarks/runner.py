@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Run a single crawl in a fresh process and record its stats.
+
+Each crawl gets its own interpreter (Twisted reactors can't be restarted) and
+writes the final crawl stats, wall time, time until the spider was opened and
+the first item scraped, and peak RSS to a JSON file:
+
+    python -m benchmarks.runner apps --stats-file stats.json -s APPSTORE_SITEMAP_URLS=...
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+# Settings every benchmark crawl starts from; callers override as needed
+BENCHMARK_SETTINGS = {
+    'JOBDIR': None,
+    'APPSTORE_DB_PATH': '',
+    'FAILURES_LEDGER': '',
+    'SITEMAP_CACHE': '',
+    'EXTENSIONS_ENABLED': False,
+    'LOG_ENABLED': False,
+    'CONCURRENT_REQUESTS': 32,
+    'CONCURRENT_REQUESTS_PER_DOMAIN': 32,
+}
+
+
+def crawl_command(spider, stats_file, settings=None, spider_args=None):
+    """Return the command line running one crawl with this module."""
+    cmd = [sys.executable, '-m', 'benchmarks.runner', spider, '--stats-file', stats_file]
+    for key, value in {**BENCHMARK_SETTINGS, **(settings or {})}.items():
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        cmd += ['-s', f'{key}={value}']
+    for key, value in (spider_args or {}).items():
+        cmd += ['-a', f'{key}={value}']
+    return cmd
+
+
+def run_crawl(spider, settings=None, spider_args=None, timeout=None):
+    """Run a crawl in a subprocess and return its recorded stats."""
+    with tempfile.TemporaryDirectory() as tmp:
+        stats_file = os.path.join(tmp, 'stats.json')
+        subprocess.run(crawl_command(spider, stats_file, settings, spider_args), check=True, timeout=timeout)
+        with open(stats_file) as f:
+            return json.load(f)
+
+
+def _parse_pairs(pairs):
+    result = {}
+    for pair in pairs:
+        key, _, value = pair.partition('=')
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        result[key] = value
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run one crawl and dump its stats as JSON')
+    parser.add_argument('spider', type=str)
+    parser.add_argument('--stats-file', type=str, required=True)
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE')
+    parser.add_argument('-a', '--arg', action='append', default=[], metavar='NAME=VALUE')
+    args = parser.parse_args()
+
+    settings = get_project_settings()
+    for key, value in _parse_pairs(args.set).items():
+        settings.set(key, value, priority='cmdline')
+
+    # Opening the spider includes loading the job directory of a resumed crawl
+    timings = {}
+    started = time.perf_counter()
+
+    def record(name):
+        def handler(*args, **kwargs):
+            timings.setdefault(name, time.perf_counter() - started)
+        return handler
+
+    process = CrawlerProcess(settings, install_root_handler=False)
+    crawler = process.create_crawler(args.spider)
+    on_opened, on_item = record('benchmark/open_time'), record('benchmark/first_item_time')
+    crawler.signals.connect(on_opened, signal=signals.spider_opened)
+    crawler.signals.connect(on_item, signal=signals.item_scraped)
+    process.crawl(crawler, **_parse_pairs(args.arg))
+    start = time.perf_counter()
+    process.start()
+    elapsed = time.perf_counter() - start
+
+    stats = dict(crawler.stats.get_stats())
+    stats.update(timings)
+    stats['benchmark/elapsed'] = elapsed
+    stats['benchmark/peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(args.stats_file, 'w') as f:
+        json.dump(stats, f, default=str, indent=2)
+
+
+if __name__ == '__main__':
+    main()
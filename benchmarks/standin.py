@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the App Store, serving a synthetic catalog.
+
+Serves sitemap index files, gzipped sitemap shards, app pages containing the
+shoebox script (generated, or recorded pages from a directory of ``*.html``
+files) and canned responses for the iTunes lookup endpoint:
+
+    /sitemaps_apps_index_app_<k>.xml (k = 1..indexes, then 404)
+    /sitemaps/apps_<n>.xml.gz
+    /us/app/app-<id>/id<id>
+    /lookup?id=<id>,<id>,...&country=<cc>
+
+App pages carry ``ETag`` and ``Last-Modified`` headers and are answered with
+304 Not Modified to a matching ``If-None-Match``. Bumping ``revision`` changes
+the ETag, price and rating of a ``changed_rate`` fraction of the apps, and
+moving ``first_app`` replaces apps at the start of the catalog with new ones
+at the end. The shards are spread over ``indexes`` index files, which list
+each shard with a ``<lastmod>`` that only moves when its content does. With
+``compress`` set,
+app pages are gzipped for clients that accept it, and ``bandwidth`` limits
+how fast each response body is sent (bytes per second).
+
+Point the spiders at it through settings:
+
+    python -m benchmarks.standin --apps 10000 --port 8000
+    scrapy crawl apps -s APPSTORE_SITEMAP_URLS=http://127.0.0.1:8000/sitemaps_apps_index_app_1.xml
+"""
+
+import argparse
+import email.utils
+import glob
+import gzip
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.fixtures import PAGE_PADDING_KB, make_app_page, make_app_record
+
+FIRST_APP_ID = 1000000
+INDEX_PATH = '/sitemaps_apps_index_app_1.xml'
+INDEX_PATH_RE = re.compile(r'/sitemaps_apps_index_app_(\d+)\.xml$')
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+class Catalog:
+    """Description of the synthetic catalog served by the stand-in."""
+
+    def __init__(self, apps=1000, shards=10, padding_kb=PAGE_PADDING_KB, lookup_miss_rate=0.0, pages=None,
+                 rate_limit=0, latency=0.0, revision=0, changed_rate=1.0, shoebox_at=0.5, varied=False,
+                 compress=False, bandwidth=0, first_app=FIRST_APP_ID, broken_rate=0.0, developers=50000,
+                 indexes=1):
+        self.apps = apps
+        # Moving the first app id drops apps from the start of the catalog and adds as many at the end
+        self.first_app = first_app
+        self.shards = shards
+        self.indexes = indexes
+        self.padding_kb = padding_kb
+        self.lookup_miss_rate = lookup_miss_rate
+        # Recorded page bodies, served round-robin instead of generated pages
+        self.pages = pages
+        # App pages beyond rate_limit per second get a 429, and every app page
+        # takes at least `latency` seconds to serve
+        self.limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.latency = latency
+        self.revision = revision
+        self.changed_rate = changed_rate
+        # Layout of generated pages (see make_app_page)
+        self.shoebox_at = shoebox_at
+        self.varied = varied
+        self.compress = compress
+        self.bandwidth = bandwidth
+        # Fraction of app pages that fail, as in a bad hour: half answer 503, half have no shoebox script
+        self.broken_rate = broken_rate
+        # Apps are spread round-robin over this many developers
+        self.developers = developers
+        # Body bytes, app pages and 304s served, for measuring what clients downloaded
+        self.served_bytes = self.served_pages = self.not_modified = 0
+        self.lock = threading.Lock()
+
+    def app_ids(self, shard=None):
+        ids = range(self.first_app, self.first_app + self.apps)
+        if shard is None:
+            return ids
+        return ids[shard::self.shards]
+
+    def shard_lastmod(self, shard):
+        """Return the ``<lastmod>`` of a shard, which depends on the apps it lists."""
+        ids = self.app_ids(shard)
+        key = f'{ids.start}-{ids.stop}-{ids.step}-{self.lastmod(ids.start) if ids else ""}'
+        return datetime.fromtimestamp(1700000000 + zlib.crc32(key.encode()) % 10 ** 7, timezone.utc).isoformat()
+
+    def lastmod(self, app_id):
+        return f'2024-{app_id % 12 + 1:02d}-{app_id % 28 + 1:02d}'
+
+    def is_lookup_miss(self, app_id, country='us'):
+        # Other storefronts miss a different subset of the apps (not sold there)
+        key = str(app_id) if country == 'us' else f'{app_id}-{country}'
+        return zlib.crc32(key.encode()) % 10000 < self.lookup_miss_rate * 10000
+
+    def broken(self, app_id):
+        """Return how an app page fails (``'error'`` or ``'no_shoebox'``), or None if it doesn't."""
+        bucket = zlib.crc32(f'{app_id}-broken'.encode()) % 10000
+        if bucket >= self.broken_rate * 10000:
+            return None
+        return 'error' if bucket % 2 else 'no_shoebox'
+
+    def revision_of(self, app_id):
+        """Return the revision of an app: ``changed_rate`` of the apps are at the catalog's revision, the rest at 0."""
+        changed = zlib.crc32(f'{app_id}-changed'.encode()) % 10000 < self.changed_rate * 10000
+        return self.revision if changed else 0
+
+    def etag(self, app_id):
+        return f'"{app_id}-{self.revision_of(app_id)}"'
+
+    def last_modified(self, app_id):
+        return email.utils.format_datetime(datetime.fromisoformat(self.lastmod(app_id)).replace(tzinfo=timezone.utc), usegmt=True)
+
+    def page(self, app_id):
+        if self.pages:
+            return self.pages[app_id % len(self.pages)]
+        revision = self.revision_of(app_id)
+        return make_app_page(app_id, padding_kb=self.padding_kb, shoebox_at=self.shoebox_at, varied=self.varied,
+                             seed=app_id * 1000 + revision if revision else None, developers=self.developers)
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing ``rate`` requests per second, with one second of burst."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.allowed = self.limited = 0
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.allowed += 1
+                return True
+            self.limited += 1
+            return False
+
+
+def load_pages(pages_dir):
+    """Return the bodies of the recorded app pages (``*.html``) in a directory."""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(pages_dir, '*.html'))):
+        with open(path, 'rb') as f:
+            pages.append(f.read())
+    if not pages:
+        raise ValueError(f"No *.html pages found in {pages_dir}")
+    return pages
+
+
+class StandinServer(ThreadingHTTPServer):
+    # Room for the connections a crawl opens at once (the default backlog of 5
+    # drops SYNs, adding a second to connections opened in bursts)
+    request_queue_size = 128
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping their connections (aborted downloads, killed crawls) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def catalog(self):
+        return self.server.catalog
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        index = INDEX_PATH_RE.match(url.path)
+        if index and 1 <= int(index.group(1)) <= self.catalog.indexes:
+            self.send_body(self.sitemap_index(int(index.group(1))), 'application/xml')
+        elif url.path.startswith('/sitemaps/apps_'):
+            shard = int(url.path[len('/sitemaps/apps_'):].split('.')[0])
+            self.send_body(self.sitemap_shard(shard), 'application/x-gzip')
+        elif url.path == '/lookup':
+            query = parse_qs(url.query)
+            ids = query.get('id', [''])[0].split(',')
+            self.send_body(self.lookup(ids, query.get('country', ['us'])[0]), 'text/javascript; charset=utf-8')
+        elif '/app/' in url.path and '/id' in url.path:
+            app_id = int(url.path.rsplit('/id', 1)[1])
+            if self.catalog.latency:
+                time.sleep(self.catalog.latency)
+            if self.catalog.limiter and not self.catalog.limiter.allow():
+                self.send_body(b'Too Many Requests', 'text/plain', status=429, headers={'Retry-After': '1'})
+                return
+            broken = self.catalog.broken(app_id)
+            if broken == 'error':
+                self.send_body(b'Service Unavailable', 'text/plain', status=503)
+                return
+            if broken == 'no_shoebox':
+                self.send_body(b'<html><body>Temporarily unavailable</body></html>', 'text/html; charset=utf-8')
+                return
+            etag = self.catalog.etag(app_id)
+            validators = {'ETag': etag, 'Last-Modified': self.catalog.last_modified(app_id)}
+            if self.headers.get('If-None-Match') == etag:
+                with self.catalog.lock:
+                    self.catalog.not_modified += 1
+                self.send_body(b'', 'text/html; charset=utf-8', status=304, headers=validators)
+                return
+            body = self.catalog.page(app_id)
+            with self.catalog.lock:
+                self.catalog.served_pages += 1
+            if self.catalog.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                # Fastest level, to keep the stand-in from competing with the crawler for CPU
+                body = gzip.compress(body, compresslevel=1)
+                validators['Content-Encoding'] = 'gzip'
+            self.send_body(body, 'text/html; charset=utf-8', headers=validators)
+        else:
+            self.send_body(b'Not Found', 'text/plain', status=404)
+
+    def send_body(self, body, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        chunk_size = len(body) or 1
+        if self.catalog.bandwidth:
+            chunk_size = min(16 * 1024, max(1024, int(self.catalog.bandwidth / 20)))
+        try:
+            for start in range(0, len(body), chunk_size):
+                chunk = body[start:start + chunk_size]
+                self.wfile.write(chunk)
+                with self.catalog.lock:
+                    self.catalog.served_bytes += len(chunk)
+                if self.catalog.bandwidth:
+                    time.sleep(len(chunk) / self.catalog.bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. after a partial download
+            self.close_connection = True
+
+    def sitemap_index(self, index=1):
+        sitemaps = ''.join(
+            f'<sitemap><loc>{self.base_url}/sitemaps/apps_{n}.xml.gz</loc>'
+            f'<lastmod>{self.catalog.shard_lastmod(n)}</lastmod></sitemap>'
+            for n in range(index - 1, self.catalog.shards, self.catalog.indexes)
+        )
+        return f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="{SITEMAP_NS}">{sitemaps}</sitemapindex>'.encode()
+
+    def sitemap_shard(self, shard):
+        urls = ''.join(
+            f'<url><loc>{self.base_url}/us/app/app-{app_id}/id{app_id}</loc>'
+            f'<lastmod>{self.catalog.lastmod(app_id)}</lastmod></url>'
+            for app_id in self.catalog.app_ids(shard)
+        )
+        xml = f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="{SITEMAP_NS}">{urls}</urlset>'
+        return gzip.compress(xml.encode(), compresslevel=1)
+
+    def lookup(self, ids, country='us'):
+        results = []
+        for app_id in ids:
+            if not app_id.isdigit() or self.catalog.is_lookup_miss(int(app_id), country):
+                continue
+            record = make_app_record(int(app_id), developers=self.catalog.developers)
+            attributes = record['attributes']
+            developer = record['relationships']['developer']['data'][0]
+            results.append({
+                'wrapperType': 'software',
+                'kind': 'software',
+                'trackId': int(app_id),
+                'trackName': attributes['name'],
+                'averageUserRating': attributes['userRating']['value'],
+                'userRatingCount': attributes['userRating']['ratingCount'],
+                'artistId': int(developer['id']),
+                'artistName': developer['attributes']['name'],
+                'artistViewUrl': developer['attributes']['url'],
+                'price': attributes['platformAttributes']['ios']['offers'][0]['price'],
+                'currency': attributes['platformAttributes']['ios']['offers'][0]['currencyCode'],
+                'trackViewUrl': f'{self.base_url}/{country}/app/app-{app_id}/id{app_id}?uo=4',
+            })
+        return json.dumps({'resultCount': len(results), 'results': results}).encode()
+
+
+def serve(catalog, host='127.0.0.1', port=0, handler=StandinHandler):
+    """Start the stand-in in a background thread and return the server."""
+    server = StandinServer((host, port), handler)
+    server.catalog = catalog
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def index_url(server):
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}{INDEX_PATH}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic App Store catalog locally')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--apps', type=int, default=1000, help='Number of apps in the catalog (default: 1000)')
+    parser.add_argument('--shards', type=int, default=10, help='Number of sitemap shards (default: 10)')
+    parser.add_argument('--indexes', type=int, default=1, help='Number of sitemap index files the shards are listed in')
+    parser.add_argument('--padding-kb', type=int, default=PAGE_PADDING_KB, help='Markup around the shoebox per page')
+    parser.add_argument('--lookup-miss-rate', type=float, default=0.0, help='Fraction of ids the lookup omits')
+    parser.add_argument('--pages-dir', type=str, help='Serve the recorded app pages (*.html) in this directory')
+    parser.add_argument('--rate-limit', type=float, default=0, help='App pages per second before answering 429')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds each app page takes to serve')
+    parser.add_argument('--shoebox-at', type=float, default=0.5, help='Fraction of the page before the shoebox script')
+    parser.add_argument('--varied', action='store_true', help='Generate varied markup that compresses like real pages')
+    parser.add_argument('--gzip', action='store_true', help='Gzip app pages for clients that accept it')
+    parser.add_argument('--bandwidth', type=int, default=0, help='Bytes per second each response is sent at')
+    parser.add_argument('--broken-rate', type=float, default=0.0, help='Fraction of app pages that answer 503 or lack the shoebox')
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages_dir) if args.pages_dir else None
+    catalog = Catalog(
+        args.apps, args.shards, args.padding_kb, args.lookup_miss_rate, pages, args.rate_limit, args.latency,
+        shoebox_at=args.shoebox_at, varied=args.varied, compress=args.gzip, bandwidth=args.bandwidth,
+        broken_rate=args.broken_rate, indexes=args.indexes,
+    )
+    server = StandinServer((args.host, args.port), StandinHandler)
+    server.catalog = catalog
+    print(f"Serving {args.apps} apps at {index_url(server)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
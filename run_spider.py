@@ -1,38 +1,98 @@
 #!/usr/bin/env python
 import os
 import sys
+import json
 import time
 import signal
 import argparse
+import subprocess
 from scrapy.crawler import CrawlerProcess
 from scrapy.utils.project import get_project_settings
+from appstore_scraper.failures import FailureLedger, format_summary
+from appstore_scraper.profiling import format_report
+from appstore_scraper.sharding import merge_outputs, parse_shard, shard_path
 from appstore_scraper.spiders.apps import AppsSpider
+from appstore_scraper.spiders.storefronts import StorefrontsSpider
 
-# Global flag to track if the spider should be paused
-should_pause = False
+def worker_argv(argv):
+    """Return the command line arguments passed on to each worker process."""
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in ('--workers', '--shard'):
+            skip = True
+        elif not (arg.startswith('--workers=') or arg.startswith('--shard=') or arg == '--merge-only'):
+            result.append(arg)
+    return result
 
-def signal_handler(sig, frame):
-    """Handle Ctrl+C (SIGINT) to gracefully pause the spider."""
-    global should_pause
-    if not should_pause:
-        print("\nReceived interrupt signal. Pausing spider (this may take a moment)...")
-        print("Press Ctrl+C again to force quit.")
-        should_pause = True
-    else:
-        print("\nForce quitting...")
-        sys.exit(1)
+def run_workers(args):
+    """Crawl with one worker process per shard, then merge their outputs."""
+    outputs = [shard_path(args.cdc or args.output, i, args.workers) for i in range(args.workers)]
+    
+    if not args.merge_only:
+        # Workers receive Ctrl+C directly and pause themselves; just remember it here
+        paused = []
+        signal.signal(signal.SIGINT, lambda sig, frame: paused.append(sig))
+        
+        print(f"Starting {args.workers} workers. Output shards: {', '.join(outputs)}")
+        workers = [
+            subprocess.Popen([sys.executable, sys.argv[0], '--shard', f'{i}/{args.workers}'] + worker_argv(sys.argv[1:]))
+            for i in range(args.workers)
+        ]
+        failed = [i for i, worker in enumerate(workers) if worker.wait() != 0]
+        if paused:
+            print("\nWorkers paused. Run with --resume to continue.")
+            print(f"To resume, run: python {sys.argv[0]} {' '.join(sys.argv[1:])} --resume")
+            return
+        if failed:
+            print(f"Workers {failed} failed; not merging. Run with --resume to retry them.")
+            return
+    
+    if args.developers:
+        # Developers are shared between shards, so several shards may have exported the same ones
+        developer_outputs = [shard_path(args.developers, i, args.workers) for i in range(args.workers)]
+        written, duplicates = merge_outputs(developer_outputs, args.developers, 'jsonlines', keep_last=True, key='id')
+        print(f"Merged {written} developers into {args.developers} ({duplicates} duplicates dropped)")
+    
+    if args.cdc:
+        # Every app belongs to one shard, so the shards' events can be applied in any order
+        print(f"Change events written to {', '.join(outputs)}")
+        return
+    
+    written, duplicates = merge_outputs(outputs, args.output, args.format)
+    print(f"Merged {written} apps into {args.output} ({duplicates} duplicates dropped)")
 
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Run the Apple App Store scraper with pause/resume functionality')
     parser.add_argument('--resume', action='store_true', help='Resume a previously paused crawl')
     parser.add_argument('--output', type=str, default='apps.json', help='Output file path (default: apps.json)')
-    parser.add_argument('--format', type=str, default='json', help='Output format (default: json)')
+    parser.add_argument('--format', type=str, default='json', help='Output format: json, jsonlines, csv, xml or parquet (default: json)')
+    parser.add_argument('--fields', type=str, help='Comma-separated app fields to extract, or "all" (default: APP_FIELDS)')
     parser.add_argument('--verbose', action='store_true', help='Enable verbose logging')
+    parser.add_argument('--incremental', action='store_true', help='Only crawl apps that are new or changed since the last run')
+    parser.add_argument('--max-age', type=float, help='With --incremental, also refresh apps last scraped more than this many days ago')
+    parser.add_argument('--freshness', action='store_true', help='Crawl apps in order of how likely they changed since the last run')
+    parser.add_argument('--cdc', type=str, metavar='EVENTS', help='Instead of full records, append insert/update/delete events of changed apps to this file')
+    parser.add_argument('--developers', type=str, metavar='FILE', help='Write each developer once to this JSON lines file and reference it by developer_id in the apps')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', metavar='REPORT',
+                        help='Time callbacks, middlewares and pipelines and write a report to this file (default: profile.json)')
+    parser.add_argument('--profile-memory', type=float, metavar='SECONDS',
+                        help='With --profile, record the top memory allocators this often (slows the crawl down)')
+    parser.add_argument('--failures', type=str, metavar='LEDGER', help='Record the pages that fail in this SQLite ledger, for --retry-failed')
+    parser.add_argument('--retry-failed', action='store_true', help='Only re-crawl the pages recorded in the failure ledger (see --failures)')
+    parser.add_argument('--workers', type=int, help='Crawl with this many worker processes and merge their outputs')
+    parser.add_argument('--shard', type=str, help='Only crawl partition i of N (format: i/N), e.g. one node of a multi-node crawl')
+    parser.add_argument('--storefronts', type=str, help='Comma-separated country codes to crawl, e.g. us,gb,de; app pages come from the first')
+    parser.add_argument('--merge-only', action='store_true', help='With --workers, only merge existing shard outputs')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE', help='Override a Scrapy setting (may be repeated)')
     args = parser.parse_args()
     
-    # Register the signal handler for SIGINT (Ctrl+C)
-    signal.signal(signal.SIGINT, signal_handler)
+    if args.workers:
+        run_workers(args)
+        return
     
     # Get project settings
     settings = get_project_settings()
@@ -42,6 +102,66 @@ def main():
         settings.set('LOG_ENABLED', False)
         settings.set('LOG_LEVEL', 'ERROR')
     
+    if args.incremental:
+        settings.set('INCREMENTAL_ENABLED', True)
+        if args.max_age is not None:
+            settings.set('INCREMENTAL_MAX_AGE', args.max_age * 24 * 3600)
+    
+    if args.freshness:
+        settings.set('FRESHNESS_ENABLED', True)
+    
+    if args.failures:
+        settings.set('FAILURES_LEDGER', args.failures)
+    if args.retry_failed:
+        settings.set('FAILURES_RETRY', True)
+    
+    if args.fields:
+        settings.set('APP_FIELDS', args.fields.split(','))
+    
+    if args.developers:
+        settings.set('DEVELOPERS_FEED', args.developers)
+    
+    if args.profile:
+        settings.set('PROFILE_ENABLED', True)
+        settings.set('PROFILE_REPORT', args.profile)
+        if args.profile_memory:
+            settings.set('PROFILE_TRACEMALLOC_INTERVAL', args.profile_memory)
+    
+    # Change events replace the full output
+    if args.cdc:
+        settings.set('CDC_ENABLED', True)
+        settings.set('CDC_EVENTS_FILE', args.cdc)
+        args.output = ''
+    
+    spider_cls = AppsSpider
+    if args.storefronts:
+        spider_cls = StorefrontsSpider
+        settings.set('STOREFRONTS', args.storefronts.split(','))
+    
+    for override in args.set:
+        name, _, value = override.partition('=')
+        settings.set(name, value, priority='cmdline')
+    
+    if args.retry_failed and not settings.get('FAILURES_LEDGER'):
+        print("--retry-failed needs the failure ledger of the earlier run: add --failures LEDGER")
+        sys.exit(2)
+    
+    # Each shard gets its own job directory and output file
+    if args.shard:
+        shard_index, shard_count = parse_shard(args.shard)
+        settings.set('SHARD_INDEX', shard_index, priority='cmdline')
+        settings.set('SHARD_COUNT', shard_count, priority='cmdline')
+        if settings.get('JOBDIR'):
+            settings.set('JOBDIR', shard_path(settings.get('JOBDIR'), shard_index, shard_count), priority='cmdline')
+        if args.output:
+            args.output = shard_path(args.output, shard_index, shard_count)
+        for name in ('CDC_INDEX', 'CDC_EVENTS_FILE', 'FAILURES_LEDGER', 'DEVELOPERS_FEED', 'PROFILE_REPORT',
+                     'APPSTORE_DB_PATH', 'INCREMENTAL_INDEX', 'SITEMAP_CACHE', 'DEVELOPERS_INDEX', 'HTTPCACHE_DIR'):
+            # Empty paths disable their feature; the SQLite ones would otherwise
+            # serialize every worker on the same write lock
+            if settings.get(name):
+                settings.set(name, shard_path(settings.get(name), shard_index, shard_count), priority='cmdline')
+    
     # Create the job directory if it doesn't exist
     job_dir = settings.get('JOBDIR')
     if job_dir and not os.path.exists(job_dir):
@@ -65,30 +185,51 @@ def main():
     process = CrawlerProcess(settings)
     
     # Add the spider to the process with the specified output
+    crawler = process.create_crawler(spider_cls)
     process.crawl(
-        AppsSpider,
+        crawler,
         output_file=args.output,
         output_format=args.format
     )
     
     # Print minimal status message
+    output = args.output or settings.get('CDC_EVENTS_FILE')
     if args.resume:
-        print(f"Resuming previous crawl. Output: {args.output}")
+        print(f"Resuming previous crawl. Output: {output}")
     else:
-        print(f"Starting new crawl. Output: {args.output}")
+        print(f"Starting new crawl. Output: {output}")
     print("Press Ctrl+C once to pause the crawl.")
+    if settings.getbool('PROFILE_ENABLED') and settings.get('PROFILE_DUMP_SIGNAL'):
+        print(f"Profiling. To dump a profile without stopping the crawl, run: kill -{settings.get('PROFILE_DUMP_SIGNAL')[3:]} {os.getpid()}")
     
-    # Start the crawling process
-    try:
-        process.start(stop_after_crawl=False)  # Don't stop reactor after crawl
-    except KeyboardInterrupt:
-        # This should not be reached due to the signal handler, but just in case
-        print("\nCrawling paused. Run with --resume to continue.")
+    # Scrapy handles Ctrl+C itself: the first one shuts the crawl down gracefully
+    # (finish reason 'shutdown'), which saves the job directory; a second one forces it
+    process.start()
+    paused = crawler.stats.get_value('finish_reason') == 'shutdown'
+    
+    # Show where the time went
+    report_path = settings.get('PROFILE_REPORT')
+    if settings.getbool('PROFILE_ENABLED') and report_path and os.path.exists(report_path):
+        with open(report_path) as f:
+            print(f"Profile written to {report_path}:")
+            print(format_report(json.load(f), limit=10))
+    
+    # Tell what is left to retry
+    ledger_path = settings.get('FAILURES_LEDGER')
+    if ledger_path and os.path.exists(ledger_path) and not paused:
+        ledger = FailureLedger(ledger_path)
+        if len(ledger):
+            print(f"{len(ledger)} failed pages recorded in {ledger_path}:")
+            print(format_summary(ledger.summary()))
+            rerun = ' '.join(arg for arg in sys.argv[1:] if arg not in ('--retry-failed', '--resume'))
+            print(f"To re-crawl them, run: python {sys.argv[0]} {rerun} --retry-failed")
+        ledger.close()
     
     # If the spider was paused, print a message
-    if should_pause:
+    if paused:
+        rerun = ' '.join(arg for arg in sys.argv[1:] if arg != '--resume')
         print("\nCrawling paused. Run with --resume to continue.")
-        print(f"To resume, run: python {sys.argv[0]} --resume --output {args.output} --format {args.format}")
+        print(f"To resume, run: python {sys.argv[0]} {rerun} --resume")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,55 @@
+import json
+
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+
+from appstore_scraper.items import App
+from appstore_scraper.pipelines import ChangeCapturePipeline
+
+
+def crawl(tmp_path, app_ids, listing_incomplete=False, **settings):
+    """Run the pipeline over a crawl listing and scraping ``app_ids``, and return its stats."""
+    crawler = get_crawler(Spider, {
+        'CDC_ENABLED': True,
+        'CDC_INDEX': str(tmp_path / 'cdc.db'),
+        'CDC_EVENTS_FILE': str(tmp_path / 'events.jsonl'),
+        **settings,
+    })
+    spider = crawler._create_spider('apps')
+    spider.listing_incomplete = listing_incomplete
+    pipeline = ChangeCapturePipeline.from_crawler(crawler)
+    pipeline.open_spider(spider)
+    for app_id in app_ids:
+        pipeline.app_listed(app_id)
+        pipeline.process_item(App(url=f'/us/app/a/id{app_id}', name=f'App {app_id}'), spider)
+    pipeline.spider_closed(spider, 'finished')
+    return crawler.stats
+
+
+def deletes(tmp_path):
+    with open(tmp_path / 'events.jsonl', encoding='utf-8') as f:
+        return [event['app_id'] for event in map(json.loads, f) if event['op'] == 'delete']
+
+
+def test_unlisted_apps_are_deleted(tmp_path):
+    crawl(tmp_path, [1, 2, 3])
+    stats = crawl(tmp_path, [1, 2])
+    assert deletes(tmp_path) == [3]
+    assert stats.get_value('cdc/delete') == 1
+
+
+def test_no_deletes_when_the_listing_is_incomplete(tmp_path):
+    crawl(tmp_path, [1, 2, 3])
+    stats = crawl(tmp_path, [1, 2], listing_incomplete=True)
+    assert deletes(tmp_path) == []
+    assert stats.get_value('cdc/deletes_skipped') == 1
+    # The next complete run still deletes the app
+    crawl(tmp_path, [1, 2])
+    assert deletes(tmp_path) == [3]
+
+
+def test_no_deletes_in_retry_runs(tmp_path):
+    crawl(tmp_path, [1, 2, 3])
+    stats = crawl(tmp_path, [2], FAILURES_RETRY=True)
+    assert deletes(tmp_path) == []
+    assert stats.get_value('cdc/deletes_skipped') == 2
@@ -0,0 +1,87 @@
+import json
+import os
+import time
+
+import pytest
+import scrapy
+from scrapy import Request, Spider
+from scrapy.extensions.feedexport import FeedExporter
+from scrapy.utils.test import get_crawler
+from twisted.internet.defer import Deferred
+
+from appstore_scraper.checkpoint import QUEUE_DIR, CheckpointExtension, FeedBatches
+from appstore_scraper.squeues import SqliteQueueStore
+
+low, high = FeedBatches.VERSIONS
+known_scrapy = pytest.mark.skipif(
+    not low <= scrapy.version_info[:2] < high, reason=f'FeedBatches is only supported with Scrapy {low} to {high}',
+)
+
+
+@known_scrapy
+def test_feed_rotation_is_supported_by_installed_scrapy():
+    assert FeedBatches.rotation_supported()
+
+
+def test_feed_rotation_is_not_supported_by_other_versions(monkeypatch):
+    monkeypatch.setattr(scrapy, 'version_info', high + (0,))
+    assert not FeedBatches.rotation_supported()
+
+
+def test_feed_rotation_is_not_supported_with_other_signatures(monkeypatch):
+    monkeypatch.setattr(FeedExporter, '_close_slot', lambda self, slot: None)
+    assert not FeedBatches.rotation_supported()
+
+
+@known_scrapy
+def test_rotate_starts_a_new_batch_file(tmp_path):
+    crawler = get_crawler(Spider, {
+        'FEEDS': {str(tmp_path / 'part-%(batch_id)d.jsonl'): {'format': 'jsonlines'}},
+    })
+    spider = crawler._create_spider('apps')
+    exporter = FeedExporter.from_crawler(crawler)
+    exporter.open_spider(spider)
+    exporter.item_scraped({'id': 1}, spider)
+
+    batches = FeedBatches(exporter)
+    batches.slots = [batches.rotate(slot, spider) for slot in batches.slots]
+    exporter.item_scraped({'id': 2}, spider)
+    # Local files are closed synchronously, so this doesn't need a running reactor
+    Deferred.fromCoroutine(exporter.close_spider(spider))
+
+    assert sorted(os.listdir(tmp_path)) == ['part-1.jsonl', 'part-2.jsonl']
+    assert json.loads((tmp_path / 'part-1.jsonl').read_text()) == {'id': 1}
+    assert json.loads((tmp_path / 'part-2.jsonl').read_text()) == {'id': 2}
+
+
+def test_recover_restores_job_files_and_truncates_feeds(tmp_path):
+    feed = tmp_path / 'apps.jsonl'
+    feed.write_bytes(b'{"id": 1}\n{"id": 2}\n{"id": 3}\n')
+    part = tmp_path / 'part-2.parquet'
+    part.write_bytes(b'PAR1')
+    store = SqliteQueueStore(str(tmp_path / 'job' / QUEUE_DIR), 0, durable=True)
+    manifest = {
+        'seq': 4,
+        'created': time.time(),
+        'items': 2,
+        'requests': 1,
+        'feeds': {str(feed): len(b'{"id": 1}\n{"id": 2}\n'), str(part): 0},
+    }
+    request = Request('https://apps.apple.com/us/app/a/id3').to_dict()
+    store.save_checkpoint(manifest, {'requests.seen.ids': b'saved'}, [request])
+    store.conn.close()
+    (tmp_path / 'job' / 'requests.seen.ids').write_bytes(b'newer')
+
+    ext = CheckpointExtension(get_crawler(Spider), str(tmp_path / 'job'))
+
+    assert feed.read_bytes() == b'{"id": 1}\n{"id": 2}\n'
+    assert not part.exists()
+    assert (tmp_path / 'job' / 'requests.seen.ids').read_bytes() == b'saved'
+    assert [r['url'] for r in ext.requeue] == [request['url']]
+    assert ext.seq == 4
+    assert ext.recovery['feed_bytes_truncated'] == len(b'{"id": 3}\n') + 4
+
+
+def test_no_recovery_without_checkpoint(tmp_path):
+    ext = CheckpointExtension(get_crawler(Spider), str(tmp_path))
+    assert ext.recovery is None
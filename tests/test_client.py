@@ -0,0 +1,38 @@
+import asyncio
+
+from appstore_scraper.client import LookupService
+
+
+class StubClient:
+    def stats(self):
+        return {'lookups': 0}
+
+
+async def exchange(data):
+    server = await asyncio.start_server(LookupService(StubClient()).handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(data)
+    await writer.drain()
+    response = await asyncio.wait_for(reader.read(), 5)
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    return response
+
+
+def test_request_body_is_skipped_before_the_next_request():
+    response = asyncio.run(exchange(
+        b'POST /stats HTTP/1.1\r\nContent-Length: 11\r\n\r\nGET /nope\r\n'
+        b'GET /stats HTTP/1.1\r\nConnection: close\r\n\r\n'
+    ))
+    assert response.count(b'HTTP/1.1 200 OK') == 2
+    assert b'404' not in response
+
+
+def test_chunked_request_body_is_refused():
+    response = asyncio.run(exchange(
+        b'POST /stats HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n'
+    ))
+    assert response.startswith(b'HTTP/1.1 411 Length Required')
+    assert b'Connection: close' in response
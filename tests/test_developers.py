@@ -0,0 +1,53 @@
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+
+from appstore_scraper.developers import DeveloperIndex, feed_key
+from appstore_scraper.items import App, Developer
+from appstore_scraper.middlewares import DeveloperMiddleware
+
+
+def app(app_id, developer_id, name):
+    developer = {'data': [{'id': developer_id, 'attributes': {'name': name, 'url': None}}]}
+    return App(url=f'/us/app/a/id{app_id}', developer=developer)
+
+
+def run(tmp_path, feed, apps):
+    """Pass ``apps`` through the middleware as one crawl and return the developer ids it emits."""
+    crawler = get_crawler(Spider, {
+        'DEVELOPERS_FEED': str(feed),
+        'DEVELOPERS_INDEX': str(tmp_path / 'developers.db'),
+    })
+    spider = crawler._create_spider('apps')
+    mw = DeveloperMiddleware.from_crawler(crawler)
+    emitted = []
+    for output in mw.process_spider_output(None, apps, spider):
+        if isinstance(output, Developer):
+            mw.item_scraped(output, spider)
+            emitted.append(output.id)
+    # Stands in for the feed exporter
+    if emitted:
+        with open(feed, 'a', encoding='utf-8') as f:
+            f.write(''.join(f'{{"id": "{developer_id}"}}\n' for developer_id in emitted))
+    mw.spider_closed(spider)
+    return emitted
+
+
+def test_unchanged_developers_are_emitted_once(tmp_path):
+    feed = tmp_path / 'developers.jsonl'
+    assert run(tmp_path, feed, [app(1, '10', 'One'), app(2, '10', 'One'), app(3, '20', 'Two')]) == ['10', '20']
+    assert run(tmp_path, feed, [app(1, '10', 'One'), app(3, '20', 'Two, renamed')]) == ['20']
+
+
+def test_index_is_kept_per_feed(tmp_path):
+    run(tmp_path, tmp_path / 'developers.jsonl', [app(1, '10', 'One')])
+    assert run(tmp_path, tmp_path / 'other.jsonl', [app(1, '10', 'One')]) == ['10']
+
+
+def test_index_is_reset_when_the_feed_is_gone(tmp_path):
+    feed = tmp_path / 'developers.jsonl'
+    run(tmp_path, feed, [app(1, '10', 'One')])
+    feed.unlink()
+    assert run(tmp_path, feed, [app(1, '10', 'One')]) == ['10']
+    index = DeveloperIndex(str(tmp_path / 'developers.db'), feed_key(str(feed)))
+    assert len(index) == 1
+    index.close()
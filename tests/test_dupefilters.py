@@ -0,0 +1,44 @@
+from scrapy import Request
+from scrapy.utils.test import get_crawler
+
+from appstore_scraper.dupefilters import AppIdDupeFilter, SortedIdSet
+
+
+def make_filter(job_dir=None):
+    settings = {'REQUEST_FINGERPRINTER_IMPLEMENTATION': '2.7'}
+    if job_dir:
+        settings['JOBDIR'] = str(job_dir)
+    return AppIdDupeFilter.from_crawler(get_crawler(settings_dict=settings))
+
+
+def test_same_app_under_another_slug_is_seen():
+    df = make_filter()
+    assert not df.request_seen(Request('https://apps.apple.com/us/app/old-name/id123'))
+    assert df.request_seen(Request('https://apps.apple.com/gb/app/old-name/id123?l=en'))
+
+
+def test_redirect_to_renamed_app_is_not_seen():
+    df = make_filter()
+    original = 'https://apps.apple.com/us/app/old-name/id123'
+    assert not df.request_seen(Request(original))
+    redirected = Request('https://apps.apple.com/us/app/new-name/id123', meta={'redirect_urls': [original]})
+    assert not df.request_seen(redirected)
+
+
+def test_redirect_to_another_app_is_filtered_by_its_id():
+    df = make_filter()
+    assert not df.request_seen(Request('https://apps.apple.com/us/app/other/id456'))
+    redirected = Request(
+        'https://apps.apple.com/us/app/other/id456',
+        meta={'redirect_urls': ['https://apps.apple.com/us/app/old-name/id123']},
+    )
+    assert df.request_seen(redirected)
+
+
+def test_ids_are_saved_and_loaded(tmp_path):
+    df = make_filter(tmp_path)
+    df.request_seen(Request('https://apps.apple.com/us/app/a/id1'))
+    df.close('finished')
+    df = make_filter(tmp_path)
+    assert isinstance(df.ids, SortedIdSet)
+    assert df.request_seen(Request('https://apps.apple.com/us/app/a/id1'))
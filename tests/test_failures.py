@@ -0,0 +1,58 @@
+from scrapy import Request, Spider
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+
+from appstore_scraper.failures import HTTP, FailureLedger
+from appstore_scraper.middlewares import AppstoreScraperSpiderMiddleware, FailedDownloadMiddleware
+
+URL = 'https://apps.apple.com/us/app/a/id1'
+
+
+class AppsSpider(Spider):
+    name = 'apps'
+    start_urls = ['https://apps.apple.com/sitemaps_apps_index_app_1.xml']
+
+    def parse(self, response):
+        pass
+
+
+def open_crawl(ledger, **settings):
+    crawler = get_crawler(AppsSpider, {'FAILURES_LEDGER': str(ledger), 'FAILURES_BACKOFF': 0, **settings})
+    crawler.spider = crawler._create_spider()
+    return crawler
+
+
+def test_retry_failed_requests_the_failed_pages_and_resolves_them(tmp_path):
+    ledger = tmp_path / 'failures.db'
+
+    # A crawl where an app page fails with a 503
+    crawler = open_crawl(ledger)
+    downloader_mw = FailedDownloadMiddleware.from_crawler(crawler)
+    request = Request(URL, callback=crawler.spider.parse, meta={'lastmod': 1700000000.0})
+    downloader_mw.process_response(request, HtmlResponse(URL, status=503, request=request), crawler.spider)
+    FailureLedger.for_crawler(crawler).spider_closed(crawler.spider)
+    assert crawler.stats.get_value('failures/http') == 1
+
+    # --retry-failed only requests the ledger's entries
+    crawler = open_crawl(ledger, FAILURES_RETRY=True)
+    spider_mw = AppstoreScraperSpiderMiddleware.from_crawler(crawler)
+    requests = list(spider_mw.process_start_requests(crawler.spider.start_requests(), crawler.spider))
+    assert [r.url for r in requests] == [URL]
+    assert requests[0].callback == crawler.spider.parse
+    assert requests[0].meta['lastmod'] == 1700000000.0
+
+    # and removes them once they succeed
+    response = HtmlResponse(URL, body=b'<html></html>', request=requests[0])
+    list(spider_mw.process_spider_output(response, [], crawler.spider))
+    FailureLedger.for_crawler(crawler).spider_closed(crawler.spider)
+    assert crawler.stats.get_value('failures/resolved') == 1
+    assert len(FailureLedger(str(ledger))) == 0
+
+
+def test_failures_of_one_run_count_one_attempt(tmp_path):
+    ledger = FailureLedger(str(tmp_path / 'failures.db'))
+    assert ledger.record(URL, 'parse', None, HTTP, 503, now=100)
+    assert not ledger.record(URL, 'parse', None, HTTP, 503, now=101)
+    assert ledger.due(now=101, backoff=10) == ([], 0)
+    assert ledger.due(now=111, backoff=10) == ([(URL, 'parse', None)], 0)
+    ledger.close()
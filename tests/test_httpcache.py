@@ -0,0 +1,54 @@
+from scrapy import Request, Spider
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+
+from appstore_scraper.httpcache import AppCacheStorage
+
+URL = 'https://apps.apple.com/us/app/example/id123'
+PAGE = b'<html><head><script type="fastboot/shoebox" id="shoebox-media-api-cache-apps">{}</script></head></html>'
+
+
+def open_storage(tmp_path):
+    crawler = get_crawler(Spider, {
+        'HTTPCACHE_DIR': str(tmp_path),
+        'REQUEST_FINGERPRINTER_IMPLEMENTATION': '2.7',
+    })
+    crawler.spider = crawler._create_spider('apps')
+    crawler.stats.open_spider(crawler.spider)
+    storage = AppCacheStorage(crawler.settings)
+    storage.open_spider(crawler.spider)
+    return storage, crawler.spider
+
+
+def test_fields_are_stored_with_the_cached_page(tmp_path):
+    storage, spider = open_storage(tmp_path)
+    storage.store_response(spider, Request(URL), HtmlResponse(URL, body=PAGE))
+    size = storage.size
+    storage.store_fields(spider, Request(URL), {'name': 'Example', 'url': '/us/app/example/id123'})
+    assert storage.size > size
+
+    request = Request(URL)
+    response = storage.retrieve_response(spider, request)
+    assert response.body == PAGE
+    assert request.meta['httpcache_fields'] == {'name': 'Example', 'url': '/us/app/example/id123'}
+    storage.close_spider(spider)
+
+
+def test_storing_a_new_page_drops_the_fields(tmp_path):
+    storage, spider = open_storage(tmp_path)
+    storage.store_response(spider, Request(URL), HtmlResponse(URL, body=PAGE))
+    storage.store_fields(spider, Request(URL), {'name': 'Example'})
+    storage.store_response(spider, Request(URL), HtmlResponse(URL, body=PAGE))
+
+    request = Request(URL)
+    storage.retrieve_response(spider, request)
+    assert 'httpcache_fields' not in request.meta
+    assert storage.size == storage.conn.execute('SELECT SUM(size) FROM responses').fetchone()[0]
+    storage.close_spider(spider)
+
+
+def test_fields_of_uncached_pages_are_not_stored(tmp_path):
+    storage, spider = open_storage(tmp_path)
+    storage.store_fields(spider, Request(URL), {'name': 'Example'})
+    assert storage.retrieve_response(spider, Request(URL)) is None
+    storage.close_spider(spider)
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+from collections import deque
+
+import pytest
+from itemadapter import ItemAdapter
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+
+from appstore_scraper.extensions import AppAdapterExtension
+from appstore_scraper.items import ALL_FIELDS, App, AppAdapter, register_adapter, select_fields
+
+
+@pytest.fixture(autouse=True)
+def adapter_classes(monkeypatch):
+    # Start without the adapter and keep the registration from leaking into other tests
+    monkeypatch.setattr(ItemAdapter, 'ADAPTER_CLASSES', deque(c for c in ItemAdapter.ADAPTER_CLASSES if c is not AppAdapter))
+
+
+def test_importing_items_registers_nothing():
+    code = (
+        'from itemadapter import ItemAdapter\n'
+        'from appstore_scraper.items import AppAdapter\n'
+        'assert AppAdapter not in ItemAdapter.ADAPTER_CLASSES\n'
+    )
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+def test_extension_registers_the_adapter_once():
+    AppAdapterExtension.from_crawler(get_crawler(Spider))
+    register_adapter()
+    assert list(ItemAdapter.ADAPTER_CLASSES).count(AppAdapter) == 1
+
+    adapter = ItemAdapter(App({'name': 'Example', 'url': '/us/app/example/id1'}))
+    assert 'price' not in adapter
+    assert adapter.get('price') is None
+    assert dict(adapter) == {'name': 'Example', 'url': '/us/app/example/id1'}
+
+
+def test_select_fields():
+    assert select_fields(['price']) == ('price', 'url')
+    assert select_fields(['all']) == ALL_FIELDS
+    with pytest.raises(ValueError):
+        select_fields(['nope'])
@@ -0,0 +1,22 @@
+from appstore_scraper.metrics import Histogram
+
+
+def test_quantile_of_empty_histogram():
+    assert Histogram((0.1, 1.0)).quantile(0.99) is None
+
+
+def test_quantile_is_bucket_upper_bound():
+    histogram = Histogram((0.1, 1.0, 10.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(0.99) == 10.0
+
+
+def test_quantile_above_largest_bound_is_clamped():
+    histogram = Histogram((0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(30.0)
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.99) == 1.0
+    assert histogram.quantile(0) == 0.1
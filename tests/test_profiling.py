@@ -0,0 +1,38 @@
+from scrapy import Spider, signals
+from scrapy.utils.test import get_crawler
+
+from appstore_scraper.profiling import ProfilingExtension
+
+
+class Receiver:
+    def __init__(self, name, calls):
+        self.name = name
+        self.calls = calls
+
+    def item_scraped(self, item):
+        self.calls.append(self.name)
+
+
+def test_receivers_are_timed_in_their_order():
+    crawler = get_crawler(Spider, {'PROFILE_ENABLED': True, 'PROFILE_REPORT': ''})
+    calls = []
+    first, second = Receiver('first', calls), Receiver('second', calls)
+    crawler.signals.connect(first.item_scraped, signal=signals.item_scraped)
+    crawler.signals.connect(second.item_scraped, signal=signals.item_scraped)
+    ext = ProfilingExtension.from_crawler(crawler)
+    ext._time_receivers()
+
+    crawler.signals.send_catch_log(signals.item_scraped, item={})
+    assert calls == ['first', 'second']
+    assert ext.timings.report()['signal/item_scraped/Receiver.item_scraped']['calls'] == 2
+
+    crawler.signals.disconnect(first.item_scraped, signal=signals.item_scraped)
+    crawler.signals.send_catch_log(signals.item_scraped, item={})
+    assert calls == ['first', 'second', 'second']
+
+
+def test_instrumentation_is_limited_to_known_scrapy_versions(monkeypatch):
+    monkeypatch.setattr('scrapy.version_info', (2, 11, 2))
+    assert ProfilingExtension.instrumentation_supported()
+    monkeypatch.setattr('scrapy.version_info', (2, 13, 0))
+    assert not ProfilingExtension.instrumentation_supported()
@@ -0,0 +1,49 @@
+import json
+
+from appstore_scraper.sharding import merge_outputs, parse_shard, shard_for, shard_path
+
+
+def write_jsonlines(path, records):
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records), encoding='utf-8')
+    return str(path)
+
+
+def read_jsonlines(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_apps_are_merged_by_app_id(tmp_path):
+    paths = [
+        write_jsonlines(tmp_path / 'a.jsonl', [{'url': '/us/app/old-name/id1', 'name': 'Old'}, {'url': '/us/app/b/id2'}]),
+        write_jsonlines(tmp_path / 'b.jsonl', [{'url': '/us/app/new-name/id1', 'name': 'New'}]),
+    ]
+    written, duplicates = merge_outputs(paths, str(tmp_path / 'apps.jsonl'), 'jsonlines')
+    assert (written, duplicates) == (2, 1)
+    assert [r['name'] for r in read_jsonlines(tmp_path / 'apps.jsonl') if 'name' in r] == ['Old']
+
+
+def test_developers_are_merged_by_id(tmp_path):
+    # Developer records have no url to tell them apart by
+    paths = [
+        write_jsonlines(tmp_path / 'a.jsonl', [{'id': '10', 'name': 'One'}, {'id': '20', 'name': 'Two'}]),
+        write_jsonlines(tmp_path / 'b.jsonl', [{'id': '30', 'name': 'Three'}, {'id': '10', 'name': 'One, renamed'}]),
+    ]
+    output = str(tmp_path / 'developers.jsonl')
+    written, duplicates = merge_outputs(paths, output, 'jsonlines', keep_last=True, key='id')
+    assert (written, duplicates) == (3, 1)
+    assert {r['id']: r['name'] for r in read_jsonlines(output)} == {'10': 'One, renamed', '20': 'Two', '30': 'Three'}
+
+
+def test_json_outputs_of_resumed_crawls_are_merged(tmp_path):
+    path = tmp_path / 'apps.json'
+    path.write_text('[\n{"url": "/us/app/a/id1"}\n][\n{"url": "/us/app/b/id2"}\n]', encoding='utf-8')
+    output = tmp_path / 'merged.json'
+    assert merge_outputs([str(path)], str(output), 'json') == (2, 0)
+    assert len(json.loads(output.read_text(encoding='utf-8'))) == 2
+
+
+def test_shards():
+    assert parse_shard('1/4') == (1, 4)
+    assert shard_path('apps.jsonl', 1, 4) == 'apps.shard-1-of-4.jsonl'
+    assert shard_for('/us/app/a/id1', 4) == shard_for('/gb/app/b/id1?l=en', 4)
@@ -0,0 +1,37 @@
+from appstore_scraper.sitemapcache import ShardCache
+
+URL = 'https://apps.apple.com/sitemaps_apps_1_1.xml.gz'
+LASTMOD = '2024-05-01'
+
+
+def cache_shard(cache, chunks, now=1000):
+    cache.begin(URL)
+    for chunk in chunks:
+        cache.add(URL, chunk)
+    cache.finish(URL, LASTMOD, now=now)
+
+
+def test_shard_is_replayed_a_chunk_at_a_time(tmp_path):
+    cache = ShardCache(str(tmp_path / 'sitemap.db'))
+    chunks = [[{'loc': 'https://apps.apple.com/us/app/a/id1'}], [{'loc': 'https://apps.apple.com/us/app/b/id2'}]]
+    cache_shard(cache, chunks)
+    assert list(cache.get(URL, LASTMOD, now=1000)) == chunks
+    assert cache.get(URL, '2024-05-02', now=1000) is None
+    assert cache.get(URL, None, now=1000) is None
+
+
+def test_unfinished_shard_is_not_replayed(tmp_path):
+    cache = ShardCache(str(tmp_path / 'sitemap.db'))
+    cache_shard(cache, [[{'loc': 'https://apps.apple.com/us/app/a/id1'}]])
+    cache.begin(URL)
+    cache.add(URL, [{'loc': 'https://apps.apple.com/us/app/b/id2'}])
+    cache.discard(URL)
+    assert cache.get(URL, LASTMOD, now=1000) is None
+    assert len(cache) == 0
+
+
+def test_old_shard_is_downloaded_again(tmp_path):
+    cache = ShardCache(str(tmp_path / 'sitemap.db'), max_age=60)
+    cache_shard(cache, [[{'loc': 'https://apps.apple.com/us/app/a/id1'}]])
+    assert cache.get(URL, LASTMOD, now=1030) is not None
+    assert cache.get(URL, LASTMOD, now=1100) is None